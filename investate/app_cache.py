@@ -0,0 +1,129 @@
+"""
+Keyed result cache with background computation for the streamlit apps. Identical inputs return instantly from the
+cache, shared by all the sessions of the app since streamlit runs them in threads of the same process. New inputs
+are computed in a pool of worker threads, only once even if several sessions ask for them at the same time.
+The results expire after max_age seconds, so that the data fetched by the apps keeps being updated, and failed
+computations are not kept: they are tried again at the next request.
+The last result displayed is specific to each session, so it is kept in st.session_state, not here: the app can
+show it while the new one is computed.
+
+Example of use in an app:
+
+    future = APP_CACHE.submit(('house_vs_stock', *inputs), lambda: compute_df(*inputs))
+    placeholder = st.empty()
+    if not future.done() and 'house' in st.session_state:
+        placeholder.line_chart(st.session_state['house'])  # stale while updating
+    st.session_state['house'] = future.result()
+    placeholder.line_chart(st.session_state['house'])
+"""
+
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from investate.memo import ArrayMemo, Uncacheable
+
+# the age in seconds after which a result is computed again, as for the quandl cache
+DFLT_APP_CACHE_MAX_AGE = 15 * 60
+
+
+class BackgroundCache:
+    """
+    Compute results in the background, keeping them in memo (an ArrayMemo) keyed by their key_parts, for
+    max_age seconds (forever if max_age is None)
+
+    >>> cache = BackgroundCache(max_workers=1)
+    >>> future = cache.submit(('square', 3), lambda: 3 ** 2)
+    >>> future.result()
+    9
+    >>> cache.submit(('square', 3), lambda: 1 / 0).result()  # from the cache, not computed again
+    9
+
+    Failures are not kept
+
+    >>> calls = []
+    >>> def flaky_fetch():
+    ...     calls.append(None)
+    ...     if len(calls) == 1:
+    ...         raise ConnectionError('transient')
+    ...     return len(calls)
+    >>> cache.submit(('fetch',), flaky_fetch).exception()
+    ConnectionError('transient')
+    >>> cache.get(('fetch',), flaky_fetch)
+    2
+
+    and expired results are computed again
+
+    >>> cache = BackgroundCache(max_workers=1, max_age=0)
+    >>> cache.get(('now',), lambda: 1), cache.get(('now',), lambda: 2)
+    (1, 2)
+    """
+
+    def __init__(self, memo=None, max_workers=2, max_age=DFLT_APP_CACHE_MAX_AGE):
+        self.memo = memo if memo is not None else ArrayMemo(max_bytes=512 * 2 ** 20)
+        self.max_age = max_age
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='investate_app'
+        )
+        self._lock = threading.Lock()
+        # the futures of the computations going on, per key
+        self._pending = {}
+        # the time at which the result of each key was computed
+        self._computed_at = {}
+
+    def _is_fresh(self, key):
+        computed_at = self._computed_at.get(key)
+        return computed_at is not None and (
+            self.max_age is None or time.time() - computed_at < self.max_age
+        )
+
+    def _forget_pending(self, key, future):
+        with self._lock:
+            # unless a new computation of the key replaced it
+            if self._pending.get(key) is future:
+                del self._pending[key]
+
+    def _compute(self, key_parts, key, compute):
+        """Compute the result in a worker, the memo only keeping it if compute() does not raise"""
+        result = self.memo.get_or_compute(key_parts, compute)
+        if key is not None:
+            self._computed_at[key] = time.time()
+        return result
+
+    def submit(self, key_parts, compute):
+        """
+        A future of the result for key_parts: already done if it is cached, otherwise computing it with compute()
+        in a worker, or the future of the same computation if another caller already started it
+        """
+        try:
+            key = self.memo.make_key(key_parts)
+        except Uncacheable:
+            key = None
+
+        if key is not None and key_parts in self.memo:
+            if self._is_fresh(key):
+                future = Future()
+                future.set_result(self.memo.get_or_compute(key_parts, compute))
+                return future
+            self.memo.discard(key_parts)
+
+        with self._lock:
+            future = self._pending.get(key) if key is not None else None
+            # a failed computation may still be pending for a moment, it must not be reused
+            is_new = future is None or (future.done() and future.exception() is not None)
+            if is_new:
+                future = self._executor.submit(self._compute, key_parts, key, compute)
+                if key is not None:
+                    self._pending[key] = future
+        if is_new and key is not None:
+            # outside of the lock, since the callback runs right away if the future is already done
+            future.add_done_callback(lambda done: self._forget_pending(key, done))
+        return future
+
+    def get(self, key_parts, compute):
+        """The result for key_parts, blocking until it is computed"""
+        return self.submit(key_parts, compute).result()
+
+
+# the cache shared by the apps
+APP_CACHE = BackgroundCache()
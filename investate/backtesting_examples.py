@@ -103,6 +103,37 @@ def invest_with_sma(chk_size_1, chk_size_2, thres_invest=0.5, thresh_devest=0.5)
     return invest_func
 
 
+def sma_strategy_total(series, chk_size_1, chk_size_2):
+    """
+    Value at the end of the series of 1 unit invested with the invest_with_sma strategy (the alternative
+    investment being saving at 0% APR), together with the value of 1 unit simply held in the series over the same
+    period, i.e. starting at the first value of the cut_series of get_comp_ma
+
+    >>> total, held = sma_strategy_total([1, 1.6, 2.9, 4.1, 3.2, 2.3, 1.2, 2.2, 3.1, 4.4], 2, 3)
+    >>> round(float(total), 4), round(float(held), 4)
+    (1.454, 1.5172)
+    """
+    stat_dict = get_comp_ma(series, chk_size_1=chk_size_1, chk_size_2=chk_size_2)
+    cut_series = stat_dict['cut_series']
+    invest_func = invest_with_sma(chk_size_1=chk_size_1, chk_size_2=chk_size_2)
+    invest_period = np.array(list(invest_func(series)))
+
+    period_rate_A = values_to_percent_growth(cut_series)
+    period_rate_B = [0] * len(cut_series)
+
+    val_A, val_B = investment_over_period(
+        period_rates_A=period_rate_A,
+        period_rates_B=period_rate_B,
+        fees_func_AB=None,
+        period_end_balance=invest_period,
+        initial_investment_A=1,
+        initial_investment_B=0,
+    )
+
+    total = np.array(val_A) + np.array(val_B)
+    return total[-1], cut_series[-1] / cut_series[0]
+
+
 def parameter_grid_search(series, max_chk_size):
     """
     Quick function to visualize the relative benefit of each pair of ma values
@@ -113,32 +144,9 @@ def parameter_grid_search(series, max_chk_size):
 
     for (chk_size_1, chk_size_2) in product(chk_sizes, chk_sizes):
         if chk_size_2 > chk_size_1:
-            stat_dict = get_comp_ma(
-                series, chk_size_1=chk_size_1, chk_size_2=chk_size_2
-            )
-            stat_series_1, stat_series_2, cut_series = (
-                stat_dict['stat_series_1'],
-                stat_dict['stat_series_2'],
-                stat_dict['cut_series'],
-            )
-            invest_func = invest_with_sma(chk_size_1=chk_size_1, chk_size_2=chk_size_2)
-            invest_period = np.array(list(invest_func(series)))
-
-            period_rate_A = values_to_percent_growth(cut_series)
-            period_rate_B = [0] * len(cut_series)
-
-            val_A, val_B = investment_over_period(
-                period_rates_A=period_rate_A,
-                period_rates_B=period_rate_B,
-                fees_func_AB=None,
-                period_end_balance=invest_period,
-                initial_investment_A=1,
-                initial_investment_B=0,
-            )
-
-            total = np.array(val_A) + np.array(val_B)
-            mat[chk_size_1, chk_size_2] = total[-1]
-            all_return.append(cut_series[-1] / cut_series[0])
+            total, held = sma_strategy_total(series, chk_size_1, chk_size_2)
+            mat[chk_size_1, chk_size_2] = total
+            all_return.append(held)
     return np.mean(all_return), mat[1:, 1:]
 
 
@@ -0,0 +1,361 @@
+"""
+Benchmarks of the core numerical routines of investate on deterministic synthetic data, at several data sizes.
+Each run records the wall time and the peak memory of every benchmark, is appended to a json history and can be
+compared to a stored baseline, the comparison failing loudly when a benchmark got slower or hungrier than
+the baseline by more than a tolerance.
+
+Example of use, from the command line:
+
+    python -m investate.benchmarks --profile small --save-baseline
+    python -m investate.benchmarks --profile small  # exits with an error if anything regressed
+
+or from python:
+
+    results = run_benchmarks('small')
+    regressions = compare_to_baseline(results, load_baseline(DFLT_BASELINE_PATH)['small'])
+"""
+
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from investate.synthetic_series import gbm_paths, generate_in_chunks
+
+DFLT_BENCHMARK_DIR = os.path.join(os.path.expanduser('~'), 'invest', 'benchmarks')
+DFLT_HISTORY_PATH = os.path.join(DFLT_BENCHMARK_DIR, 'history.json')
+DFLT_BASELINE_PATH = os.path.join(DFLT_BENCHMARK_DIR, 'baseline.json')
+
+# the size of the data of each profile: the number of points of the series and the number of tickers
+PROFILES = {
+    'tiny': {'n_points': 1000, 'n_tickers': 1},
+    'small': {'n_points': 10000, 'n_tickers': 10},
+    'medium': {'n_points': 1000000, 'n_tickers': 500},
+    'large': {'n_points': 10000000, 'n_tickers': 5000},
+}
+
+# a benchmark is a setup function of (n_points, n_tickers, tmp_dir) returning the function to time, with caps on the sizes
+# so that the pure python routines run in a reasonable time on the largest profiles
+Benchmark = namedtuple('Benchmark', ['name', 'setup', 'max_points', 'max_tickers'])
+
+
+def synthetic_prices(n_points, n_tickers=1, seed=0, start_price=100.0, volatility=0.01):
+    """
+    Deterministic geometric brownian motions (see synthetic_series.gbm_paths), one per ticker
+
+    :return: an array of shape (n_points, n_tickers)
+
+    >>> prices = synthetic_prices(5, 2)
+    >>> prices.shape
+    (5, 2)
+    >>> bool((synthetic_prices(5, 2) == prices).all())
+    True
+    """
+    return gbm_paths(n_tickers, n_points, sigma=volatility, s0=start_price, seed=seed).T
+
+
+def _setup_values_of_series_of_invest(n_points, n_tickers, tmp_dir):
+    from investate.series_utils import values_of_series_of_invest, values_to_percent_growth
+
+    rates = values_to_percent_growth(synthetic_prices(n_points + 1)[:, 0])
+    amounts = [1.0] * n_points
+    return lambda: values_of_series_of_invest(rates, amounts)
+
+
+def _setup_investment_over_period(n_points, n_tickers, tmp_dir):
+    from investate.series_utils import investment_over_period, values_to_percent_growth
+
+    rates_A = values_to_percent_growth(synthetic_prices(n_points + 1)[:, 0])
+    rates_B = [0.0] * n_points
+    balance = np.random.default_rng(1).integers(0, 2, n_points).tolist()
+    return lambda: investment_over_period(rates_A, rates_B, balance)
+
+
+def _setup_moving_stats(n_points, n_tickers, tmp_dir):
+    from investate.features import moving_stats
+
+    series = synthetic_prices(n_points)[:, 0]
+    return lambda: moving_stats(series, chk_size=30)
+
+
+def _setup_get_aligned_ma(n_points, n_tickers, tmp_dir):
+    from investate.features import get_aligned_ma
+
+    series = synthetic_prices(n_points)[:, 0].tolist()
+    return lambda: get_aligned_ma(series, (5, 20, 50), [np.mean] * 3)
+
+
+def _setup_parameter_grid_search(n_points, n_tickers, tmp_dir):
+    from investate.backtesting_examples import parameter_grid_search
+    from investate.moving_average import MA_MEMO
+
+    series = synthetic_prices(n_points)[:, 0]
+
+    def grid_search():
+        # start cold, the memo would otherwise make every repeat but the first one faster
+        MA_MEMO.clear()
+        return parameter_grid_search(series, max_chk_size=15)
+
+    return grid_search
+
+
+def _setup_house_investment(n_points, n_tickers, tmp_dir):
+    from investate.real_estate_vs_stock import house_investment
+
+    house_costs = np.linspace(100000, 1000000, n_tickers)
+    return lambda: [house_investment(house_cost=cost, plot=False) for cost in house_costs]
+
+
+def _prices_df(n_points, n_tickers):
+    return pd.DataFrame(
+        synthetic_prices(n_points, n_tickers),
+        index=pd.date_range('2000-01-01', periods=n_points, freq='min'),
+        columns=[f'TICK{i}' for i in range(n_tickers)],
+    )
+
+
+def _setup_pickle_cache_write(n_points, n_tickers, tmp_dir):
+    from investate.file_utils import pickle_dump
+
+    df = _prices_df(n_points, n_tickers)
+    path = os.path.join(tmp_dir, 'prices.p')
+    return lambda: pickle_dump(df, path)
+
+
+def _setup_pickle_cache_read(n_points, n_tickers, tmp_dir):
+    from investate.file_utils import pickle_dump, pickle_load
+
+    path = os.path.join(tmp_dir, 'prices.p')
+    pickle_dump(_prices_df(n_points, n_tickers), path)
+    return lambda: pickle_load(path)
+
+
+def _setup_tick_cache_read(n_points, n_tickers, tmp_dir):
+    from investate.quandl_data import fetch_tick_and_cache
+
+    df = _prices_df(n_points, 1)
+    cache_dir = os.path.join(tmp_dir, 'cache')
+    fetch = lambda tick, **kwargs: df
+    fetch_tick_and_cache('BENCH/TICK', cache_dir=cache_dir, fetch_func=fetch)
+    return lambda: fetch_tick_and_cache('BENCH/TICK', cache_dir=cache_dir, fetch_func=fetch)
+
+
+def _setup_memo_disk_read(n_points, n_tickers, tmp_dir):
+    from investate.memo import ArrayMemo
+    from investate.moving_average import cached_moving_stats
+
+    series = synthetic_prices(n_points)[:, 0]
+    cache_dir = os.path.join(tmp_dir, 'cache')
+    cached_moving_stats(series, 30, memo=ArrayMemo(cache_dir=cache_dir))
+
+    # a fresh memo each time, so that the stats come from the disk tier
+    return lambda: cached_moving_stats(series, 30, memo=ArrayMemo(cache_dir=cache_dir))
+
+
+def _setup_generate_in_chunks(n_points, n_tickers, tmp_dir):
+    # the final values of n_tickers paths, generated by chunks of bounded memory
+    return lambda: [
+        chunk[:, -1]
+        for chunk in generate_in_chunks(gbm_paths, n_tickers, n_points, dtype=np.float32, seed=0)
+    ]
+
+
+def _setup_panel_returns(n_points, n_tickers, tmp_dir):
+    from investate.series_utils import panel_returns
+
+    prices = synthetic_prices(n_points, n_tickers)
+    # the returns are written into the same float32 buffer at every call
+    buffer = np.empty((n_points - 1, n_tickers), dtype=np.float32)
+    return lambda: panel_returns(prices, out=buffer)
+
+
+def _setup_total_return_index(n_points, n_tickers, tmp_dir):
+    from investate.regular_stock_invest import total_return_index
+
+    prices = _prices_df(n_points, n_tickers)
+    # a quarterly dividend of 0.5% of the price
+    dividends = prices.iloc[::63] * 0.005
+    return lambda: total_return_index(prices, dividends)
+
+
+BENCHMARKS = [
+    Benchmark('values_of_series_of_invest', _setup_values_of_series_of_invest, 10000000, 1),
+    Benchmark('investment_over_period', _setup_investment_over_period, 1000000, 1),
+    Benchmark('moving_stats', _setup_moving_stats, 200000, 1),
+    Benchmark('get_aligned_ma', _setup_get_aligned_ma, 100000, 1),
+    Benchmark('parameter_grid_search', _setup_parameter_grid_search, 2000, 1),
+    Benchmark('house_investment', _setup_house_investment, 1, 500),
+    Benchmark('pickle_cache_write', _setup_pickle_cache_write, 100000, 200),
+    Benchmark('pickle_cache_read', _setup_pickle_cache_read, 100000, 200),
+    Benchmark('tick_cache_read', _setup_tick_cache_read, 1000000, 1),
+    Benchmark('memo_disk_read', _setup_memo_disk_read, 200000, 1),
+    Benchmark('generate_in_chunks', _setup_generate_in_chunks, 10000000, 5000),
+    Benchmark('panel_returns', _setup_panel_returns, 100000, 5000),
+    Benchmark('total_return_index', _setup_total_return_index, 100000, 500),
+]
+
+
+def measure(func, repeat=3):
+    """
+    Best wall time over repeat calls of func, and peak memory allocated by a separate call of func.
+    The memory is traced separately since tracing slows down the calls.
+
+    :return: a dict with the seconds and the peak_bytes
+
+    >>> sorted(measure(lambda: np.ones(1000), repeat=2))
+    ['peak_bytes', 'seconds']
+    """
+    times = []
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - tic)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': min(times), 'peak_bytes': peak}
+
+
+def run_benchmarks(profile='small', names=None, repeat=3, verbose=False):
+    """
+    Run the benchmarks (all of them, or those in names) on the data sizes of the profile
+
+    :return: a dict from the names of the benchmarks to their measure, with the sizes actually used
+    """
+    sizes = PROFILES[profile]
+    results = {}
+    for benchmark in BENCHMARKS:
+        if names is not None and benchmark.name not in names:
+            continue
+        n_points = min(sizes['n_points'], benchmark.max_points)
+        n_tickers = min(sizes['n_tickers'], benchmark.max_tickers)
+        # the files written by the cache benchmarks go to a temporary dir
+        with tempfile.TemporaryDirectory(prefix='investate_bench_') as tmp_dir:
+            func = benchmark.setup(n_points, n_tickers, tmp_dir)
+            result = measure(func, repeat=repeat)
+        result.update(n_points=n_points, n_tickers=n_tickers)
+        results[benchmark.name] = result
+        if verbose:
+            print(
+                f"{benchmark.name:<30}{result['seconds']:>12.4f}s{result['peak_bytes'] / 2 ** 20:>12.1f}MB"
+                f'   ({n_points} points, {n_tickers} tickers)'
+            )
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance=0.25, min_seconds=0.001):
+    """
+    List the regressions of results with respect to baseline: the benchmarks, run on the same sizes, whose time or
+    peak memory exceeds the baseline one by more than tolerance (as a fraction of the baseline).
+    Times under min_seconds are too noisy to be compared.
+
+    :return: a list of (name, metric, baseline value, current value)
+
+    >>> baseline = {'moving_stats': {'seconds': 1.0, 'peak_bytes': 1000, 'n_points': 10, 'n_tickers': 1}}
+    >>> results = {'moving_stats': {'seconds': 1.5, 'peak_bytes': 1100, 'n_points': 10, 'n_tickers': 1}}
+    >>> compare_to_baseline(results, baseline)
+    [('moving_stats', 'seconds', 1.0, 1.5)]
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None or (base['n_points'], base['n_tickers']) != (
+            result['n_points'],
+            result['n_tickers'],
+        ):
+            continue
+        for metric in 'seconds', 'peak_bytes':
+            if metric == 'seconds' and base[metric] < min_seconds:
+                continue
+            if result[metric] > base[metric] * (1 + tolerance):
+                regressions.append((name, metric, base[metric], result[metric]))
+    return regressions
+
+
+def _load_json(path, default):
+    if not os.path.isfile(path):
+        return default
+    with open(path) as infile:
+        return json.load(infile)
+
+
+def _dump_json(obj, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as outfile:
+        json.dump(obj, outfile, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_baseline(path=DFLT_BASELINE_PATH):
+    """The stored baseline: a dict from profile to the results of run_benchmarks"""
+    return _load_json(path, {})
+
+
+def append_to_history(results, profile, path=DFLT_HISTORY_PATH):
+    """Append the results of a run, with the time and the versions of the environment, to the json history"""
+    history = _load_json(path, [])
+    history.append(
+        {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'profile': profile,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'results': results,
+        }
+    )
+    _dump_json(history, path)
+
+
+def main(args=None):
+    """Command line entry point, see the module docstring"""
+    parser = argparse.ArgumentParser(description='Benchmark the core routines of investate')
+    parser.add_argument('--profile', default='small', choices=sorted(PROFILES))
+    parser.add_argument('--names', nargs='*', help='only run these benchmarks')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--history', default=DFLT_HISTORY_PATH)
+    parser.add_argument('--baseline', default=DFLT_BASELINE_PATH)
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument(
+        '--save-baseline',
+        action='store_true',
+        help='store the results as the baseline of the profile instead of comparing to it',
+    )
+    args = parser.parse_args(args)
+
+    results = run_benchmarks(args.profile, args.names, args.repeat, verbose=True)
+    append_to_history(results, args.profile, args.history)
+
+    baselines = load_baseline(args.baseline)
+    if args.save_baseline:
+        baselines[args.profile] = {**baselines.get(args.profile, {}), **results}
+        _dump_json(baselines, args.baseline)
+        print(f'Baseline of profile {args.profile} saved to {args.baseline}')
+        return
+
+    regressions = compare_to_baseline(
+        results, baselines.get(args.profile, {}), args.tolerance
+    )
+    for name, metric, base_value, value in regressions:
+        print(f'REGRESSION {name}: {metric} went from {base_value:.6g} to {value:.6g}')
+    if regressions:
+        raise SystemExit(
+            f'{len(regressions)} regression(s) beyond {args.tolerance:.0%} of the baseline'
+        )
+
+
+if __name__ == '__main__':
+    main()
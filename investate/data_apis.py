@@ -9,6 +9,7 @@ import robin_stocks.robinhood as r
 import pandas_datareader as pdr
 
 import pandas as pd
+from investate.instrumentation import timed, add_counts, file_size
 
 def mkdir_if_missing(folder_path):
     if not os.path.exists(folder_path):
@@ -96,6 +97,7 @@ def normalize_to_utc_pd_timestamp(date):
 # TODO: figure out why an index column is created and remove that, it is annoying
 allowed_suffix = ['_daily', '_1min', '_5min', '_yearly']
 
+@timed(count_records=len)
 def fetch_data_and_cache(ticker,
                          start,
                          end,
@@ -139,6 +141,7 @@ def fetch_data_and_cache(ticker,
 
     if ticker_and_freq_str in existing_tickers_and_freq_str:
         ticker_df = pd.read_csv(path_to_csv, parse_dates=['date'], date_parser=normalize_to_utc_pd_timestamp)
+        add_counts(bytes_read=file_size(path_to_csv))
 
         ts_existing_start = ticker_df['date'].iloc[0]
         ts_existing_end = ticker_df['date'].iloc[-1]
@@ -149,6 +152,11 @@ def fetch_data_and_cache(ticker,
         left_query = (ts_new_start, ts_existing_start)
         right_query = (ts_existing_end, ts_new_end)
 
+        # the cache is hit if it already covers the whole range of the query
+        if len(set(left_query)) == 1 and len(set(right_query)) == 1:
+            add_counts(cache_hits=1)
+        else:
+            add_counts(cache_misses=1)
         for i, query in enumerate([left_query, right_query]):
             if len(set(query)) == 2:
                 ts_start, ts_end = query
@@ -170,6 +178,7 @@ def fetch_data_and_cache(ticker,
                 ticker_df.reset_index(inplace=True, drop=True)
 
     else:
+        add_counts(cache_misses=1)
         ticker_df = fetch_func(ticker,
                                start=start,
                                end=end,
@@ -184,6 +193,7 @@ def fetch_data_and_cache(ticker,
         ticker_df.reset_index(inplace=True, drop=True)
 
     ticker_df.to_csv(path_to_csv, index=False)
+    add_counts(bytes_written=file_size(path_to_csv))
     return ticker_df
 
 
@@ -1,5 +1,6 @@
 from collections import defaultdict
 import numpy as np
+import pandas as pd
 
 
 class divide_by_first:
@@ -53,21 +54,199 @@ def get_dates_overlap(dfs, date_col_names='date'):
     return date_overlap
 
 
-def date_align_dfs(dfs, date_col_names='date'):
+def dates_to_int64(dates):
     """
-    Return the sub-dfs of the dfs where only the common dates are kept. This is intended to use with dfs
-    which have slightly different dates, typically holidays for one exchange that wasn't one for another
+    View a sequence of dates as an array of int64 nanoseconds since the epoch, without boxing each date
+    into a Timestamp. Timezone aware dates are taken in UTC.
+
+    >>> dates_to_int64(pd.Series(pd.to_datetime(['1970-01-01', '1970-01-02']))).tolist()
+    [0, 86400000000000]
+    """
+    return np.asarray(pd.Series(dates).to_numpy(dtype='datetime64[ns]')).view('int64')
+
+
+def int64_to_dates(values, tz=None):
+    """
+    Inverse of dates_to_int64, tz being the timezone of the dates to return, if any
+
+    >>> int64_to_dates(np.array([0, 86400000000000]))
+    DatetimeIndex(['1970-01-01', '1970-01-02'], dtype='datetime64[ns]', freq=None)
+    """
+    dates = pd.DatetimeIndex(np.asarray(values, dtype='int64').view('datetime64[ns]'))
+    if tz is not None:
+        dates = dates.tz_localize('UTC').tz_convert(tz)
+    return dates
+
+
+def sorted_intersection(sorted_arrays):
+    """
+    Intersection of several sorted arrays of unique values, merging them two at a time with searchsorted.
+    The running intersection only shrinks, so each merge costs O(len(running) * log(len(array))).
+
+    >>> sorted_intersection([np.array([1, 2, 3, 5]), np.array([2, 3, 4, 5]), np.array([0, 3, 5])])
+    array([3, 5])
+    """
+    # start from the smallest array, the intersection can't be larger than it
+    sorted_arrays = sorted(sorted_arrays, key=len)
+    common = sorted_arrays[0]
+    for arr in sorted_arrays[1:]:
+        if len(common) == 0 or len(arr) == 0:
+            return common[:0]
+        pos = np.searchsorted(arr, common).clip(max=len(arr) - 1)
+        common = common[arr[pos] == common]
+    return common
+
+
+def sorted_union(sorted_arrays):
+    """
+    Union of several sorted arrays of unique values, merging them two at a time
+
+    >>> sorted_union([np.array([1, 3]), np.array([2, 3, 4]), np.array([0])])
+    array([0, 1, 2, 3, 4])
+    """
+    union = sorted_arrays[0]
+    for arr in sorted_arrays[1:]:
+        if len(union) == 0:
+            union = arr
+            continue
+        # positions of the values of arr not already in the union, then a single insert
+        pos = np.searchsorted(union, arr)
+        is_new = (pos == len(union)) | (union[pos.clip(max=len(union) - 1)] != arr)
+        union = np.insert(union, pos[is_new], arr[is_new])
+    return union
+
+
+def _sorted_dates_and_order(dates):
+    """Sort the int64 dates if needed, returning them together with the sorting positions (or None if sorted)"""
+    if len(dates) < 2 or np.all(dates[1:] >= dates[:-1]):
+        return dates, None
+    order = np.argsort(dates, kind='stable')
+    return dates[order], order
+
+
+def date_align_indexers(dfs, date_col_names='date', how='inner'):
+    """
+    Compute the common dates of the dfs together with, for each df, the positional indexer of its rows on
+    those dates. The dates are handled as int64 nanoseconds and merged with searchsorted on sorted arrays,
+    no sets of Timestamp are built.
+
+    :param dfs: list of dataframes
+    :param date_col_names: a single common date column name or a list of such name of same length as dfs
+    :param how: 'inner' to keep only the dates common to all dfs, 'outer' to keep all the dates (the indexer
+                being -1 when a df is missing a date) or 'asof' to keep all the dates, each df pointing to its
+                last row at or before the date (forward fill, -1 before its first date)
+    :return: the int64 dates and a list of int64 positional indexers, one per df
+
+    >>> dfs = [pd.DataFrame({'date': pd.to_datetime(['2020-01-01', '2020-01-02', '2020-01-04'])}),
+    ...        pd.DataFrame({'date': pd.to_datetime(['2020-01-02', '2020-01-03', '2020-01-04'])})]
+    >>> dates, indexers = date_align_indexers(dfs, how='inner')
+    >>> int64_to_dates(dates).strftime('%m-%d').tolist(), [i.tolist() for i in indexers]
+    (['01-02', '01-04'], [[1, 2], [0, 2]])
+    >>> dates, indexers = date_align_indexers(dfs, how='outer')
+    >>> [i.tolist() for i in indexers]
+    [[0, 1, -1, 2], [-1, 0, 1, 2]]
+    >>> dates, indexers = date_align_indexers(dfs, how='asof')
+    >>> [i.tolist() for i in indexers]
+    [[0, 1, 1, 2], [-1, 0, 1, 2]]
     """
 
+    assert how in ('inner', 'outer', 'asof'), "how must be one of 'inner', 'outer' or 'asof'"
     if isinstance(date_col_names, str):
         date_col_names = [date_col_names] * len(dfs)
     else:
         assert len(dfs) == len(date_col_names), "You must provide a single common date" \
                                                 " column name or a list of such name of same length as dfs"
-    dates_overlap = get_dates_overlap(dfs, date_col_names)
+
+    sorted_dates_and_orders = [_sorted_dates_and_order(dates_to_int64(df[date_col_name]))
+                               for df, date_col_name in zip(dfs, date_col_names)]
+    # duplicated dates within a df are only counted once in the common dates
+    unique_dates = [dates[np.r_[True, dates[1:] != dates[:-1]]] if len(dates) else dates
+                    for dates, _ in sorted_dates_and_orders]
+    if how == 'inner':
+        common_dates = sorted_intersection(unique_dates)
+    else:
+        common_dates = sorted_union(unique_dates)
+
+    indexers = []
+    for dates, order in sorted_dates_and_orders:
+        if how == 'asof':
+            pos = np.searchsorted(dates, common_dates, side='right') - 1
+            found = pos >= 0
+        else:
+            pos = np.searchsorted(dates, common_dates, side='left')
+            found = pos < len(dates)
+            found[found] = dates[pos[found]] == common_dates[found]
+        if order is not None:
+            pos[found] = order[pos[found]]
+        indexers.append(np.where(found, pos, -1).astype('int64'))
+    return common_dates, indexers
+
+
+def take_with_missing(df, indexer):
+    """
+    Reindex df positionally, the rows where indexer is -1 being filled with NaN
+
+    >>> df = pd.DataFrame({'a': [1, 2]})
+    >>> take_with_missing(df, np.array([1, -1, 0]))['a'].tolist()
+    [2.0, nan, 1.0]
+    """
+    missing = indexer < 0
+    if not missing.any():
+        return df.iloc[indexer].reset_index(drop=True)
+    taken = {}
+    for col in df.columns:
+        values = df[col].to_numpy()
+        if values.dtype.kind in 'biu':
+            values = values.astype('float64')
+        column = values.take(indexer.clip(min=0))
+        if values.dtype.kind == 'M':
+            column[missing] = np.datetime64('NaT')
+        elif values.dtype.kind in 'fc':
+            column[missing] = np.nan
+        else:
+            column = column.astype(object)
+            column[missing] = None
+        taken[col] = column
+    return pd.DataFrame(taken, columns=df.columns)
+
+
+def date_align_dfs(dfs, date_col_names='date', how='inner'):
+    """
+    Return the sub-dfs of the dfs where only the common dates are kept. This is intended to use with dfs
+    which have slightly different dates, typically holidays for one exchange that wasn't one for another.
+    With how='outer' or how='asof', all the dates are kept instead and the dfs are reindexed on them, the
+    missing rows being NaN or forward filled respectively (see date_align_indexers).
+
+    >>> dfs = [pd.DataFrame({'date': pd.to_datetime(['2020-01-01', '2020-01-02', '2020-01-04']),
+    ...                      'close': [1., 2., 4.]}),
+    ...        pd.DataFrame({'date': pd.to_datetime(['2020-01-02', '2020-01-03', '2020-01-04']),
+    ...                      'close': [20., 30., 40.]})]
+    >>> [df['close'].tolist() for df in date_align_dfs(dfs)]
+    [[2.0, 4.0], [20.0, 40.0]]
+    >>> [df['close'].tolist() for df in date_align_dfs(dfs, how='asof')]
+    [[1.0, 2.0, 2.0, 4.0], [nan, 20.0, 30.0, 40.0]]
+    >>> date_align_dfs(dfs, how='outer')[0]['date'].dt.strftime('%m-%d').tolist()
+    ['01-01', '01-02', '01-03', '01-04']
+    """
+
+    if isinstance(date_col_names, str):
+        date_col_names = [date_col_names] * len(dfs)
+    common_dates, indexers = date_align_indexers(dfs, date_col_names, how=how)
+
     date_aligned_dfs = []
-    for df, date_col_name in zip(dfs, date_col_names):
-        date_aligned_dfs.append(df[df[date_col_name].isin(dates_overlap)])
+    for df, date_col_name, indexer in zip(dfs, date_col_names, indexers):
+        if how == 'inner':
+            # keep the rows of the common dates, in their original order and with their original index
+            if len(common_dates) == 0:
+                date_aligned_dfs.append(df.iloc[:0])
+                continue
+            dates = dates_to_int64(df[date_col_name])
+            pos = np.searchsorted(common_dates, dates).clip(max=len(common_dates) - 1)
+            date_aligned_dfs.append(df[common_dates[pos] == dates])
+        else:
+            aligned_df = take_with_missing(df, indexer)
+            aligned_df[date_col_name] = int64_to_dates(common_dates, tz=getattr(df[date_col_name].dt, 'tz', None))
+            date_aligned_dfs.append(aligned_df)
     return date_aligned_dfs
 
 
@@ -1,9 +1,15 @@
 """Functions computing features"""
 
-from investate.series_utils import parallel_sort, values_to_percent_growth
+from investate.series_utils import (
+    parallel_sort,
+    values_to_percent_growth,
+    panel_returns,
+)
 import numpy as np
 from itertools import islice
 from collections import deque
+from bisect import bisect_right
+from investate.instrumentation import timed
 
 
 def chunker(iterable, chk_size, chk_step=1):
@@ -36,6 +42,7 @@ def chunker(iterable, chk_size, chk_step=1):
         d.extend(to_add)
 
 
+@timed(count_records=len)
 def moving_stats(series, chk_size, chk_step=1, chk_func=np.mean, pad=None):
     """
     Compute the moving averages of the series (or moving stats more generally), where winsize is the size of the
@@ -170,7 +177,7 @@ def sector_normalized_growth(ticker_values,
     if weights is None:
         weights = np.array([1] * len(comp_tickers_list_values))
 
-    comp_values_growth = np.array([values_to_percent_growth(values) for values in comp_tickers_list_values])
+    comp_values_growth = panel_returns(comp_tickers_list_values, axis=1)
     weighted_comp_values_growth = (comp_values_growth.T * weights).T
     comp_values_growth_mean = np.sum(weighted_comp_values_growth, axis=0) / np.sum(weights)
     normalized_ticker_values = values_to_percent_growth(ticker_values)
@@ -178,6 +185,39 @@ def sector_normalized_growth(ticker_values,
     return normalized_ticker_values - comp_values_growth_mean
 
 
+def sector_normalized_growths(tickers_values, weights=None):
+    """
+    Sector wide version of sector_normalized_growth: for each ticker, its growth minus the weighted mean growth of
+    all the OTHER tickers (leave-one-out mean). The growth of each ticker and the weighted total of the growths are
+    computed once and shared by all the tickers, instead of once per ticker.
+
+    :param tickers_values: array like of shape (n_tickers, n_dates), the values of each ticker over time
+    :param weights: array like of n_tickers weights, all equal by default
+    :return: array of shape (n_tickers, n_dates - 1), row i being
+             sector_normalized_growth(tickers_values[i], <the other rows>, <the other weights>)
+
+    >>> tickers_values = [[1, 2, 3], [1, 0.8, 0.9], [1, 2, 3]]
+    >>> sector_normalized_growths(tickers_values)[0].tolist()
+    [0.6, 0.1875]
+    >>> sector_normalized_growths(tickers_values, weights=[1, 2, 1])[0].round(4).tolist()
+    [0.8, 0.25]
+    """
+
+    tickers_values = np.asarray(tickers_values, dtype=float)
+    if weights is None:
+        weights = np.ones(len(tickers_values))
+    weights = np.asarray(weights, dtype=float)
+
+    growths = panel_returns(tickers_values, axis=1)
+    weighted_growths = growths * weights[:, None]
+    total_weighted_growth = np.sum(weighted_growths, axis=0)
+    # removing each ticker from the totals gives the mean of the others
+    with np.errstate(invalid='ignore', divide='ignore'):
+        others_mean = (total_weighted_growth - weighted_growths) / (np.sum(weights) - weights)[:, None]
+
+    return growths - others_mean
+
+
 def time_up_time_down(series):
     """
     Return the number of times a series goes up and the number of time a series goes down (strictly)
@@ -197,7 +237,10 @@ def time_up_time_down(series):
     return pos, neg
 
 
-def distribution_growth(series, bins=[-0.5, -0.2, -0.1, 0, 0.01, 0.2, 0.5]):
+DFLT_GROWTH_BINS = (-0.5, -0.2, -0.1, 0, 0.01, 0.2, 0.5)
+
+
+def distribution_growth(series, bins=list(DFLT_GROWTH_BINS)):
     """
     >>> frq, edges = distribution_growth([1, 1.1, 1.2, 1.15])
     >>> frq, edges
@@ -215,6 +258,394 @@ def series_growth(pd_series):
 
     :param series: a pandas series
     :return: a pandas series
+
+    >>> import pandas as pd
+    >>> series_growth(pd.Series([1.0, 2.0, 3.0])).tolist()
+    [1.0, 0.5, nan]
+    """
+    growth = np.full(len(pd_series), np.nan)
+    panel_returns(pd_series.to_numpy(dtype=float), out=growth[:-1])
+    return type(pd_series)(growth, index=pd_series.index, name=pd_series.name)
+
+
+def rolling_sum(x, chk_size, axis=-1):
+    """
+    Sums of x over all the windows of chk_size consecutive terms along axis, obtained as differences of cumulative
+    sums, so O(n) whatever chk_size. The length of the output along axis is len(x) - chk_size + 1.
+    The cumulative sums restart every chk_size terms, so that each window sum comes from the terms of at most two
+    blocks: a large term far from a window does not swamp its sum with rounding errors.
+
+    >>> rolling_sum(np.arange(5), chk_size=2).tolist()
+    [1, 3, 5, 7]
+    >>> rolling_sum(np.arange(6).reshape(2, 3), chk_size=2, axis=1).tolist()
+    [[1, 3], [7, 9]]
+    >>> rolling_sum([1e12, 1.0, 1.0, 1.0], chk_size=2).tolist()
+    [1000000000001.0, 2.0, 2.0]
+    """
+    x = np.moveaxis(np.asarray(x), axis, 0)
+    if chk_size < 1:
+        cumsum = np.concatenate([np.zeros((1,) + x.shape[1:], dtype=x.dtype), x]).cumsum(axis=0)
+        return np.moveaxis(cumsum[chk_size:] - cumsum[: len(cumsum) - chk_size], 0, axis)
+
+    n_blocks = -(-len(x) // chk_size)
+    padded = np.zeros((n_blocks * chk_size,) + x.shape[1:], dtype=x.dtype)
+    padded[: len(x)] = x
+    blocks = padded.reshape((n_blocks, chk_size) + x.shape[1:])
+    # the cumulative sums within each block, and the total of each block
+    local = blocks.cumsum(axis=1)
+    totals = local[:, -1]
+    local = local.reshape(padded.shape)[: len(x)]
+
+    sums = np.empty((max(len(x) - chk_size + 1, 0),) + x.shape[1:], dtype=local.dtype)
+    if len(sums):
+        sums[0] = local[chk_size - 1]
+        # the window ending at i is the start of its block, plus the end of the previous block
+        ends = np.arange(chk_size, len(x))
+        sums[1:] = local[ends] + (totals[ends // chk_size - 1] - local[ends - chk_size])
+    return np.moveaxis(sums, 0, axis)
+
+
+class _PanelIntermediates:
+    """
+    Arrays computed once from a (n_tickers, n_dates) panel and shared by all the features and windows of
+    build_feature_matrix. All the arrays of "terms" are aligned on the LAST date of the panel.
+    """
+
+    def __init__(self, panel):
+        self.panel = panel
+        self._cache = dict()
+
+    def _cached(self, key, func):
+        if key not in self._cache:
+            self._cache[key] = func()
+        return self._cache[key]
+
+    def diff(self, order):
+        return self._cached(('diff', order), lambda: np.diff(self.panel, order, axis=1))
+
+    def up(self, n_derivative):
+        """1 where the n_derivative-th differences go up (or stay equal) from one term to the next"""
+        return self._cached(
+            ('up', n_derivative), lambda: (self.diff(n_derivative + 1) >= 0).astype(np.int64)
+        )
+
+    def positive_diff(self, order=1):
+        return self._cached(
+            ('positive_diff', order), lambda: np.clip(self.diff(order), 0, None)
+        )
+
+    def abs_diff(self, order=1):
+        return self._cached(('abs_diff', order), lambda: np.abs(self.diff(order)))
+
+    def strictly_up(self, order=1):
+        """1 where the differences of order are > 0, for exact counts"""
+        return self._cached(('strictly_up', order), lambda: (self.diff(order) > 0).astype(np.int64))
+
+    def strictly_down(self, order=1):
+        """1 where the differences of order are < 0, for exact counts"""
+        return self._cached(('strictly_down', order), lambda: (self.diff(order) < 0).astype(np.int64))
+
+    def growth(self):
+        return self._cached(
+            ('growth',), lambda: panel_returns(self.panel, axis=1)
+        )
+
+    def window_sum(self, name, n_terms, rolling):
+        """
+        Sum of the last n_terms terms of the array called name, or, if rolling, the sums ending at each date
+        (NaN where there are fewer than n_terms terms)
+        """
+
+        def compute():
+            terms = getattr(self, name[0])(*name[1:])
+            if not rolling:
+                return terms[:, terms.shape[1] - n_terms :].sum(axis=1)
+            sums = np.full(self.panel.shape, np.nan)
+            sums[:, self.panel.shape[1] - terms.shape[1] + n_terms - 1 :] = rolling_sum(
+                terms, n_terms, axis=1
+            )
+            return sums
+
+        return self._cached(('window_sum', name, n_terms, rolling), compute)
+
+
+def _up_count(inter, chk_size, rolling, n_derivative=0):
+    return inter.window_sum(('up', n_derivative), chk_size - n_derivative - 1, rolling)
+
+
+def _down_count(inter, chk_size, rolling, n_derivative=0):
+    n_terms = chk_size - n_derivative - 1
+    return n_terms - inter.window_sum(('up', n_derivative), n_terms, rolling)
+
+
+def _monotonicity(inter, chk_size, rolling, n_derivative=0):
+    n_terms = chk_size - n_derivative - 1
+    order = n_derivative + 1
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scores = inter.window_sum(('positive_diff', order), n_terms, rolling) / inter.window_sum(
+            ('abs_diff', order), n_terms, rolling
+        )
+    # the windows going only up, or only down, are known exactly from integer counts of the steps
+    n_up = inter.window_sum(('strictly_up', order), n_terms, rolling)
+    n_down = inter.window_sum(('strictly_down', order), n_terms, rolling)
+    scores = np.where((n_up > 0) & (n_down == 0), 1.0, scores)
+    scores = np.where((n_up == 0) & (n_down > 0), 0.0, scores)
+    # and the flat windows have no score, as in monotonicity_score
+    scores = np.where((n_up == 0) & (n_down == 0), np.nan, scores)
+    return np.clip(scores, 0.0, 1.0)
+
+
+def _growth(inter, chk_size, rolling):
+    panel = inter.panel
+    if not rolling:
+        return panel[:, -1] / panel[:, -chk_size] - 1
+    growth = np.full(panel.shape, np.nan)
+    growth[:, chk_size - 1 :] = panel[:, chk_size - 1 :] / panel[:, : panel.shape[1] - chk_size + 1] - 1
+    return growth
+
+
+def _mean_growth(inter, chk_size, rolling):
+    return inter.window_sum(('growth',), chk_size - 1, rolling) / (chk_size - 1)
+
+
+# the features available in build_feature_matrix, each computed over windows of chk_size values:
+# time_up/time_down: see time_up_time_down
+# up_count/down_count: see window_up_down_count, accepting n_derivative
+# monotonicity: see monotonicity_score, accepting n_derivative (the score of the n_derivative-th differences)
+# growth: the growth from the first to the last value of the window, see series_growth
+# mean_growth: the mean of the period growths, see values_to_percent_growth
+PANEL_FEATURES = {
+    'time_up': _up_count,
+    'time_down': _down_count,
+    'up_count': _up_count,
+    'down_count': _down_count,
+    'monotonicity': _monotonicity,
+    'growth': _growth,
+    'mean_growth': _mean_growth,
+}
+
+
+def build_feature_matrix(panel, features, chk_sizes, rolling=False):
+    """
+    Compute several features over windows of several sizes for all the tickers of a panel at once. The
+    intermediate arrays (differences, growths, their cumulative sums...) are computed once and shared by all
+    the features and windows.
+
+    :param panel: array like of shape (n_tickers, n_dates), the values of each ticker over time
+    :param features: list of names of PANEL_FEATURES, or (name, kwargs) pairs, e.g. ('up_count', {'n_derivative': 1})
+    :param chk_sizes: the sizes of the windows (number of values) on which each feature is computed
+    :param rolling: if False, the features are computed on the last chk_size values of the panel. If True, they are
+                    computed on the windows ending at each date, NaN when there are not enough values yet
+    :return: the array of features, of shape (n_tickers, n_features) if rolling is False and
+             (n_dates, n_tickers, n_features) otherwise, and the list of the names of the n_features features
+
+    >>> panel = [[1, 2, 3, 2, 3, 4], [4, 3, 3, 2, 1, 2]]
+    >>> matrix, names = build_feature_matrix(panel, ['time_up', 'time_down', 'monotonicity'], chk_sizes=[3, 6])
+    >>> names
+    ['time_up_3', 'time_down_3', 'monotonicity_3', 'time_up_6', 'time_down_6', 'monotonicity_6']
+    >>> matrix.tolist()
+    [[2.0, 0.0, 1.0, 4.0, 1.0, 0.8], [1.0, 1.0, 0.5, 2.0, 3.0, 0.25]]
+
+    Each row matches the scalar functions computed on the corresponding window
+
+    >>> from investate.series_utils import monotonicity_score
+    >>> print(monotonicity_score(panel[1]))
+    0.25
+
+    In rolling mode, the features are given for every date
+
+    >>> matrix, names = build_feature_matrix(panel, [('up_count', {'n_derivative': 1})], chk_sizes=[4], rolling=True)
+    >>> names, matrix[:, 0, 0].tolist()
+    (['up_count_d1_4'], [nan, nan, nan, 1.0, 1.0, 2.0])
+
+    The windows must fit in the panel and hold at least one difference of the order the feature needs
+
+    >>> build_feature_matrix([[1, 2, 3, 2, 3]], ['time_up', 'time_down'], chk_sizes=[8])
+    Traceback (most recent call last):
+    ...
+    ValueError: chk_size 8 of time_up must be between 2 and the number of dates, 5
     """
-    return (pd_series / pd_series.shift(1) - 1).shift(-1)
 
+    inter = _PanelIntermediates(np.asarray(panel, dtype=float))
+    features = [(feat, {}) if isinstance(feat, str) else feat for feat in features]
+
+    n_dates = inter.panel.shape[1]
+    for chk_size in chk_sizes:
+        for name, kwargs in features:
+            min_size = kwargs.get('n_derivative', 0) + 2
+            if not min_size <= chk_size <= n_dates:
+                raise ValueError(
+                    f'chk_size {chk_size} of {name} must be between {min_size} and the number of dates, {n_dates}'
+                )
+
+    columns, names = [], []
+    for chk_size in chk_sizes:
+        for name, kwargs in features:
+            columns.append(
+                np.asarray(PANEL_FEATURES[name](inter, chk_size, rolling, **kwargs), dtype=float)
+            )
+            suffix = ''.join(f'_d{val}' for key, val in kwargs.items() if key == 'n_derivative')
+            names.append(f'{name}{suffix}_{chk_size}')
+
+    matrix = np.stack(columns, axis=-1)
+    if rolling:
+        matrix = matrix.transpose(1, 0, 2)
+    return matrix, names
+
+
+def _rolling_series_features(series, chk_size, features, pad=None):
+    """
+    The features of build_feature_matrix on each window of chk_size values of a single series, aligned like
+    moving_stats: one row per window, padded with chk_size - 1 rows of pad at the start if pad is not None
+    """
+    matrix, _ = build_feature_matrix([series], features, [chk_size], rolling=True)
+    stats = matrix[chk_size - 1 :, 0, :]
+    if pad is not None:
+        stats = np.concatenate([np.full((chk_size - 1, stats.shape[1]), pad), stats])
+    return stats.T
+
+
+def rolling_up_down_count(series, chk_size, n_derivative=0, pad=None):
+    """
+    The window_up_down_count of every window of chk_size consecutive values of series, in O(n) overall: the up
+    indicators of the differences are summed over the windows with a cumulative sum instead of looping over each
+    window. Aligned like moving_stats.
+
+    :return: two arrays, the number of ups and the number of downs of each window
+
+    >>> series = [1, 3, 2, 2, 5, 4, 6]
+    >>> n_up, n_down = rolling_up_down_count(series, chk_size=4, n_derivative=1)
+    >>> n_up.tolist(), n_down.tolist()
+    ([1, 2, 1, 1], [1, 0, 1, 1])
+    >>> window_counts = moving_stats(series, chk_size=4, chk_func=lambda w: window_up_down_count(w, n_derivative=1))
+    >>> [(int(up), int(down)) for up, down in window_counts]
+    [(1, 1), (2, 0), (1, 1), (1, 1)]
+    """
+    n_up, n_down = _rolling_series_features(
+        series,
+        chk_size,
+        [('up_count', {'n_derivative': n_derivative}), ('down_count', {'n_derivative': n_derivative})],
+        pad=pad,
+    )
+    if pad is None:
+        n_up, n_down = n_up.astype(int), n_down.astype(int)
+    return n_up, n_down
+
+
+def rolling_time_up_time_down(series, chk_size, pad=None):
+    """
+    The time_up_time_down of every window of chk_size consecutive values of series, in O(n) overall
+
+    >>> n_up, n_down = rolling_time_up_time_down([1, 2, 3, 2, 2, 1], chk_size=3)
+    >>> n_up.tolist(), n_down.tolist()
+    ([2, 1, 1, 1], [0, 1, 1, 1])
+    """
+    return rolling_up_down_count(series, chk_size, n_derivative=0, pad=pad)
+
+
+def rolling_monotonicity_score(series, chk_size, n_derivative=0, pad=None):
+    """
+    The monotonicity_score of the n_derivative-th differences of every window of chk_size consecutive values of
+    series, in O(n) overall (the positive and absolute differences are summed over the windows with cumulative sums)
+
+    >>> rolling_monotonicity_score([1, 2, 3, 2, 2, 4], chk_size=3).tolist()
+    [1.0, 0.5, 0.0, 1.0]
+    >>> rolling_monotonicity_score([1, 2, 3, 2, 2, 4], chk_size=3, pad=np.nan).tolist()
+    [nan, nan, 1.0, 0.5, 0.0, 1.0]
+
+    The scores are exact on long monotone series, even after a huge step
+
+    >>> from investate.series_utils import monotonicity_score
+    >>> series = np.concatenate([[1e12], 1 + np.cumsum(np.full(10000, 1e-6))])
+    >>> scores = rolling_monotonicity_score(series, chk_size=10)
+    >>> print(monotonicity_score(series[-10:]))
+    1.0
+    >>> bool((scores[1:] == 1.0).all())
+    True
+    """
+    (scores,) = _rolling_series_features(
+        series, chk_size, [('monotonicity', {'n_derivative': n_derivative})], pad=pad
+    )
+    return scores
+
+
+def _growth_bins(growth, edges):
+    """
+    Index of the bin of np.histogram(growth, edges) each growth falls in (the last bin being closed on the right),
+    -1 for the growths outside of the edges
+
+    >>> _growth_bins(np.array([-1, -0.5, 0, 0.3, 0.5, 0.6]), np.array([-0.5, 0, 0.5])).tolist()
+    [-1, 0, 1, 1, 1, -1]
+    """
+    bins = np.searchsorted(edges, growth, side='right') - 1
+    bins[growth == edges[-1]] = len(edges) - 2
+    bins[~((growth >= edges[0]) & (growth <= edges[-1]))] = -1
+    return bins
+
+
+class RollingHistogram:
+    """
+    The distribution_growth of the last chk_size values of a series which is fed one value at a time. Each update
+    adds the growth entering the window and removes the one leaving it, so it costs O(1) for fixed bins
+    (O(log n_bins) to find the bin).
+
+    >>> hist = RollingHistogram(chk_size=3, bins=[-0.5, -0.2, -0.1, 0, 0.01, 0.2, 0.5])
+    >>> for value in [1, 1.1, 1.2, 1.15, 1.2]:
+    ...     counts = hist.update(value)
+    >>> counts.tolist()
+    [0, 0, 1, 0, 1, 0]
+    >>> distribution_growth([1.2, 1.15, 1.2])[0].tolist()
+    [0, 0, 1, 0, 1, 0]
+    """
+
+    __slots__ = ('edges', 'chk_size', 'counts', '_window_bins', '_last_value')
+
+    def __init__(self, chk_size, bins=DFLT_GROWTH_BINS):
+        self.edges = list(bins)
+        self.chk_size = chk_size
+        self.counts = np.zeros(len(self.edges) - 1, dtype=int)
+        # the bins of the chk_size - 1 growths of the window
+        self._window_bins = deque()
+        self._last_value = None
+
+    def _bin(self, growth):
+        if growth == self.edges[-1]:
+            return len(self.edges) - 2
+        if not self.edges[0] <= growth <= self.edges[-1]:
+            return -1
+        return bisect_right(self.edges, growth) - 1
+
+    def update(self, value):
+        """Add a value to the series and return the counts of the current window (the array is updated in place)"""
+        if self._last_value is not None:
+            new_bin = self._bin(value / self._last_value - 1)
+            self._window_bins.append(new_bin)
+            if new_bin >= 0:
+                self.counts[new_bin] += 1
+            if len(self._window_bins) > self.chk_size - 1:
+                old_bin = self._window_bins.popleft()
+                if old_bin >= 0:
+                    self.counts[old_bin] -= 1
+        self._last_value = value
+        return self.counts
+
+
+def rolling_distribution_growth(series, chk_size, bins=DFLT_GROWTH_BINS):
+    """
+    The distribution_growth counts of every window of chk_size consecutive values of series, computed at once:
+    the growths are binned once and the one-hot bins are summed over the windows with a cumulative sum.
+
+    :return: array of shape (len(series) - chk_size + 1, len(bins) - 1), aligned like moving_stats
+
+    >>> series = [1, 1.1, 1.2, 1.15, 1.2]
+    >>> rolling_distribution_growth(series, chk_size=4).tolist()
+    [[0, 0, 1, 0, 2, 0], [0, 0, 1, 0, 2, 0]]
+    >>> distribution_growth(series[1:])[0].tolist()
+    [0, 0, 1, 0, 2, 0]
+    """
+    edges = np.asarray(bins, dtype=float)
+    growth_bins = _growth_bins(values_to_percent_growth(series), edges)
+    one_hot = np.zeros((len(growth_bins), len(edges)), dtype=int)
+    # the growths outside the edges go to the extra last column, which is dropped
+    one_hot[np.arange(len(growth_bins)), growth_bins] = 1
+    return rolling_sum(one_hot, chk_size - 1, axis=0)[:, :-1]
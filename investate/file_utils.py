@@ -2,29 +2,211 @@
 
 import pickle
 import os
+import struct
+import threading
+import zlib
+from collections import namedtuple
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
 import pandas as pd
 from PyPDF2 import PdfFileMerger, PdfFileReader
-from openpyxl import load_workbook
-import glob
-from collections import defaultdict
+from openpyxl import Workbook, load_workbook
 
 
-def pickle_dump(obj, path):
+def pickle_dump(obj, path, container=False, **container_kwargs):
     """
-    Dump a pickle
+    Dump a pickle. With container=True, obj must be a mapping (typically a dict of ticker dataframes) and is
+    saved in the container format of container_dump, which lets single keys be loaded lazily.
     """
+    if container:
+        return container_dump(obj, path, **container_kwargs)
     with open(path, 'wb') as outfile:
         return pickle.dump(obj, outfile)
 
 
-def pickle_load(path):
+def pickle_load(path, lazy=False):
     """
-    Load a pickle
+    Load a pickle, or a container written by container_dump: as a dict, or as a lazy ContainerReader if lazy
     """
+    if is_container(path):
+        reader = ContainerReader(path)
+        if lazy:
+            return reader
+        with reader:
+            return dict(reader.items())
     with open(path, 'rb') as pickle_in:
         return pickle.load(pickle_in)
 
 
+# ---------------------------------------------container format----------------------------------------------------
+# header: magic, version, offset, length and crc32 of the table of contents
+# then the payloads of the entries, each starting at a multiple of CONTAINER_ALIGNMENT so that arrays can be
+# memory mapped, and finally the table of contents, a zlib compressed pickle of key -> entry
+
+CONTAINER_MAGIC = b'INVSTCNT'
+CONTAINER_VERSION = 1
+CONTAINER_ALIGNMENT = 64
+_CONTAINER_HEADER = struct.Struct('<8sIQQI')
+
+ContainerEntry = namedtuple(
+    'ContainerEntry', ['offset', 'length', 'kind', 'compressed', 'crc32', 'dtype', 'shape']
+)
+
+
+def is_container(path):
+    """Whether the file at path is a container written by container_dump"""
+    with open(path, 'rb') as infile:
+        return infile.read(len(CONTAINER_MAGIC)) == CONTAINER_MAGIC
+
+
+def _entry_payload(value, compression_level, compress_arrays):
+    """The bytes to write for a value, with the kind, compression flag, dtype and shape of its entry"""
+    if isinstance(value, np.ndarray) and not value.dtype.hasobject:
+        payload = np.ascontiguousarray(value).tobytes()
+        kind, dtype, shape = 'ndarray', value.dtype.str, value.shape
+        compressed = compress_arrays
+    else:
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        kind, dtype, shape = 'pickle', None, None
+        compressed = compression_level > 0
+    if compressed:
+        payload = zlib.compress(payload, compression_level or 1)
+    return payload, kind, compressed, dtype, shape
+
+
+def container_dump(mapping, path, compression_level=3, compress_arrays=False, schema=None):
+    """
+    Save a mapping in the container format: each value is an entry of its own, with its key in a table of
+    contents, so that single keys can be read without loading the others (see ContainerReader). Numpy arrays are
+    stored raw to be memory mapped (unless compress_arrays), other values are pickled and zlib compressed with
+    compression_level (0 for no compression). Each entry gets a crc32 checksum.
+    The file is written next to path then renamed, so readers never see a partially written container.
+
+    :param schema: optional metadata stored with the table of contents, see ContainerReader.schema
+
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'store')
+    >>> container_dump({'QQQ': pd.DataFrame({'close': [1.0, 2.0]}), 'ones': np.ones(3)}, path)
+    >>> store = pickle_load(path, lazy=True)
+    >>> sorted(store), store['QQQ']['close'].tolist(), store['ones'].tolist()
+    (['QQQ', 'ones'], [1.0, 2.0], [1.0, 1.0, 1.0])
+    >>> store.close()
+    """
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    toc = {}
+    with open(tmp_path, 'wb') as outfile:
+        outfile.write(b'\0' * _CONTAINER_HEADER.size)
+        for key, value in mapping.items():
+            payload, kind, compressed, dtype, shape = _entry_payload(
+                value, compression_level, compress_arrays
+            )
+            offset = -(-outfile.tell() // CONTAINER_ALIGNMENT) * CONTAINER_ALIGNMENT
+            outfile.write(b'\0' * (offset - outfile.tell()))
+            outfile.write(payload)
+            toc[key] = ContainerEntry(
+                offset, len(payload), kind, compressed, zlib.crc32(payload), dtype, shape
+            )
+
+        toc_payload = zlib.compress(
+            pickle.dumps(
+                {'schema': schema, 'entries': {key: tuple(entry) for key, entry in toc.items()}},
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        )
+        toc_offset = outfile.tell()
+        outfile.write(toc_payload)
+        outfile.seek(0)
+        outfile.write(
+            _CONTAINER_HEADER.pack(
+                CONTAINER_MAGIC,
+                CONTAINER_VERSION,
+                toc_offset,
+                len(toc_payload),
+                zlib.crc32(toc_payload),
+            )
+        )
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.replace(tmp_path, path)
+
+
+class ContainerReader(Mapping):
+    """
+    Read only mapping over a container written by container_dump, only reading the table of contents when opened
+    and each entry when accessed. Uncompressed numpy arrays are memory mapped if mmap_arrays, in which case their
+    checksum is only checked by verify. Use it as a context manager, or call close, to release the file.
+    """
+
+    def __init__(self, path, mmap_arrays=True):
+        self.path = path
+        self.mmap_arrays = mmap_arrays
+        self._file = open(path, 'rb')
+        self._lock = threading.Lock()
+        try:
+            magic, version, toc_offset, toc_length, toc_crc32 = _CONTAINER_HEADER.unpack(
+                self._file.read(_CONTAINER_HEADER.size)
+            )
+            if magic != CONTAINER_MAGIC:
+                raise ValueError(f'{path} is not a container')
+            if version > CONTAINER_VERSION:
+                raise ValueError(
+                    f'{path} has version {version}, this code only reads up to version {CONTAINER_VERSION}'
+                )
+            self.version = version
+            toc = pickle.loads(zlib.decompress(self._read(toc_offset, toc_length, toc_crc32)))
+        except Exception:
+            self._file.close()
+            raise
+        self.schema = toc['schema']
+        self._entries = {key: ContainerEntry(*entry) for key, entry in toc['entries'].items()}
+
+    def _read(self, offset, length, crc32):
+        with self._lock:
+            self._file.seek(offset)
+            payload = self._file.read(length)
+        if zlib.crc32(payload) != crc32:
+            raise ValueError(f'Corrupted entry at offset {offset} of {self.path}')
+        return payload
+
+    def __getitem__(self, key):
+        entry = self._entries[key]
+        if entry.kind == 'ndarray' and not entry.compressed and self.mmap_arrays:
+            if entry.length == 0:
+                return np.empty(entry.shape, dtype=entry.dtype)
+            return np.memmap(
+                self.path, dtype=entry.dtype, mode='r', offset=entry.offset, shape=entry.shape
+            )
+        payload = self._read(entry.offset, entry.length, entry.crc32)
+        if entry.compressed:
+            payload = zlib.decompress(payload)
+        if entry.kind == 'ndarray':
+            return np.frombuffer(bytearray(payload), dtype=entry.dtype).reshape(entry.shape)
+        return pickle.loads(payload)
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def verify(self):
+        """Check the checksums of all the entries, raising a ValueError at the first corrupted one"""
+        for entry in self._entries.values():
+            self._read(entry.offset, entry.length, entry.crc32)
+        return True
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
 def merge_pdf_in_folder(directory_path, output_name='combined_pdf.pdf', delete=False):
     """
     Finds all pdf within the directory and merge them into one single pdf
@@ -48,9 +230,120 @@ def merge_pdf_in_folder(directory_path, output_name='combined_pdf.pdf', delete=F
             os.remove(filename)
 
 
+def _excel_value(value):
+    """
+    A value as openpyxl can write it: missing values are left empty and, since excel has no timezones, tz-aware
+    datetimes become the naive datetimes of their local time
+    """
+    if value is pd.NaT or value is pd.NA or (isinstance(value, float) and value != value):
+        return None
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.replace(tzinfo=None)
+    return value
+
+
+def _without_timezones(dataframe):
+    """
+    The dataframe with its tz-aware datetime columns and index levels converted to naive datetimes of their local
+    time, which to_excel requires, or the dataframe itself if it has none
+    """
+    tz_positions = [
+        position
+        for position, dtype in enumerate(dataframe.dtypes)
+        if isinstance(dtype, pd.DatetimeTZDtype)
+    ]
+    index = dataframe.index
+    levels = index.levels if isinstance(index, pd.MultiIndex) else [index]
+    index_has_tz = any(getattr(level, 'tz', None) is not None for level in levels)
+    if not tz_positions and not index_has_tz:
+        return dataframe
+
+    dataframe = dataframe.copy()
+    for position in tz_positions:
+        dataframe.isetitem(position, dataframe.iloc[:, position].dt.tz_localize(None))
+    if index_has_tz:
+        naive_levels = [
+            level.tz_localize(None) if getattr(level, 'tz', None) is not None else level
+            for level in levels
+        ]
+        dataframe.index = (
+            index.set_levels(naive_levels) if isinstance(index, pd.MultiIndex) else naive_levels[0]
+        )
+    return dataframe
+
+
+def _frame_rows(dataframe):
+    """
+    The rows of a dataframe as written by to_excel: a header row, then the index followed by the values.
+    A MultiIndex gets a column per level.
+    """
+    index = dataframe.index
+    yield list(index.names) + [str(col) for col in dataframe.columns]
+    labels = index if isinstance(index, pd.MultiIndex) else ((label,) for label in index)
+    for label, row in zip(labels, dataframe.itertuples(index=False, name=None)):
+        yield [_excel_value(value) for value in label + row]
+
+
+def _stream_frames_to_workbook(filename, frames):
+    """
+    Write the frames with a write only workbook, which streams the rows to the file and keeps memory flat.
+    The sheets of the existing workbook which are not replaced are copied, as values only, row by row.
+    """
+    frames = list(frames)
+    new_tabnames = {tabname for tabname, _ in frames}
+    workbook = Workbook(write_only=True)
+
+    existing = None
+    if os.path.isfile(filename):
+        existing = load_workbook(filename, read_only=True)
+        for sheet in existing.worksheets:
+            if sheet.title not in new_tabnames:
+                copy = workbook.create_sheet(sheet.title)
+                for row in sheet.iter_rows(values_only=True):
+                    copy.append(row)
+
+    for tabname, dataframe in frames:
+        sheet = workbook.create_sheet(tabname)
+        for row in _frame_rows(dataframe):
+            sheet.append(row)
+
+    # write next to the file then rename, the existing workbook being read while writing
+    tmp_path = f'{filename}.{os.getpid()}.tmp.xlsx'
+    workbook.save(tmp_path)
+    if existing is not None:
+        existing.close()
+    os.replace(tmp_path, filename)
+
+
+def add_frames_to_workbook(filename, frames, write_only=False):
+    """
+    Save several dataframes to tabs of a workbook, opening and saving it only once. Existing tabs with the same
+    names are replaced, the other tabs are kept.
+
+    :param filename: the workbook, created if it does not exist
+    :param frames: a dict or an iterable of (tabname, dataframe) pairs
+    :param write_only: if True, the frames are streamed to the file with an openpyxl write only workbook, which
+                       keeps memory flat for very large sheets but only keeps the values of the existing tabs
+    :return: None
+    """
+
+    frames = frames.items() if isinstance(frames, dict) else frames
+    if write_only:
+        return _stream_frames_to_workbook(filename, frames)
+
+    if os.path.isfile(filename):
+        writer = pd.ExcelWriter(filename, engine='openpyxl', mode='a', if_sheet_exists='replace')
+    else:
+        writer = pd.ExcelWriter(filename, engine='openpyxl')
+    with writer:
+        for tabname, dataframe in frames:
+            _without_timezones(dataframe).to_excel(writer, sheet_name=tabname)
+
+
 def add_frame_to_workbook(filename, tabname, dataframe):
     """
-    Save a dataframe to a workbook tab with the filename and tabname
+    Save a dataframe to a workbook tab with the filename and tabname.
+    To save several dataframes, add_frames_to_workbook does it with a single load and save of the workbook.
 
     :param filename: filename to create, can use strptime formatting
     :param tabname: tabname to create, can use strptime formatting
@@ -58,57 +351,114 @@ def add_frame_to_workbook(filename, tabname, dataframe):
     :return: None
     """
 
-    sheet_name = tabname
+    add_frames_to_workbook(filename, [(tabname, dataframe)])
 
-    # create a writer for this month and year
-    writer = pd.ExcelWriter(filename, engine='openpyxl')
 
-    try:
-        # try to open an existing workbook
-        writer.book = load_workbook(filename)
+def _scan_dir(dir_path, extension, old_dirs):
+    """
+    The names of the files of dir_path ending with extension and the paths of its subfolders, hidden ones excluded
+    as glob does, reused from old_dirs (dir_path -> (mtime, file names, subfolders)) if the folder did not change
+    """
+    mtime = os.stat(dir_path).st_mtime_ns
+    old = old_dirs.get(dir_path)
+    if old is not None and old[0] == mtime:
+        return old
+    file_names, subdirs = [], []
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_dir():
+                subdirs.append(entry.path)
+            elif entry.name.endswith(extension):
+                file_names.append(entry.name)
+    return mtime, file_names, subdirs
 
-        # copy existing sheets
-        writer.sheets = dict(
-            (ws.title, ws) for ws in writer.book.worksheets)
-    except IOError:
-        # file does not exist yet, we will create it
-        pass
 
-    # write out the new sheet
-    dataframe.to_excel(writer, sheet_name=sheet_name)
+def _scan_tree(dir_path, extension, old_dirs):
+    """
+    Scan dir_path and all its subfolders, depth first, each folder before its subfolders
+
+    :return: a dict dir path -> (mtime, file names, subfolders), in the order of the scan
+    """
+    dirs = {}
+    to_scan = [dir_path]
+    while to_scan:
+        current = to_scan.pop()
+        dirs[current] = _scan_dir(current, extension, old_dirs)
+        to_scan.extend(reversed(dirs[current][2]))
+    return dirs
 
-    # save the workbook
-    writer.save()
 
+def scan_files(root_dir, extension='.wav', index_path=None, max_workers=8):
+    """
+    Find the files under root_dir ending with extension, in a single pass over the tree, the subfolders of root_dir
+    being scanned in parallel. If index_path is given, the result is persisted there and, on the next calls,
+    only the folders whose modification time changed are listed again.
 
-def make_file_df(root_dir, extension='.wav'):
+    :return: a dict from the paths of the folders to their (mtime, matching file names, subfolders)
+    """
+    old_dirs = {}
+    if index_path is not None and os.path.isfile(index_path):
+        index = pickle_load(index_path)
+        if (index['root_dir'], index['extension']) == (root_dir, extension):
+            old_dirs = index['dirs']
+
+    dirs = {root_dir: _scan_dir(root_dir, extension, old_dirs)}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for subdir_dirs in executor.map(
+            lambda subdir: _scan_tree(subdir, extension, old_dirs), dirs[root_dir][2]
+        ):
+            dirs.update(subdir_dirs)
+
+    if index_path is not None:
+        tmp_path = f'{index_path}.{os.getpid()}.tmp'
+        pickle_dump({'root_dir': root_dir, 'extension': extension, 'dirs': dirs}, tmp_path)
+        os.replace(tmp_path, index_path)
+    return dirs
+
+
+def make_file_df(root_dir, extension='.wav', index_path=None, max_workers=8):
     """
     Goes recursively through root_dir and make a df with the filenames with matching extension. The enclosing
     subfolders are recorded in the df too. The goal being able to easily select sets of filenames based on
     their origin, typically when the folder name are meaningful for train/test or contain important meta data
     about the files.
 
+    The tree is scanned once with scan_files, and the folder columns are built once per folder rather than once
+    per file.
+
     :param root_dir: a string of the path to the folder of interest
     :param extension: the extension of interest
+    :param index_path: optional path of a persisted index of the tree, see scan_files
+    :param max_workers: the number of subfolders of root_dir scanned at the same time
     :return: a dataframe
     """
 
-    dict_for_df = defaultdict(list)
-    n_folders = 0
-
-    for full_path in glob.iglob(root_dir + f'/**/*{extension}',
-                                recursive=True):
-        if len(full_path.split('/')) > n_folders:
-            n_folders = len(full_path.split('/')) - 1
-
-    for full_path in glob.iglob(root_dir + f'/**/*{extension}',
-                                recursive=True):
-        split = full_path.split('/')
-        dict_for_df['filename'].append(split[-1])
-        dict_for_df['full_path'].append(full_path)
-        for idx, folder in enumerate(split[:-1]):
-            dict_for_df[idx].append(folder)
-        if n_folders > idx:
-            for i in range(idx + 1, n_folders):
-                dict_for_df[i].append(None)
-    return pd.DataFrame(dict_for_df)
+    dirs = scan_files(root_dir, extension, index_path, max_workers)
+    dirs = [(dir_path, names) for dir_path, (_, names, _) in dirs.items() if names]
+    if not dirs:
+        return pd.DataFrame()
+
+    # one row of folders per folder, padded with None, repeated for each of its files
+    dir_folders = [dir_path.split('/') for dir_path, _ in dirs]
+    n_folders = max(map(len, dir_folders))
+    folder_table = np.full((len(dirs), n_folders), None, dtype=object)
+    for row, folders in enumerate(dir_folders):
+        folder_table[row, : len(folders)] = folders
+    dir_rows = np.repeat(np.arange(len(dirs)), [len(names) for _, names in dirs])
+
+    filenames = np.fromiter(
+        (name for _, names in dirs for name in names), dtype=object, count=len(dir_rows)
+    )
+    dir_prefixes = np.array([dir_path + '/' for dir_path, _ in dirs], dtype=object)
+    full_paths = dir_prefixes[dir_rows] + filenames
+    folder_columns = folder_table[dir_rows]
+
+    return pd.DataFrame(
+        {
+            'filename': filenames,
+            'full_path': full_paths,
+            **{idx: folder_columns[:, idx] for idx in range(n_folders)},
+        }
+    )
@@ -1,82 +1,104 @@
 """
-Little streamlit app to generate artificial stock market timeseries
+Little streamlit app to generate artificial stock market timeseries, with the generators of synthetic_series.
+The block bootstrap model resamples the returns of real intraday data of a ticker.
 """
 
+from functools import partial
+
 import streamlit as st
-import pandas as pd
-from investate.data_apis import get_intraday_data
-import matplotlib.pyplot as plt 
-st.title('Artificial stock series')
+import numpy as np
+import matplotlib.pyplot as plt
+from investate.synthetic_series import (
+    gbm_paths,
+    regime_switching_paths,
+    jump_diffusion_paths,
+    block_bootstrap_paths,
+    historical_log_returns,
+)
+from investate.app_cache import APP_CACHE
 
-ticker = st.sidebar.text_input('Stock ticker', value='QQQ')
-data = get_intraday_data(ticker=ticker,
-                         start='2019-11-01',
-                         end='2019-11-01')
+st.title('Artificial stock series')
 
-fig, ax = plt.subplots(figsize=(10,5))
-ax.plot(data.open)
-# Add figure in streamlit app
-st.pyplot(fig)
+model = st.sidebar.selectbox(
+    'Model', ['Geometric brownian motion', 'Regime switching', 'Jump diffusion', 'Block bootstrap']
+)
+n_paths = st.sidebar.number_input('Number of paths', value=20, min_value=1)
+n_steps = st.sidebar.number_input('Number of steps', value=390, min_value=2)
+seed = st.sidebar.number_input('Seed', value=0)
+s0 = st.sidebar.number_input('Start price', value=100.0)
 
-# house_cost = st.sidebar.number_input('House price', value=240000)
-# down_payment_perc = st.sidebar.number_input('Down payment percentage', value=10) * 0.01
-# mortg_rate = st.sidebar.number_input('Mortgage rate', value=2.75) * 0.01
-# mortgage_n_years = st.sidebar.number_input('Mortgage duration in years', value=15)
-# n_years_after_pay_off = st.sidebar.number_input(
-#     'Years to display after pay off', value=5
-# )
+if model == 'Geometric brownian motion':
+    mu = st.sidebar.number_input('Drift per step (%)', value=0.0, format='%.4f') * 0.01
+    sigma = st.sidebar.number_input('Volatility per step (%)', value=0.1, format='%.4f') * 0.01
+    generator = partial(gbm_paths, mu=mu, sigma=sigma)
+    model_params = (mu, sigma)
+elif model == 'Regime switching':
+    p_bull_to_bear = st.sidebar.number_input('Probability bull to bear (%)', value=1.0) * 0.01
+    p_bear_to_bull = st.sidebar.number_input('Probability bear to bull (%)', value=5.0) * 0.01
+    generator = partial(
+        regime_switching_paths,
+        transition_matrix=(
+            (1 - p_bull_to_bear, p_bull_to_bear),
+            (p_bear_to_bull, 1 - p_bear_to_bull),
+        ),
+    )
+    model_params = (p_bull_to_bear, p_bear_to_bull)
+elif model == 'Jump diffusion':
+    sigma = st.sidebar.number_input('Volatility per step (%)', value=0.1, format='%.4f') * 0.01
+    jump_intensity = st.sidebar.number_input('Jumps per step', value=0.01, format='%.4f')
+    jump_mean = st.sidebar.number_input('Mean jump (%)', value=-1.0) * 0.01
+    jump_std = st.sidebar.number_input('Jump volatility (%)', value=1.0) * 0.01
+    generator = partial(
+        jump_diffusion_paths,
+        sigma=sigma,
+        jump_intensity=jump_intensity,
+        jump_mean=jump_mean,
+        jump_std=jump_std,
+    )
+    model_params = (sigma, jump_intensity, jump_mean, jump_std)
+else:
+    # only this model needs real data
+    from investate.data_apis import get_intraday_data
 
-# tax = st.sidebar.number_input('Yearly tax', value=4000)
-# insurance = st.sidebar.number_input('Yearly insurance cost', value=3000)
-# repair = st.sidebar.number_input('Yearly repair cost', value=6000)
-# monthly_rental_income = st.sidebar.number_input(
-#     'Average monthly rental income', value=7500
-# )
-# percentage_rented = st.sidebar.number_input('Percentage rented', value=0.5)
+    ticker = st.sidebar.text_input('Stock ticker', value='QQQ')
+    start = st.sidebar.text_input('From', value='2019-11-01')
+    end = st.sidebar.text_input('To', value='2019-11-01')
+    block_size = st.sidebar.number_input('Block size', value=30, min_value=1)
+    # the data of a ticker is only fetched once, whatever the other inputs and the number of sessions
+    data = APP_CACHE.get(
+        ('get_intraday_data', ticker, start, end),
+        lambda: get_intraday_data(ticker=ticker, start=start, end=end),
+    )
+    generator = partial(
+        block_bootstrap_paths, historical_log_returns(data.open), block_size=block_size
+    )
+    model_params = (ticker, start, end, block_size)
 
-# estate_rate = (
-#     st.sidebar.number_input('Yearly real estate market increase', value=3.5) * 0.01
-# )
-# inflation_rate = st.sidebar.number_input('Inflation rate', value=2.1) * 0.01
-# income_tax = st.sidebar.number_input('Income tax percentage', value=33) * 0.01
-# management_fees_rate = st.sidebar.number_input('Management fees', value=22) * 0.01
-# stock_market_rate = (
-#     st.sidebar.number_input('Yearly rate of other investment', value=8) * 0.01
-# )
 
-# equity, monthly_income = house_investment(
-#     mortg_rate,
-#     down_payment_perc,
-#     house_cost,
-#     tax,
-#     insurance,
-#     repair,
-#     estate_rate,
-#     mortgage_n_years,
-#     n_years_after_pay_off,
-#     monthly_rental_income,
-#     percentage_rented,
-#     inflation_rate,
-#     income_tax,
-#     management_fees_rate,
-#     plot=False,
-# )
+def show(paths, display):
+    with display.container():
+        fig, ax = plt.subplots(figsize=(10, 5))
+        ax.plot(paths.T, linewidth=0.7)
+        ax.set_xlabel('steps')
+        ax.set_ylabel('price')
+        # Add figure in streamlit app
+        st.pyplot(fig)
 
-# df = pd.DataFrame()
-# df['equity'] = equity
-# df['montlhy_income'] = monthly_income
+        final_values = paths[:, -1]
+        st.write(
+            f'Final price: median {np.median(final_values):.2f}, '
+            f'5% quantile {np.quantile(final_values, 0.05):.2f}, '
+            f'95% quantile {np.quantile(final_values, 0.95):.2f}'
+        )
 
-# house_invest, down_payment_invest = compare_house_invest_vs_stock(
-#     equity,
-#     monthly_income,
-#     stock_market_rate=stock_market_rate,
-#     down_payment_perc=down_payment_perc,
-#     house_cost=house_cost,
-#     plot=False,
-# )
-# df['house_investment'] = house_invest
-# df['stock_investment'] = down_payment_invest
 
-# st.line_chart(df['montlhy_income'])
-# st.line_chart(df['equity'])
-# st.line_chart(df[['house_investment', 'stock_investment']])
+future = APP_CACHE.submit(
+    ('synthetic_paths', model, *model_params, n_paths, n_steps, s0, seed),
+    lambda: generator(int(n_paths), int(n_steps), s0=s0, seed=int(seed)),
+)
+display = st.empty()
+# keep showing the last paths of this session while the new ones are generated
+if not future.done() and 'synthetic_paths' in st.session_state:
+    show(st.session_state['synthetic_paths'], display)
+st.session_state['synthetic_paths'] = future.result()
+show(st.session_state['synthetic_paths'], display)
@@ -0,0 +1,474 @@
+"""
+Indicators updated one value at a time, for live bars: each update costs O(1) instead of recomputing the
+indicator from the full history as the functions of features and moving_average do.
+
+The scalar classes (SMA, EMA, RollingStd, UpDownCount, MACrossover) follow a single series. The bank classes
+(SMABank, EMABank, ...) follow n_symbols series at once, each update taking one value per symbol as a numpy array.
+
+All the indicators treat NaN values like pandas: the indicators over a window (SMA, RollingStd and their banks)
+are NaN while a NaN is in the window, as rolling(chk_size) is, and recover as soon as it leaves the window. The
+exponential averages skip the NaNs, keeping their previous value, as ewm(adjust=False, ignore_na=True) does.
+
+Example of use, following the 10/30 moving average crossover of 3000 symbols as the minute bars arrive:
+
+    crossover = MACrossoverBank(n_symbols=3000, chk_size_1=10, chk_size_2=30)
+    for bar_closes in minute_bars:  # arrays of 3000 close values
+        invest = crossover.update(bar_closes)
+"""
+
+import math
+from collections import deque
+
+import numpy as np
+
+
+class SMA:
+    """
+    Simple moving average of the last chk_size values, NaN until chk_size values have been seen and while a NaN is
+    in the window
+
+    >>> sma = SMA(chk_size=3)
+    >>> [sma.update(value) for value in [1, 2, 3, 4, 5]]
+    [nan, nan, 2.0, 3.0, 4.0]
+    >>> sma.snapshot()
+    {'value': 4.0, 'count': 5}
+    >>> [sma.update(value) for value in [float('nan'), 1, 2, 3]]
+    [nan, nan, nan, 2.0]
+    """
+
+    __slots__ = ('chk_size', 'value', 'count', '_window', '_pos', '_sum', '_n_nan')
+
+    def __init__(self, chk_size):
+        self.chk_size = chk_size
+        self.value = math.nan
+        self.count = 0
+        self._window = [0.0] * chk_size
+        self._pos = 0
+        # the sum of the values of the window which are not NaN, and the number of NaNs in the window
+        self._sum = 0.0
+        self._n_nan = 0
+
+    def update(self, value):
+        old_value = self._window[self._pos]
+        if math.isnan(old_value):
+            self._n_nan -= 1
+        else:
+            self._sum -= old_value
+        if math.isnan(value):
+            self._n_nan += 1
+        else:
+            self._sum += value
+        self._window[self._pos] = value
+        self._pos += 1
+        if self._pos == self.chk_size:
+            self._pos = 0
+        if self._n_nan == 0 and (self._pos == 0 or math.isnan(old_value)):
+            # resum once per window to keep the rounding errors of the running sum from accumulating, and when the
+            # last NaN leaves the window
+            self._sum = math.fsum(self._window)
+        self.count += 1
+        if self.count >= self.chk_size:
+            self.value = math.nan if self._n_nan else self._sum / self.chk_size
+        return self.value
+
+    def snapshot(self):
+        return {'value': self.value, 'count': self.count}
+
+
+class EMA:
+    """
+    Exponential moving average, value = alpha * new_value + (1 - alpha) * value, starting at the first value.
+    Either alpha or span (alpha = 2 / (span + 1)) must be given, as in pandas ewm with adjust=False.
+    The NaN values are skipped.
+
+    >>> ema = EMA(alpha=0.5)
+    >>> [ema.update(value) for value in [1, 2, float('nan'), 3]]
+    [1.0, 1.5, 1.5, 2.25]
+    """
+
+    __slots__ = ('alpha', 'value', 'count')
+
+    def __init__(self, span=None, alpha=None):
+        assert (span is None) != (alpha is None), 'Give either span or alpha'
+        self.alpha = alpha if alpha is not None else 2 / (span + 1)
+        self.value = math.nan
+        self.count = 0
+
+    def update(self, value):
+        if math.isnan(self.value):
+            self.value = float(value)
+        elif not math.isnan(value):
+            self.value += self.alpha * (value - self.value)
+        self.count += 1
+        return self.value
+
+    def snapshot(self):
+        return {'value': self.value, 'count': self.count}
+
+
+class RollingStd:
+    """
+    Standard deviation of the last chk_size values (np.std(window, ddof=ddof)), NaN until the window is full and
+    while a NaN is in the window. The mean and sum of squared deviations are updated with Welford's formulas for a
+    sliding window, and recomputed from the window when the last NaN leaves it.
+
+    >>> rolling_std = RollingStd(chk_size=3)
+    >>> [round(rolling_std.update(value), 4) for value in [1, 2, 3, 5]]
+    [nan, nan, 0.8165, 1.2472]
+    >>> [round(rolling_std.update(value), 4) for value in [float('nan'), 1, 2, 3]]
+    [nan, nan, nan, 0.8165]
+    """
+
+    __slots__ = ('chk_size', 'ddof', 'value', 'count', '_window', '_mean', '_m2', '_n_nan')
+
+    def __init__(self, chk_size, ddof=0):
+        self.chk_size = chk_size
+        self.ddof = ddof
+        self.value = math.nan
+        self.count = 0
+        self._window = deque()
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._n_nan = 0
+
+    def update(self, value):
+        had_nan = self._n_nan > 0
+        self._window.append(value)
+        self._n_nan += math.isnan(value)
+        old_value = self._window.popleft() if len(self._window) > self.chk_size else None
+        if old_value is not None and math.isnan(old_value):
+            self._n_nan -= 1
+
+        if self._n_nan:
+            # the mean and m2 are meaningless while there is a NaN in the window
+            pass
+        elif had_nan:
+            self._mean = math.fsum(self._window) / len(self._window)
+            self._m2 = math.fsum((x - self._mean) ** 2 for x in self._window)
+        elif old_value is not None:
+            new_mean = self._mean + (value - old_value) / self.chk_size
+            self._m2 += (value - old_value) * (value - new_mean + old_value - self._mean)
+            self._mean = new_mean
+        else:
+            delta = value - self._mean
+            self._mean += delta / len(self._window)
+            self._m2 += delta * (value - self._mean)
+        self.count += 1
+        if self.count >= self.chk_size:
+            self.value = (
+                math.nan
+                if self._n_nan
+                else math.sqrt(max(self._m2, 0.0) / (self.chk_size - self.ddof))
+            )
+        return self.value
+
+    def snapshot(self):
+        return {'value': self.value, 'mean': self._mean, 'count': self.count}
+
+
+class UpDownCount:
+    """
+    The window_up_down_count(window, n_derivative) of the window of the last chk_size values, None until the window
+    is full. The differences are updated order by order, with the same arithmetic as np.diff.
+
+    >>> counter = UpDownCount(chk_size=4)
+    >>> [counter.update(value) for value in [1, 2, 3, 2, 2]]
+    [None, None, None, (2, 1), (2, 1)]
+    """
+
+    __slots__ = ('chk_size', 'n_derivative', 'n_up', 'count', '_last_diffs', '_ups')
+
+    def __init__(self, chk_size, n_derivative=0):
+        assert chk_size - n_derivative - 1 >= 1, 'The window is too small for this n_derivative'
+        self.chk_size = chk_size
+        self.n_derivative = n_derivative
+        self.n_up = 0
+        self.count = 0
+        # the last value of the differences of each order, 0 to n_derivative
+        self._last_diffs = [0.0] * (n_derivative + 1)
+        # whether each of the (n_derivative + 1)-th differences of the window are >= 0
+        self._ups = deque()
+
+    def update(self, value):
+        diff = value
+        for order in range(self.n_derivative + 1):
+            previous, self._last_diffs[order] = self._last_diffs[order], diff
+            diff = diff - previous
+        self.count += 1
+        if self.count > self.n_derivative + 1:
+            is_up = diff >= 0
+            self._ups.append(is_up)
+            self.n_up += is_up
+            if len(self._ups) > self.chk_size - self.n_derivative - 1:
+                self.n_up -= self._ups.popleft()
+        if self.count < self.chk_size:
+            return None
+        return self.n_up, len(self._ups) - self.n_up
+
+    def snapshot(self):
+        if self.count < self.chk_size:
+            return {'n_up': None, 'n_down': None, 'count': self.count}
+        return {'n_up': self.n_up, 'n_down': len(self._ups) - self.n_up, 'count': self.count}
+
+
+class MACrossover:
+    """
+    The invest (1) / devest (0) state of the moving average crossover strategy of
+    backtesting_examples.invest_with_sma: invest while the average of the last chk_size_1 values is more than
+    thres_invest above the average of the last chk_size_2 values, devest when it is less than thresh_devest above it
+    (and keep the previous state in between). The state is 1 until chk_size_2 values have been seen.
+
+    >>> crossover = MACrossover(chk_size_1=1, chk_size_2=2)
+    >>> [crossover.update(value) for value in [1, 2, 3, 2, 1]]
+    [1, 1, 1, 0, 0]
+    """
+
+    __slots__ = ('sma_1', 'sma_2', 'thres_invest', 'thresh_devest', 'state', 'diff')
+
+    def __init__(self, chk_size_1, chk_size_2, thres_invest=0.5, thresh_devest=0.5):
+        chk_size_1, chk_size_2 = sorted([chk_size_1, chk_size_2])
+        self.sma_1 = SMA(chk_size_1)
+        self.sma_2 = SMA(chk_size_2)
+        self.thres_invest = thres_invest
+        self.thresh_devest = thresh_devest
+        self.state = 1
+        self.diff = math.nan
+
+    def update(self, value):
+        self.diff = self.sma_1.update(value) - self.sma_2.update(value)
+        if self.diff > self.thres_invest:
+            self.state = 1
+        elif self.diff < self.thresh_devest:
+            self.state = 0
+        return self.state
+
+    def snapshot(self):
+        return {
+            'state': self.state,
+            'diff': self.diff,
+            'ma_1': self.sma_1.value,
+            'ma_2': self.sma_2.value,
+        }
+
+
+class SMABank:
+    """
+    SMA of n_symbols series at once. A NaN value makes the average of its symbol NaN until it leaves the window.
+
+    >>> bank = SMABank(n_symbols=2, chk_size=2)
+    >>> _ = bank.update(np.array([1.0, 10.0]))
+    >>> bank.update(np.array([2.0, 30.0])).tolist()
+    [1.5, 20.0]
+    >>> [bank.update(np.array(values)).tolist() for values in [[np.nan, 10.0], [4.0, 20.0], [6.0, 30.0]]]
+    [[nan, 20.0], [nan, 15.0], [5.0, 25.0]]
+    """
+
+    __slots__ = ('chk_size', 'value', 'count', '_window', '_pos', '_sum', '_n_nan')
+
+    def __init__(self, n_symbols, chk_size, dtype=float):
+        self.chk_size = chk_size
+        self.value = np.full(n_symbols, np.nan, dtype=dtype)
+        self.count = 0
+        self._window = np.zeros((chk_size, n_symbols), dtype=dtype)
+        self._pos = 0
+        # the sums of the values of the window which are not NaN, and the numbers of NaNs in the window
+        self._sum = np.zeros(n_symbols, dtype=dtype)
+        self._n_nan = np.zeros(n_symbols, dtype=np.int64)
+
+    def update(self, values):
+        old_values = self._window[self._pos]
+        old_nan, new_nan = np.isnan(old_values), np.isnan(values)
+        self._sum += np.where(new_nan, 0, values) - np.where(old_nan, 0, old_values)
+        self._n_nan += new_nan
+        self._n_nan -= old_nan
+        self._window[self._pos] = values
+        self._pos += 1
+        if self._pos == self.chk_size:
+            self._pos = 0
+            # resum once per window to keep the rounding errors of the running sums from accumulating
+            np.nansum(self._window, axis=0, out=self._sum)
+        else:
+            # and resum the symbols whose last NaN just left the window
+            cleared = old_nan & (self._n_nan == 0)
+            if cleared.any():
+                self._sum[cleared] = self._window[:, cleared].sum(axis=0)
+        self.count += 1
+        if self.count >= self.chk_size:
+            np.divide(self._sum, self.chk_size, out=self.value)
+            self.value[self._n_nan > 0] = np.nan
+        return self.value
+
+    def snapshot(self):
+        return {'value': self.value.copy(), 'count': self.count}
+
+
+class EMABank:
+    """
+    EMA of n_symbols series at once. The symbols whose value is NaN keep their previous average and each
+    symbol starts at its first non NaN value.
+
+    >>> bank = EMABank(n_symbols=2, alpha=0.5)
+    >>> _ = bank.update(np.array([1.0, np.nan]))
+    >>> bank.update(np.array([2.0, 4.0])).tolist()
+    [1.5, 4.0]
+    """
+
+    __slots__ = ('alpha', 'value', 'count')
+
+    def __init__(self, n_symbols, span=None, alpha=None, dtype=float):
+        assert (span is None) != (alpha is None), 'Give either span or alpha'
+        self.alpha = alpha if alpha is not None else 2 / (span + 1)
+        self.value = np.full(n_symbols, np.nan, dtype=dtype)
+        self.count = 0
+
+    def update(self, values):
+        updated = self.value + self.alpha * (values - self.value)
+        # start from the value itself where there is no average yet, keep the average where there is no value
+        updated = np.where(np.isnan(self.value), values, updated)
+        self.value = np.where(np.isnan(values), self.value, updated)
+        self.count += 1
+        return self.value
+
+    def snapshot(self):
+        return {'value': self.value.copy(), 'count': self.count}
+
+
+class RollingStdBank:
+    """
+    RollingStd of n_symbols series at once. A NaN value makes the std of its symbol NaN until it leaves the window.
+
+    >>> bank = RollingStdBank(n_symbols=2, chk_size=2)
+    >>> _ = bank.update(np.array([1.0, 10.0]))
+    >>> bank.update(np.array([3.0, 10.0])).tolist()
+    [1.0, 0.0]
+    >>> [bank.update(np.array(values)).tolist() for values in [[np.nan, 12.0], [4.0, 12.0], [6.0, 8.0]]]
+    [[nan, 1.0], [nan, 0.0], [1.0, 2.0]]
+    """
+
+    __slots__ = ('chk_size', 'ddof', 'value', 'count', '_window', '_pos', '_mean', '_m2', '_n_nan')
+
+    def __init__(self, n_symbols, chk_size, ddof=0, dtype=float):
+        self.chk_size = chk_size
+        self.ddof = ddof
+        self.value = np.full(n_symbols, np.nan, dtype=dtype)
+        self.count = 0
+        self._window = np.zeros((chk_size, n_symbols), dtype=dtype)
+        self._pos = 0
+        self._mean = np.zeros(n_symbols, dtype=dtype)
+        self._m2 = np.zeros(n_symbols, dtype=dtype)
+        self._n_nan = np.zeros(n_symbols, dtype=np.int64)
+
+    def update(self, values):
+        # the mean and m2 of the symbols with a NaN in the window become NaN, until the window has no NaN left
+        if self.count >= self.chk_size:
+            old_values = self._window[self._pos]
+            old_nan = np.isnan(old_values)
+            new_mean = self._mean + (values - old_values) / self.chk_size
+            self._m2 += (values - old_values) * (values - new_mean + old_values - self._mean)
+            self._mean = new_mean
+        else:
+            old_nan = np.zeros(len(values), dtype=bool)
+            delta = values - self._mean
+            self._mean += delta / (self.count + 1)
+            self._m2 += delta * (values - self._mean)
+        self._n_nan += np.isnan(values)
+        self._n_nan -= old_nan
+        self._window[self._pos] = values
+        self._pos = (self._pos + 1) % self.chk_size
+        self.count += 1
+
+        cleared = old_nan & (self._n_nan == 0)
+        if cleared.any():
+            # recompute the symbols whose last NaN just left the window from their full window
+            window = self._window[:, cleared]
+            self._mean[cleared] = window.mean(axis=0)
+            self._m2[cleared] = ((window - self._mean[cleared]) ** 2).sum(axis=0)
+        if self.count >= self.chk_size:
+            np.sqrt(np.clip(self._m2, 0, None) / (self.chk_size - self.ddof), out=self.value)
+            self.value[self._n_nan > 0] = np.nan
+        return self.value
+
+    def snapshot(self):
+        return {'value': self.value.copy(), 'mean': self._mean.copy(), 'count': self.count}
+
+
+class UpDownCountBank:
+    """
+    UpDownCount of n_symbols series at once, the counts being NaN until the window is full
+
+    >>> bank = UpDownCountBank(n_symbols=2, chk_size=3)
+    >>> for values in [[1, 3], [2, 2], [3, 1]]:
+    ...     n_up, n_down = bank.update(np.array(values, dtype=float))
+    >>> n_up.tolist(), n_down.tolist()
+    ([2.0, 0.0], [0.0, 2.0])
+    """
+
+    __slots__ = ('chk_size', 'n_derivative', 'n_up', 'count', '_last_diffs', '_ups', '_pos')
+
+    def __init__(self, n_symbols, chk_size, n_derivative=0):
+        assert chk_size - n_derivative - 1 >= 1, 'The window is too small for this n_derivative'
+        self.chk_size = chk_size
+        self.n_derivative = n_derivative
+        self.n_up = np.zeros(n_symbols, dtype=np.int64)
+        self.count = 0
+        self._last_diffs = np.zeros((n_derivative + 1, n_symbols))
+        self._ups = np.zeros((chk_size - n_derivative - 1, n_symbols), dtype=np.int64)
+        self._pos = 0
+
+    def update(self, values):
+        diff = values
+        for order in range(self.n_derivative + 1):
+            previous = self._last_diffs[order].copy()
+            self._last_diffs[order] = diff
+            diff = diff - previous
+        self.count += 1
+        if self.count > self.n_derivative + 1:
+            is_up = (diff >= 0).astype(np.int64)
+            self.n_up += is_up - self._ups[self._pos]
+            self._ups[self._pos] = is_up
+            self._pos = (self._pos + 1) % len(self._ups)
+        if self.count < self.chk_size:
+            nan = np.full(len(self.n_up), np.nan)
+            return nan, nan
+        return self.n_up.astype(float), (len(self._ups) - self.n_up).astype(float)
+
+    def snapshot(self):
+        n_up, n_down = (
+            (self.n_up.copy(), len(self._ups) - self.n_up) if self.count >= self.chk_size else (None, None)
+        )
+        return {'n_up': n_up, 'n_down': n_down, 'count': self.count}
+
+
+class MACrossoverBank:
+    """
+    MACrossover of n_symbols series at once
+
+    >>> bank = MACrossoverBank(n_symbols=2, chk_size_1=1, chk_size_2=2)
+    >>> [bank.update(np.array(values, dtype=float)).tolist() for values in [[1, 3], [2, 2], [3, 1]]]
+    [[1, 1], [1, 0], [1, 0]]
+    """
+
+    __slots__ = ('sma_1', 'sma_2', 'thres_invest', 'thresh_devest', 'state', 'diff')
+
+    def __init__(self, n_symbols, chk_size_1, chk_size_2, thres_invest=0.5, thresh_devest=0.5):
+        chk_size_1, chk_size_2 = sorted([chk_size_1, chk_size_2])
+        self.sma_1 = SMABank(n_symbols, chk_size_1)
+        self.sma_2 = SMABank(n_symbols, chk_size_2)
+        self.thres_invest = thres_invest
+        self.thresh_devest = thresh_devest
+        self.state = np.ones(n_symbols, dtype=np.int8)
+        self.diff = np.full(n_symbols, np.nan)
+
+    def update(self, values):
+        self.diff = self.sma_1.update(values) - self.sma_2.update(values)
+        self.state[self.diff > self.thres_invest] = 1
+        self.state[self.diff < self.thresh_devest] = 0
+        return self.state
+
+    def snapshot(self):
+        return {
+            'state': self.state.copy(),
+            'diff': self.diff.copy(),
+            'ma_1': self.sma_1.value.copy(),
+            'ma_2': self.sma_2.value.copy(),
+        }
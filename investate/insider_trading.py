@@ -8,6 +8,7 @@ from tiingo import TiingoClient
 import pandas_datareader as pdr
 from investate.file_utils import *
 import progressbar
+from investate.instrumentation import timed, add_counts, file_size
 
 
 # each page has 20 rows, each is one insider purchase
@@ -191,6 +192,7 @@ def get_insider_purchase_performance(
     return insider_purchase_return
 
 
+@timed(count_records=len)
 def pull_data_for_tickers(
     tickers,
     tiingo_api_key,
@@ -205,6 +207,7 @@ def pull_data_for_tickers(
     """
 
     if load_only:
+        add_counts(bytes_read=file_size(save_to))
         return pickle_load(save_to)
 
     tickers = list(set(tickers))
@@ -224,11 +227,13 @@ def pull_data_for_tickers(
     bar.start()
 
     if check_existing and save_to:
+        add_counts(bytes_read=file_size(save_to))
         result = pickle_load(save_to)
 
     for idx, ticker in enumerate(tickers):
         # if ticker has not data existing locally already or check_existing is set to False, fetch the data with tiingo
         if ticker not in result.keys() or not check_existing:
+            add_counts(cache_misses=1)
             try:
                 ticker_df = pdr.get_data_tiingo(
                     ticker,
@@ -244,6 +249,8 @@ def pull_data_for_tickers(
                 result[ticker] = None
         # otherwise, some data exist locally, only fetch the new dates and concatenate to the existing
         else:
+            # only the new dates are fetched
+            add_counts(cache_hits=1)
             existing_data = result[ticker]
             try:
                 last_data_day = existing_data.index[-1][1].replace(tzinfo=None)
@@ -270,6 +277,7 @@ def pull_data_for_tickers(
     bar.finish()
     if save_to:
         pickle_dump(result, save_to)
+        add_counts(bytes_written=file_size(save_to))
 
     return result
 
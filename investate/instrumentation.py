@@ -0,0 +1,217 @@
+"""
+Opt-in instrumentation of the hot paths of investate: fetches, cache reads and writes, feature computations and
+simulations. When enabled, each call of a function decorated with timed emits a record (its name, duration and
+counters such as the number of records, the bytes read and written and the cache hits and misses) to the sinks:
+a log, a csv file or an in memory aggregator. When disabled, which is the default, the only overhead is the check
+of a global flag.
+
+Example of use:
+
+    sink = MemorySink()
+    enable(sink)
+    df = fetch_data_and_cache('QQQ', '2021-01-01', '2021-06-01')
+    ma = moving_stats(df['close'], 30)
+    disable()
+    print(sink.summary())
+"""
+
+import csv
+import functools
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+import pandas as pd
+
+# the counters the instrumented functions may report, in the order of the csv columns
+COUNTERS = ('n_records', 'bytes_read', 'bytes_written', 'cache_hits', 'cache_misses')
+
+_enabled = False
+_sinks = []
+# the records of the timed calls going on in each thread, the innermost last
+_local = threading.local()
+
+
+def enable(*sinks):
+    """
+    Turn the instrumentation on, adding sinks to the sinks records are emitted to
+
+    >>> sink = MemorySink()
+    >>> enable(sink)
+    >>> is_enabled()
+    True
+    >>> disable()
+    >>> is_enabled()
+    False
+    """
+    global _enabled
+    _sinks.extend(sinks)
+    _enabled = True
+
+
+def disable(remove_sinks=True):
+    """Turn the instrumentation off, and forget the sinks unless remove_sinks is False"""
+    global _enabled
+    _enabled = False
+    if remove_sinks:
+        _sinks.clear()
+
+
+def is_enabled():
+    """Whether the instrumentation is on"""
+    return _enabled
+
+
+def _record_stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def add_counts(**counts):
+    """
+    Add counts, such as bytes_read=1024 or cache_hits=1, to the record of the innermost timed call going on.
+    Does nothing if the instrumentation is disabled or outside of a timed call.
+    """
+    if not _enabled:
+        return
+    stack = _record_stack()
+    if stack:
+        record = stack[-1]
+        for counter, count in counts.items():
+            record[counter] = record.get(counter, 0) + count
+
+
+def emit(record):
+    """Send a record, a dict with at least a name, to all the sinks"""
+    for sink in _sinks:
+        sink(record)
+
+
+def timed(name=None, count_records=None):
+    """
+    Decorator emitting a record for each call of the decorated function, when the instrumentation is enabled.
+
+    :param name: the name of the records, the qualified name of the function by default
+    :param count_records: optional function of the output of the decorated function returning its number of records
+
+    >>> @timed(count_records=len)
+    ... def double(values):
+    ...     return [2 * value for value in values]
+    >>> sink = MemorySink()
+    >>> enable(sink)
+    >>> double([1, 2, 3])
+    [2, 4, 6]
+    >>> disable()
+    >>> double([1, 2])  # not recorded
+    [2, 4]
+    >>> stats = sink.stats['double']
+    >>> stats['calls'], stats['n_records']
+    (1, 3)
+    """
+
+    def decorator(func):
+        record_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            stack = _record_stack()
+            record = {'name': record_name}
+            stack.append(record)
+            tic = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+                if count_records is not None:
+                    record['n_records'] = record.get('n_records', 0) + count_records(result)
+                return result
+            finally:
+                record['seconds'] = time.perf_counter() - tic
+                record['timestamp'] = time.time()
+                stack.pop()
+                emit(record)
+
+        return wrapper
+
+    return decorator
+
+
+def file_size(path):
+    """The size of the file at path, 0 if there is none"""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+class MemorySink:
+    """
+    Aggregate the records in memory, per name: number of calls, total and max duration and the sum of the counters.
+    The aggregates can be read from stats at any time, or as a df from summary.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = defaultdict(lambda: defaultdict(float))
+
+    def __call__(self, record):
+        with self._lock:
+            stats = self.stats[record['name']]
+            stats['calls'] = int(stats['calls']) + 1
+            stats['total_seconds'] += record.get('seconds', 0)
+            stats['max_seconds'] = max(stats['max_seconds'], record.get('seconds', 0))
+            for counter in COUNTERS:
+                if counter in record:
+                    stats[counter] = stats.get(counter, 0) + record[counter]
+
+    def summary(self):
+        """A df with one row per name, with the aggregates and the cache hit ratio"""
+        with self._lock:
+            summary = pd.DataFrame({name: dict(stats) for name, stats in self.stats.items()}).T
+        if {'cache_hits', 'cache_misses'} <= set(summary.columns):
+            lookups = summary['cache_hits'].fillna(0) + summary['cache_misses'].fillna(0)
+            summary['cache_hit_ratio'] = summary['cache_hits'].fillna(0) / lookups.where(lookups > 0)
+        return summary
+
+    def clear(self):
+        with self._lock:
+            self.stats.clear()
+
+
+class LogSink:
+    """Log each record with logger, the investate logger by default"""
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger('investate')
+        self.level = level
+
+    def __call__(self, record):
+        counts = ' '.join(
+            f'{counter}={record[counter]}' for counter in COUNTERS if counter in record
+        )
+        self.logger.log(
+            self.level, f"{record['name']} took {record.get('seconds', 0):.6f}s {counts}"
+        )
+
+
+class CSVSink:
+    """Append each record as a row of the csv file at path, writing the header if the file is new"""
+
+    columns = ('timestamp', 'name', 'seconds') + COUNTERS
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        with self._lock:
+            is_new = not os.path.isfile(self.path)
+            with open(self.path, 'a', newline='') as outfile:
+                writer = csv.DictWriter(outfile, fieldnames=self.columns, extrasaction='ignore')
+                if is_new:
+                    writer.writeheader()
+                writer.writerow(record)
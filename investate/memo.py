@@ -0,0 +1,289 @@
+"""
+Memoization of computations on arrays, keyed by a hash of the content of the arrays and of the parameters of the
+computation, so that the same moving average of the same series is computed only once, even across sessions if
+a cache_dir is given.
+
+Example of use:
+
+    memo = ArrayMemo(max_bytes=512 * 2 ** 20, cache_dir='~/invest/memo')
+    ma = memo.get_or_compute((series, 'moving_stats', 30, np.mean), lambda: moving_stats(series, 30))
+    print(memo.stats())
+"""
+
+import copy
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class Uncacheable(Exception):
+    """Raised when some part of a key can't be reliably hashed, e.g. a lambda"""
+
+
+def array_digest(array):
+    """
+    A hash of the content, dtype and shape of an array
+
+    >>> array_digest([1, 2, 3]) == array_digest(np.array([1, 2, 3]))
+    True
+    >>> array_digest([1, 2, 3]) == array_digest([1, 2, 4])
+    False
+    """
+    array = np.ascontiguousarray(array)
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(f'{array.dtype.str}{array.shape}'.encode())
+    hasher.update(array.view(np.uint8).data if array.size else b'')
+    return hasher.hexdigest()
+
+
+@functools.lru_cache(maxsize=1024)
+def _code_version(func):
+    """
+    A hash of the source of func, so that the results cached on disk are not used anymore once its code changes.
+    Functions without python source, such as numpy ufuncs, get the version of their package instead.
+    """
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        package = sys.modules.get((getattr(func, '__module__', None) or '').split('.')[0])
+        source = str(getattr(package, '__version__', ''))
+    return hashlib.blake2b(source.encode(), digest_size=8).hexdigest()
+
+
+def _key_token(part):
+    """
+    String standing for one part of a key: the digest of arrays, the full name and code version of functions, the
+    repr of the rest
+    """
+    if isinstance(part, (np.ndarray, list)):
+        try:
+            array = np.asarray(part)
+        except ValueError:
+            # ragged lists
+            raise Uncacheable('Can not key on a ragged list')
+        if array.dtype.hasobject:
+            raise Uncacheable('Can not key on an array of objects')
+        return array_digest(array)
+    if isinstance(part, tuple):
+        return '(' + ','.join(_key_token(p) for p in part) + ')'
+    if callable(part):
+        name = f"{getattr(part, '__module__', '')}.{getattr(part, '__qualname__', '')}"
+        # lambdas and local functions may have the same name and do different things
+        if '<lambda>' in name or '<locals>' in name or name == '.':
+            raise Uncacheable(f'Can not key on {part}')
+        try:
+            return f'{name}:{_code_version(part)}'
+        except TypeError:
+            # unhashable callables
+            raise Uncacheable(f'Can not key on {part}')
+    if part is None or isinstance(part, (bool, int, float, str, np.number)):
+        return repr(part)
+    raise Uncacheable(f'Can not key on {part}')
+
+
+def _nbytes(value):
+    """Approximate size of a cached value"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if hasattr(value, 'memory_usage'):
+        # pandas objects
+        return int(np.sum(value.memory_usage(index=True)))
+    if isinstance(value, dict):
+        return sum(_nbytes(val) for val in value.values())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_nbytes(val) for val in value)
+    return sys.getsizeof(value)
+
+
+def _freeze(value):
+    """Make the arrays of a cached value, possibly nested in dicts, lists and tuples, read only"""
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    elif isinstance(value, dict):
+        for val in value.values():
+            _freeze(val)
+    elif isinstance(value, (list, tuple)):
+        for val in value:
+            _freeze(val)
+
+
+def _private_copy(value):
+    """
+    A copy of a cached value that its caller can modify without modifying the cache. The read only arrays are
+    shared rather than copied.
+
+    >>> cached = {'df_like': [1, 2], 'array': np.zeros(2)}
+    >>> _freeze(cached)
+    >>> private = _private_copy(cached)
+    >>> private['df_like'].append(3)
+    >>> cached['df_like'], private['array'] is cached['array']
+    ([1, 2], True)
+    """
+    if isinstance(value, np.ndarray):
+        return value if not value.flags.writeable else value.copy()
+    if value is None or isinstance(value, (bool, int, float, complex, str, bytes, np.generic)):
+        return value
+    if isinstance(value, dict):
+        return {key: _private_copy(val) for key, val in value.items()}
+    if isinstance(value, list):
+        return [_private_copy(val) for val in value]
+    if isinstance(value, tuple):
+        copied = [_private_copy(val) for val in value]
+        # namedtuples are rebuilt with their fields
+        return type(value)._make(copied) if hasattr(value, '_fields') else tuple(copied)
+    if hasattr(value, 'memory_usage'):
+        # pandas objects
+        return value.copy()
+    return copy.deepcopy(value)
+
+
+class ArrayMemo:
+    """
+    Two tier memo: an in memory LRU holding at most max_bytes of results and, optionally, a cache_dir on disk
+    persisting them across runs. The keys are made of arrays (hashed by content), functions (by full name) and
+    simple values. Functions are keyed on their code too, so that the disk tier is invalidated when it changes.
+    Keys which can't be reliably hashed, like those involving lambdas or arrays of objects, bypass the memo.
+    Cached arrays are made read only since they are shared by all the callers, and the callers get copies of the
+    other values, such as dfs, so that modifying them does not modify the cache.
+
+    >>> memo = ArrayMemo(max_bytes=1000)
+    >>> memo.get_or_compute(([1, 2, 3], np.cumsum), lambda: np.cumsum([1, 2, 3])).tolist()
+    [1, 3, 6]
+    >>> memo.get_or_compute(([1, 2, 3], np.cumsum), lambda: np.cumsum([1, 2, 3])).tolist()
+    [1, 3, 6]
+    >>> memo.stats()
+    {'hits': 1, 'disk_hits': 0, 'misses': 1, 'bypasses': 0, 'evictions': 0, 'n_items': 1, 'nbytes': 24, 'hit_ratio': 0.5}
+
+    Arrays of objects can't be hashed by content, so they bypass the memo
+
+    >>> memo.get_or_compute(([1, 'a', None], len), lambda: 3)
+    3
+    >>> memo.stats()['bypasses']
+    1
+    """
+
+    def __init__(self, max_bytes=256 * 2 ** 20, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = os.path.expanduser(cache_dir) if cache_dir else None
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(key_parts):
+        """The string key of a tuple of key parts, raising Uncacheable if it can't be made"""
+        return hashlib.blake2b(_key_token(tuple(key_parts)).encode(), digest_size=20).hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.pkl')
+
+    def _remember(self, key, value):
+        _freeze(value)
+        size = _nbytes(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                return
+            self._items[key] = (value, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, old_size) = self._items.popitem(last=False)
+                self.nbytes -= old_size
+                self.evictions += 1
+
+    def __contains__(self, key_parts):
+        """Whether the result for key_parts is in the memory tier"""
+        try:
+            return self.make_key(key_parts) in self._items
+        except Uncacheable:
+            return False
+
+    def discard(self, key_parts):
+        """
+        Forget the result for key_parts, in memory and on disk, so that the next call computes it again
+
+        >>> memo = ArrayMemo()
+        >>> _ = memo.get_or_compute(('answer',), lambda: 42)
+        >>> memo.discard(('answer',))
+        >>> ('answer',) in memo
+        False
+        """
+        try:
+            key = self.make_key(key_parts)
+        except Uncacheable:
+            return
+        with self._lock:
+            if key in self._items:
+                _, size = self._items.pop(key)
+                self.nbytes -= size
+        if self.cache_dir and os.path.isfile(self._disk_path(key)):
+            os.remove(self._disk_path(key))
+
+    def get_or_compute(self, key_parts, compute):
+        """Return the cached result for key_parts, computing it with compute() and caching it if needed"""
+        try:
+            key = self.make_key(key_parts)
+        except Uncacheable:
+            self.bypasses += 1
+            return compute()
+
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return _private_copy(self._items[key][0])
+
+        if self.cache_dir and os.path.isfile(self._disk_path(key)):
+            with open(self._disk_path(key), 'rb') as infile:
+                value = pickle.load(infile)
+            self.disk_hits += 1
+            self._remember(key, value)
+            return _private_copy(value)
+
+        self.misses += 1
+        value = compute()
+        self._remember(key, value)
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f'{self._disk_path(key)}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as outfile:
+                pickle.dump(value, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._disk_path(key))
+        return _private_copy(value)
+
+    def stats(self):
+        """Counters of the memo, to tune its sizes"""
+        n_lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'bypasses': self.bypasses,
+            'evictions': self.evictions,
+            'n_items': len(self._items),
+            'nbytes': self.nbytes,
+            'hit_ratio': (self.hits + self.disk_hits) / n_lookups if n_lookups else 0.0,
+        }
+
+    def clear(self, disk=False):
+        """Empty the in memory tier, and the disk tier too if disk is True"""
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+        if disk and self.cache_dir and os.path.isdir(self.cache_dir):
+            for filename in os.listdir(self.cache_dir):
+                if filename.endswith('.pkl'):
+                    os.remove(os.path.join(self.cache_dir, filename))
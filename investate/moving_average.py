@@ -12,47 +12,71 @@ plot_mas(**get_comp_ma(series, chk_size_1=10, chk_size_2=20, chk_step=1, chk_fun
 """
 import numpy as np
 from investate.features import moving_stats
+from investate.memo import ArrayMemo
+from investate.plotting import plot_downsampled, DFLT_MAX_POINTS
 import matplotlib.pyplot as plt
 
+# memo shared by the moving averages computations, see cached_moving_stats
+MA_MEMO = ArrayMemo(max_bytes=256 * 2 ** 20)
+
+
+def cached_moving_stats(series, chk_size, chk_step=1, chk_func=np.mean, memo=MA_MEMO):
+    """
+    moving_stats as a (read only) array, memoized in memo so that the same stats of the same series are only
+    computed once. Use memo=None to skip the memo.
+
+    >>> cached_moving_stats([1, 2, 3, 4], chk_size=2, memo=ArrayMemo()).tolist()
+    [1.5, 2.5, 3.5]
+    """
+    series = np.asarray(series)
+    compute = lambda: np.array(moving_stats(series, chk_size, chk_step=chk_step, chk_func=chk_func))
+    if memo is None:
+        return compute()
+    # keyed on moving_stats itself, so that the cached stats are recomputed when its code changes
+    return memo.get_or_compute((series, moving_stats, chk_size, chk_step, chk_func), compute)
+
+
 def get_comp_ma(
-    series, chk_size_1, chk_size_2, chk_step=1, chk_func_1=np.mean, chk_func_2=np.mean,
+    series, chk_size_1, chk_size_2, chk_step=1, chk_func_1=np.mean, chk_func_2=np.mean, memo=MA_MEMO,
 ):
     """
-    Convenience function to compute and align the moving average of a series
+    Convenience function to compute and align the moving average of a series.
+    The moving averages are memoized in memo (see cached_moving_stats), and computed on the whole series when
+    chk_step is 1, so that a grid search over (chk_size_1, chk_size_2) computes each of them once.
     """
 
     # make chk_size_1 is always the smallest
     chk_size_1, chk_size_2 = np.sort([chk_size_1, chk_size_2])
     offset = chk_size_2 - chk_size_1
-    series = list(series)
-    stat_series_1 = list(
-        moving_stats(
-            series[offset:], chk_size_1, chk_step=chk_step, chk_func=chk_func_1
-        )
-    )
-    stat_series_2 = list(
-        moving_stats(series, chk_size_2, chk_step=chk_step, chk_func=chk_func_2)
-    )
+    series = np.asarray(series)
+    if chk_step == 1:
+        # the stats of series[offset:] are the stats of series without the first offset ones
+        stat_series_1 = cached_moving_stats(series, chk_size_1, chk_step, chk_func_1, memo)[offset:]
+    else:
+        stat_series_1 = cached_moving_stats(series[offset:], chk_size_1, chk_step, chk_func_1, memo)
+    stat_series_2 = cached_moving_stats(series, chk_size_2, chk_step, chk_func_2, memo)
 
     return {
-        'stat_series_1': np.array(stat_series_1),
-        'stat_series_2': np.array(stat_series_2),
+        'stat_series_1': stat_series_1,
+        'stat_series_2': stat_series_2,
         'cut_series': np.array(series[chk_size_2 - 1 :]),
         'chk_size_1': chk_size_1,
         'chk_size_2': chk_size_2,
     }
 
 
-def plot_mas(stat_series_1, stat_series_2, cut_series, chk_size_1, chk_size_2):
+def plot_mas(
+    stat_series_1, stat_series_2, cut_series, chk_size_1, chk_size_2, max_points=DFLT_MAX_POINTS
+):
     """
-    Plot two moving averages on a single plot
+    Plot two moving averages on a single plot, each series being downsampled above max_points values
     """
 
     fig, ax = plt.subplots(nrows=1, ncols=1)
 
-    ax.plot(stat_series_1, label=f'ma_{chk_size_1}', linewidth=0.5)
-    ax.plot(stat_series_2, label=f'ma_{chk_size_2}', linewidth=0.5)
-    ax.plot(cut_series[:], label=f'series', linewidth=0.8)
+    plot_downsampled(ax, stat_series_1, max_points, label=f'ma_{chk_size_1}', linewidth=0.5)
+    plot_downsampled(ax, stat_series_2, max_points, label=f'ma_{chk_size_2}', linewidth=0.5)
+    plot_downsampled(ax, cut_series, max_points, label=f'series', linewidth=0.8)
     ax.legend()
 
     return fig, ax
@@ -1,6 +1,142 @@
 """Code to detect pattern in time series"""
 
+import numpy as np
 
-def detect_plateaux(series, min_length, smoothing, max_rate_deviation):
 
-    pass
\ No newline at end of file
+class PlateauDetector:
+    """
+    Detect plateaux in a series fed by chunks, in a single pass. The series is smoothed with a trailing moving
+    average of smoothing values and a plateau is a run of at least min_length consecutive points where the smoothed
+    series changes by at most max_rate_deviation (in relative terms) from one point to the next.
+    Only the last smoothing values and the start of the current run are carried from one chunk to the next, so
+    the series never has to be held in memory.
+
+    >>> detector = PlateauDetector(min_length=3, smoothing=1, max_rate_deviation=0.01)
+    >>> starts, ends = detector.update([1, 2, 2, 2])
+    >>> starts.tolist(), ends.tolist()  # the plateau is still running at the end of the chunk
+    ([], [])
+    >>> starts, ends = detector.update([2, 3, 4, 4, 4, 4])
+    >>> starts.tolist(), ends.tolist()
+    ([1], [5])
+    >>> starts, ends = detector.finalize()
+    >>> starts.tolist(), ends.tolist()
+    ([6], [10])
+    """
+
+    def __init__(self, min_length, smoothing=1, max_rate_deviation=0.001):
+        self.min_length = min_length
+        self.smoothing = smoothing
+        self.max_rate_deviation = max_rate_deviation
+        # the last smoothing values seen, needed to smooth the start of the next chunk
+        self._tail = np.empty(0)
+        # number of points seen so far
+        self._n_seen = 0
+        # index of the first flat step of the run of flat steps going on at the end of the last chunk, if any
+        self._run_start = None
+
+    def _flat_steps(self, chunk):
+        """Boolean array telling, for each point of the chunk, if the step from the previous point is flat"""
+        extended = np.concatenate([self._tail, chunk])
+        cumsum = np.concatenate([[0], np.cumsum(extended)])
+        smoothed = (cumsum[self.smoothing :] - cumsum[: -self.smoothing]) / self.smoothing
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rates = np.abs(smoothed[1:] / smoothed[:-1] - 1)
+        # rates[i] is the step ending at extended[i + smoothing]
+        flat = np.zeros(len(extended), dtype=bool)
+        flat[self.smoothing :] = rates <= self.max_rate_deviation
+        return flat[len(self._tail) :]
+
+    def _plateaux_of_runs(self, run_starts, run_ends):
+        """
+        Plateaux (start, end) made of the runs of flat steps [run_start, run_end), a run of k flat steps spanning
+        k + 1 points, starting one point before its first step
+        """
+        starts, ends = np.asarray(run_starts, dtype=np.int64) - 1, np.asarray(run_ends, dtype=np.int64)
+        long_enough = ends - starts >= self.min_length
+        return starts[long_enough], ends[long_enough]
+
+    def update(self, chunk):
+        """
+        Feed the next chunk of the series, returning the start and end indices (end excluded, indices counted
+        from the beginning of the series) of the plateaux which ended within the chunk
+        """
+        chunk = np.asarray(chunk, dtype=float)
+        flat = self._flat_steps(chunk)
+
+        # starts and ends of the runs of flat steps, in the chunk
+        edges = np.diff(np.concatenate([[False], flat, [False]]).astype(np.int8))
+        run_starts = np.flatnonzero(edges == 1) + self._n_seen
+        run_ends = np.flatnonzero(edges == -1) + self._n_seen
+
+        # a run going on at the end of the previous chunk continues if the chunk starts with a flat step
+        if self._run_start is not None:
+            if len(flat) and flat[0]:
+                run_starts[0] = self._run_start
+            elif len(flat):
+                run_starts = np.concatenate([[self._run_start], run_starts])
+                run_ends = np.concatenate([[self._n_seen], run_ends])
+        # a run going on at the end of the chunk is kept for later
+        if len(flat) and flat[-1]:
+            self._run_start = run_starts[-1]
+            run_starts, run_ends = run_starts[:-1], run_ends[:-1]
+        elif len(flat):
+            self._run_start = None
+
+        self._n_seen += len(chunk)
+        self._tail = np.concatenate([self._tail, chunk])[-self.smoothing :]
+        return self._plateaux_of_runs(run_starts, run_ends)
+
+    def finalize(self):
+        """Return the plateau going on at the end of the series, if any, once the series is fully fed"""
+        if self._run_start is None:
+            return self._plateaux_of_runs([], [])
+        run_start, self._run_start = self._run_start, None
+        return self._plateaux_of_runs([run_start], [self._n_seen])
+
+
+def detect_plateaux_in_chunks(chunks, min_length, smoothing=1, max_rate_deviation=0.001):
+    """
+    Detect the plateaux of a series given as an iterable of chunks, see PlateauDetector
+
+    :return: two int64 arrays, the starts and the ends (excluded) of the plateaux
+
+    >>> starts, ends = detect_plateaux_in_chunks([[1, 2, 2], [2, 2, 3], [3, 3, 3]], min_length=3,
+    ...                                          max_rate_deviation=0)
+    >>> starts.tolist(), ends.tolist()
+    ([1, 5], [5, 9])
+    """
+    detector = PlateauDetector(min_length, smoothing, max_rate_deviation)
+    all_starts, all_ends = [], []
+    for chunk in chunks:
+        starts, ends = detector.update(chunk)
+        all_starts.append(starts)
+        all_ends.append(ends)
+    starts, ends = detector.finalize()
+    all_starts.append(starts)
+    all_ends.append(ends)
+    return np.concatenate(all_starts), np.concatenate(all_ends)
+
+
+def detect_plateaux(series, min_length, smoothing=1, max_rate_deviation=0.001, chk_size=None):
+    """
+    Detect the plateaux of a series: runs of at least min_length points where the series, smoothed with a trailing
+    moving average of smoothing values, changes by at most max_rate_deviation from one point to the next.
+    Single pass and O(n). If chk_size is given, the series is processed by chunks of that size.
+
+    :param series: array like of floats
+    :param min_length: int, the minimum number of points of a plateau
+    :param smoothing: int, the size of the moving average window, 1 for no smoothing
+    :param max_rate_deviation: float, the largest relative change of the smoothed series within a plateau
+    :return: two int64 arrays, the starts and the ends (excluded) of the plateaux
+
+    >>> starts, ends = detect_plateaux([5, 1, 1.001, 1, 1, 3, 3.01, 9], min_length=3, max_rate_deviation=0.01)
+    >>> starts.tolist(), ends.tolist()
+    ([1], [5])
+    >>> starts, ends = detect_plateaux([5, 1, 1.001, 1, 1, 3, 3.01, 9], min_length=2, max_rate_deviation=0.01)
+    >>> starts.tolist(), ends.tolist()
+    ([1, 5], [5, 7])
+    """
+    series = np.asarray(series, dtype=float)
+    chk_size = chk_size or max(len(series), 1)
+    chunks = (series[i : i + chk_size] for i in range(0, len(series), chk_size))
+    return detect_plateaux_in_chunks(chunks, min_length, smoothing, max_rate_deviation)
@@ -2,27 +2,89 @@
 A few useful functions to plot financial features
 """
 import matplotlib.pyplot as plt
+from matplotlib.colors import to_rgba_array
 import numpy as np
+import pandas as pd
 import random
-from collections import defaultdict
-def random_rgb(rand_func=random):
+
+
+def random_rgb(rand_func=random.random):
     return (rand_func(), rand_func(), rand_func())
 
 
-def consistent_random_color(sequence,
-                            color_func=random_rgb):
+def _category_codes(sequence):
+    """
+    The number of distinct elements of the sequence and, for each element, the index of its first occurrence
+    among the distinct elements. The elements are compared as python objects, so tuples stay whole and elements
+    of different types can be mixed.
+
+    >>> n_distinct, codes = _category_codes([(1, 2), (1, 2), (3, 4), 'a', None, 'a'])
+    >>> n_distinct, codes.tolist()
+    (4, [0, 0, 1, 2, 3, 2])
+    """
+    codes, distinct = pd.factorize(pd.Series(sequence, dtype=object), use_na_sentinel=False)
+    return len(distinct), codes
+
+
+def categorical_rgba(sequence, seed=10, alpha=1.0):
+    """
+    Random colors as an rgba array, one row per element of the sequence, two equal elements getting the same color.
+    The palette is drawn once per distinct element, from a generator seeded with seed.
+
+    >>> colors = categorical_rgba(['a', 'a', 'b'])
+    >>> colors.shape, bool((colors[0] == colors[1]).all()), bool((colors[0] == colors[2]).all())
+    ((3, 4), True, False)
+    """
+    n_distinct, codes = _category_codes(sequence)
+    palette = np.empty((n_distinct, 4))
+    palette[:, :3] = np.random.default_rng(seed).random((n_distinct, 3))
+    palette[:, 3] = alpha
+    return palette[codes]
+
+
+def consistent_random_color(sequence, color_func=None, seed=10):
     """
     Choose a random color for each element of the sequence, but where two equal element gets the same color
 
     >>> colors = consistent_random_color(['a', 'a', 'b'])
     >>> assert colors[0] == colors[1] != colors[2]
+    >>> len(consistent_random_color([(1, 2), (1, 2), (3, 4)])), len(consistent_random_color([1, 'a', None]))
+    (3, 3)
     """
-    random.seed(10)
-    colors = defaultdict(color_func)
-    color_seq = []
-    for i in sequence:
-        color_seq.append(colors[i])
-    return color_seq
+    if color_func is not None:
+        # a color per distinct element, from the given color function
+        n_distinct, codes = _category_codes(sequence)
+        random.seed(seed)
+        palette = [color_func() for _ in range(n_distinct)]
+        return [palette[i] for i in codes]
+    return list(map(tuple, categorical_rgba(sequence, seed)[:, :3].tolist()))
+
+
+def _step_signs(series):
+    """The sign of each step of the series, -1, 0 or 1, the steps from or to a NaN being 0"""
+    return np.nan_to_num(np.sign(np.diff(np.asarray(series, dtype=float)))).astype(np.intp)
+
+
+def monotonicity_rgba(series, col_up='g', col_down='r', color_equal='g', start_col='g'):
+    """
+    Colors depending on the monotonicity of the series, as an rgba array with one row per value: the sign of each
+    step picks its color in a lookup table of the four colors, the first value getting start_col. The steps from or
+    to a NaN get color_equal.
+
+    >>> monotonicity_rgba([1, 2, 2, 1], col_up='g', col_down='r', color_equal='b', start_col='k')[:, :3].tolist()
+    [[0.0, 0.0, 0.0], [0.0, 0.5, 0.0], [0.0, 0.0, 1.0], [1.0, 0.0, 0.0]]
+    >>> monotonicity_rgba([1, np.nan, 3], color_equal='b')[:, :3].tolist()
+    [[0.0, 0.5, 0.0], [0.0, 0.0, 1.0], [0.0, 0.0, 1.0]]
+    >>> monotonicity_rgba([]).shape
+    (0, 4)
+    """
+    lookup = to_rgba_array([col_down, color_equal, col_up, start_col])
+    indices = np.empty(len(series), dtype=np.intp)
+    if len(indices):
+        indices[0] = 3
+        indices[1:] = _step_signs(series) + 1
+    return lookup[indices]
+
 
 def color_according_to_monotonicity(
     series, col_up='g', col_down='r', color_equal='g', start_col='g'
@@ -32,20 +94,109 @@ def color_according_to_monotonicity(
      >>> series = [1, 2, 3, 2, 3, 3]
      >>> color_according_to_monotonicity(series, col_up='u', col_down='d', color_equal='e', start_col='s')
      ['s', 'u', 'u', 'd', 'u', 'e']
+     >>> color_according_to_monotonicity([1, 2, np.nan, 3], col_up='u', col_down='d', color_equal='e', start_col='s')
+     ['s', 'u', 'e', 'e']
+     >>> color_according_to_monotonicity([])
+     []
+    """
+
+    if len(series) == 0:
+        return []
+    # the sign of each step, -1, 0 or 1, picks its color
+    colors = np.array([col_down, color_equal, col_up], dtype=object)[_step_signs(series) + 1]
+    return [start_col] + colors.tolist()
+
+
+# above this number of points, the plotting helpers draw a downsampled version of the series
+DFLT_MAX_POINTS = 4000
+
+
+def minmax_indices(values, n_buckets):
+    """
+    Indices of the smallest and largest of the values in each of n_buckets buckets of consecutive values, together
+    with the first and last indices, sorted. Keeps every spike of the series.
+
+    >>> minmax_indices([0, 5, 1, 2, -3, 4, 4, 1], n_buckets=2).tolist()
+    [0, 1, 4, 5, 7]
+    """
+    values = np.asarray(values, dtype=float)
+    n_values = len(values)
+    bucket_size = max(1, -(-n_values // n_buckets))
+    n_full = n_values // bucket_size * bucket_size
+
+    blocks = values[:n_full].reshape(-1, bucket_size)
+    offsets = np.arange(0, n_full, bucket_size)
+    indices = [[0, n_values - 1], blocks.argmin(axis=1) + offsets, blocks.argmax(axis=1) + offsets]
+    if n_full < n_values:
+        indices.append([n_full + values[n_full:].argmin(), n_full + values[n_full:].argmax()])
+    return np.unique(np.concatenate(indices))
+
+
+def lttb_indices(values, n_out, x=None):
+    """
+    Indices of n_out points of the series chosen with the largest triangle three buckets algorithm, which keeps
+    the visual shape of the series: the first and last points are kept and, in each bucket of consecutive points in
+    between, the point making the largest triangle with the previously chosen point and the mean of the next bucket.
+
+    >>> lttb_indices([0, 1, 0, 5, 0, 1, 0], n_out=3).tolist()
+    [0, 3, 6]
+    """
+    y = np.asarray(values, dtype=float)
+    n_values = len(y)
+    if n_out >= n_values or n_out < 3:
+        return np.arange(n_values)
+    x = np.arange(n_values, dtype=float) if x is None else np.asarray(x, dtype=float)
+
+    # the edges of the n_out - 2 buckets between the first and the last points
+    edges = np.linspace(1, n_values - 1, n_out - 1).astype(int)
+    next_edges = np.append(edges[2:], n_values)
+    indices = np.empty(n_out, dtype=int)
+    indices[0], indices[-1] = 0, n_values - 1
+    chosen = 0
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_x = x[end : next_edges[bucket]].mean()
+        next_y = y[end : next_edges[bucket]].mean()
+        # twice the areas of the triangles, chosen point / candidate / mean of the next bucket
+        areas = np.abs(
+            (x[chosen] - next_x) * (y[start:end] - y[chosen])
+            - (x[chosen] - x[start:end]) * (next_y - y[chosen])
+        )
+        chosen = start + areas.argmax()
+        indices[bucket + 1] = chosen
+    return indices
+
+
+def downsample_indices(values, max_points=DFLT_MAX_POINTS, method='minmax'):
+    """
+    Indices of at most about max_points points of values to draw instead of all of them, all the indices if there
+    are less values than max_points
+
+    :param method: 'minmax' to keep the min and max of each bucket, best for spiky series and bars, or 'lttb'
+
+    >>> downsample_indices(range(5), max_points=10).tolist()
+    [0, 1, 2, 3, 4]
+    >>> len(downsample_indices(np.arange(100000), max_points=1000, method='lttb'))
+    1000
     """
+    n_values = len(values)
+    if max_points is None or n_values <= max_points:
+        return np.arange(n_values)
+    if method == 'minmax':
+        return minmax_indices(values, max(1, max_points // 2))
+    if method == 'lttb':
+        return lttb_indices(values, max_points)
+    raise ValueError(f'Unknown downsampling method {method}')
 
-    colors = [start_col]
-    first = series[0]
-    for second in series[1:]:
-        if second < first:
-            col = col_down
-        elif second > first:
-            col = col_up
-        else:
-            col = color_equal
-        colors.append(col)
-        first = second
-    return colors
+
+def plot_downsampled(ax, values, max_points=DFLT_MAX_POINTS, method='minmax', **plot_kwargs):
+    """
+    Plot values on ax, downsampled if there are more than max_points of them, the x coordinates being the positions
+    of the values in the series
+    """
+    values = np.asarray(values)
+    indices = downsample_indices(values, max_points, method)
+    return ax.plot(indices, values[indices], **plot_kwargs)
 
 
 def sparsify_and_rotate_ticks(ax, rotation=90, one_tick_every=4):
@@ -58,12 +209,33 @@ def sparsify_and_rotate_ticks(ax, rotation=90, one_tick_every=4):
 
 def plot_series(
     series,
-    col_func=color_according_to_monotonicity,
+    col_func=monotonicity_rgba,
     plot_kwargs={'kind': 'bar'},
     ax_func=sparsify_and_rotate_ticks,
+    max_points=DFLT_MAX_POINTS,
 ):
+    """
+    Plot a pandas series, by default as bars colored according to the monotonicity of the series.
+    Above max_points values, only the min and max of buckets of the series are drawn, with the colors they have in
+    the full series, and bars are drawn as a single collection of vertical lines at their positions in the series.
+    """
     my_colors = col_func(series)
-    ax = series.plot(**plot_kwargs, color=my_colors)
+    indices = downsample_indices(series.to_numpy(), max_points)
+    if len(indices) == len(series):
+        ax = series.plot(**plot_kwargs, color=my_colors)
+        ax_func(ax)
+        return ax
+
+    if isinstance(my_colors, np.ndarray):
+        my_colors = my_colors[indices]
+    else:
+        my_colors = [my_colors[i] for i in indices]
+    if plot_kwargs.get('kind') == 'bar':
+        # far more bars than pixels, drawing them one by one would take minutes
+        ax = plt.gca()
+        ax.vlines(indices, 0, series.to_numpy()[indices], colors=my_colors)
+    else:
+        ax = series.iloc[indices].plot(**plot_kwargs, color=my_colors)
     ax_func(ax)
     return ax
 
@@ -1,13 +1,25 @@
 """
 Utils to get stock data from Quandl. Was inspired by a naive view on financial data and not really
-appropriate for most usage. For example some data are daily and some are monthly, no effort was made at merging them
+appropriate for most usage. Some data are daily and some are monthly: by default they are simply put on the union of
+their dates and filled forward/backward, but passing a target_freq to make_df_from_ticks resamples each series to a
+common calendar instead (see align_mixed_frequency).
 The only possible purpose is to easily get data for several stocks into one pandas df.
 """
 
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from collections import OrderedDict
+
 import quandl
 import numpy as np
 import pandas as pd
 
+from investate.df_utils import dates_to_int64
+from investate.instrumentation import timed, add_counts, file_size
+
 
 ticks_dicts = {
     'btc': {'tick': 'BCHARTS/BITSTAMPUSD', 'data_cols': ['Close', 'Volume (BTC)'],},
@@ -42,49 +54,352 @@ def get_col_names_for_tick(tick='BCHARTS/BITSTAMPUSD'):
     return quandl.get(tick, start_date=None).columns
 
 
+DFLT_QUANDL_CACHE_DIR = os.path.expanduser('~/invest/quandl')
+# the age in seconds after which a cached copy is fetched again, so that the recent data keeps being updated
+DFLT_QUANDL_MAX_AGE = 15 * 60
+
+
+def _tick_cache_path(tick, start_date, end_date, cache_dir):
+    """Path of the local copy of the data of tick between start_date and end_date"""
+    return os.path.join(cache_dir, f"{tick.replace('/', '__')}_{start_date}_{end_date}.pkl")
+
+
+@timed(count_records=len)
+def fetch_tick_and_cache(
+    tick,
+    start_date='2017-01-01',
+    end_date='2030-12-31',
+    cache_dir=DFLT_QUANDL_CACHE_DIR,
+    max_age=DFLT_QUANDL_MAX_AGE,
+    fetch_func=quandl.get,
+):
+    """
+    Get the data of a quandl tick, from the local cache in cache_dir if it holds a copy for the same
+    (tick, start_date, end_date) which is less than max_age seconds old. Otherwise the data is fetched with
+    fetch_func and cached. Set max_age to None to use the cached copy whatever its age, which only makes sense for
+    an end_date in the past, and cache_dir to None to bypass the cache.
+
+    >>> import tempfile
+    >>> calls = []
+    >>> def fake_get(tick, start_date, end_date):
+    ...     calls.append(tick)
+    ...     return pd.DataFrame({'Value': [float(len(calls))]})
+    >>> with tempfile.TemporaryDirectory() as cache_dir:
+    ...     first = fetch_tick_and_cache('A/B', cache_dir=cache_dir, fetch_func=fake_get)
+    ...     cached = fetch_tick_and_cache('A/B', cache_dir=cache_dir, fetch_func=fake_get)
+    ...     expired = fetch_tick_and_cache('A/B', cache_dir=cache_dir, max_age=0, fetch_func=fake_get)
+    >>> len(calls), cached['Value'].tolist(), expired['Value'].tolist()
+    (2, [1.0], [2.0])
+    """
+
+    if cache_dir is None:
+        return fetch_func(tick, start_date=start_date, end_date=end_date)
+
+    path = _tick_cache_path(tick, start_date, end_date, cache_dir)
+    if os.path.isfile(path) and (
+        max_age is None or time.time() - os.path.getmtime(path) < max_age
+    ):
+        add_counts(cache_hits=1, bytes_read=file_size(path))
+        return pd.read_pickle(path)
+
+    add_counts(cache_misses=1)
+    tick_data = fetch_func(tick, start_date=start_date, end_date=end_date)
+    os.makedirs(cache_dir, exist_ok=True)
+    # write then rename, so that concurrent readers never see a partially written file
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    tick_data.to_pickle(tmp_path)
+    os.replace(tmp_path, path)
+    add_counts(bytes_written=file_size(path))
+    return tick_data
+
+
+def fetch_ticks(
+    ticks,
+    start_date='2017-01-01',
+    end_date='2030-12-31',
+    max_workers=8,
+    verbose=False,
+    **fetch_kwargs,
+):
+    """
+    Fetch each of the distinct ticks once, concurrently, with fetch_tick_and_cache
+
+    :param ticks: an iterable of quandl ticks, possibly with repetitions
+    :param max_workers: the number of ticks fetched at the same time
+    :param fetch_kwargs: extra arguments for fetch_tick_and_cache, such as cache_dir or max_age
+    :return: a dict whose keys are the distinct ticks and values the dfs of data, or the exception raised
+             when trying to get them
+
+    >>> calls = []
+    >>> def fake_get(tick, start_date, end_date):
+    ...     calls.append(tick)
+    ...     return pd.DataFrame({'Value': [1.0]})
+    >>> fetched = fetch_ticks(['A/B', 'C/D', 'A/B'], cache_dir=None, fetch_func=fake_get)
+    >>> sorted(fetched), sorted(calls)
+    (['A/B', 'C/D'], ['A/B', 'C/D'])
+    """
+
+    ticks = list(dict.fromkeys(ticks))
+    fetched = dict()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                fetch_tick_and_cache,
+                tick,
+                start_date=start_date,
+                end_date=end_date,
+                **fetch_kwargs,
+            ): tick
+            for tick in ticks
+        }
+        for future in as_completed(futures):
+            tick = futures[future]
+            try:
+                fetched[tick] = future.result()
+                if verbose:
+                    print(f'Got data for {tick}')
+            except Exception as E:
+                fetched[tick] = E
+    return fetched
+
+
 def make_df_from_ticks(
     api_key,
     ticks_dicts=ticks_dicts,
     start_date='2017-01-01',
     end_date='2030-12-31',
     verbose=False,
+    target_freq=None,
+    rules=None,
+    **fetch_kwargs,
 ):
     """
-    Make a df from the ticks in the ticks_list
+    Make a df from the ticks in the ticks_list. Each quandl dataset is downloaded once, whatever the number of
+    columns taken from it, and the datasets are fetched concurrently and cached (see fetch_ticks).
+    If target_freq is given, the columns are resampled to that frequency and aligned with align_mixed_frequency
+    (rules being passed along) instead of being forward/backward filled on the union of their dates.
+
+    >>> def fake_get(tick, start_date, end_date):
+    ...     index = pd.to_datetime(['2020-01-01', '2020-01-02'] if tick == 'A/B' else ['2020-01-02'])
+    ...     return pd.DataFrame({'x': [1.0, 2.0][:len(index)], 'y': [3.0, 4.0][:len(index)]}, index=index)
+    >>> df = make_df_from_ticks(None, {'ab': {'tick': 'A/B', 'data_cols': ['x', 'y']},
+    ...                                'cd': {'tick': 'C/D', 'data_cols': ['x']}},
+    ...                         cache_dir=None, fetch_func=fake_get)
+    >>> df.columns.tolist(), df['cd_x'].tolist()
+    (['ab_x', 'ab_y', 'cd_x'], [1.0, 1.0])
+    >>> def failing_get(tick, start_date, end_date):
+    ...     raise ValueError('no data')
+    >>> make_df_from_ticks(None, {'ab': {'tick': 'A/B', 'data_cols': ['x']}}, target_freq='monthly',
+    ...                    cache_dir=None, fetch_func=failing_get).shape
+    no data Unable to get data for ab
+    (0, 0)
     """
 
     quandl.ApiConfig.api_key = api_key
-    df = pd.DataFrame()
-    first = True
+    fetched = fetch_ticks(
+        [tick_dict['tick'] for tick_dict in ticks_dicts.values()],
+        start_date=start_date,
+        end_date=end_date,
+        verbose=verbose,
+        **fetch_kwargs,
+    )
 
+    columns = []
     for name, tick_dict in ticks_dicts.items():
-        if verbose:
-            print(f'\nGetting data for {name}')
+        tick_data = fetched[tick_dict['tick']]
+        if isinstance(tick_data, Exception):
+            print(tick_data, f'Unable to get data for {name}')
+            continue
         for data_col in tick_dict['data_cols']:
-            try:
-                if verbose:
-                    print(f'{data_col}')
-                tick_data = quandl.get(
-                    tick_dict['tick'], start_date=start_date, end_date=end_date
-                )
-                if first:
-                    df[name + '_' + data_col] = tick_data[data_col]
-                    first = False
-                else:
-                    new_df = pd.DataFrame()
-                    new_df[name + '_' + data_col] = tick_data[data_col]
-                    df = pd.concat([df, new_df], axis=1, sort=False)
+            if data_col in tick_data.columns:
+                columns.append(tick_data[data_col].rename(name + '_' + data_col))
+            else:
+                print(f'No column {data_col}.', f'Available columns for {name}', tick_data.columns)
 
-            except Exception as E:
-                print(E, f'Available columns for {name}', tick_data.columns)
+    if target_freq is not None:
+        return align_mixed_frequency(
+            {column.name: column for column in columns}, target_freq, rules=rules
+        )
+
+    # a single join of all the columns on the union of their dates
+    df = pd.concat(columns, axis=1, sort=False) if columns else pd.DataFrame()
 
     # fill forward and backward the missing data
-    df.fillna(method='ffill', axis=0, inplace=True)
-    df.fillna(method='bfill', axis=0, inplace=True)
+    df = df.ffill().bfill()
 
     return df
 
 
+# pandas offset aliases of each frequency, most recent pandas alias first
+_FREQ_ALIASES = {
+    'daily': ('D',),
+    'weekly': ('W',),
+    'monthly': ('ME', 'M'),
+    'quarterly': ('QE', 'Q'),
+    'yearly': ('YE', 'A'),
+}
+# typical number of days between two observations of each frequency
+_FREQ_DAYS = {
+    'daily': 1,
+    'weekly': 7,
+    'monthly': 30.44,
+    'quarterly': 91.31,
+    'yearly': 365.25,
+}
+RESAMPLE_RULES = ('last', 'mean', 'interpolate')
+_resample_cache = OrderedDict()
+RESAMPLE_CACHE_SIZE = 256
+
+
+def freq_to_offset(freq):
+    """
+    Pandas offset of a frequency name, one of the keys of _FREQ_ALIASES
+
+    >>> freq_to_offset('weekly')
+    <Week: weekday=6>
+    """
+    for alias in _FREQ_ALIASES[freq]:
+        try:
+            return pd.tseries.frequencies.to_offset(alias)
+        except ValueError:
+            pass
+    raise ValueError(f'No pandas offset found for {freq}')
+
+
+def infer_native_freq(series):
+    """
+    Name of the frequency closest to the median spacing of the dates of the series index
+
+    >>> infer_native_freq(pd.Series(1.0, index=pd.date_range('2020-01-01', periods=5, freq='7D')))
+    'weekly'
+    """
+    dates = dates_to_int64(series.index)
+    if len(dates) < 2:
+        return 'daily'
+    median_days = np.median(np.diff(dates)) / (24 * 3600 * 1e9)
+    return min(
+        _FREQ_DAYS, key=lambda freq: abs(np.log(max(median_days, 1e-9) / _FREQ_DAYS[freq]))
+    )
+
+
+def _series_fingerprint(series):
+    """A hash of the index and values of the series, to key the resample cache"""
+    return int(pd.util.hash_pandas_object(series, index=True).sum())
+
+
+def resample_series(series, target_freq='monthly', rule=None, native_freq=None):
+    """
+    Resample a series of values indexed by dates to the calendar of target_freq, spanning the dates of the series.
+    The value at each date of the calendar is computed with rule:
+        'last': the last value known at that date
+        'mean': the mean of the values since the previous date of the calendar (NaN if there is none)
+        'interpolate': the values linearly interpolated (in time) at that date
+    By default, series which are coarser than target_freq are interpolated and the other ones take the last value.
+    The computation is vectorized over the int64 dates and its results are cached per (series, target_freq, rule).
 
+    >>> daily = pd.Series(np.arange(1.0, 61.0), index=pd.date_range('2020-01-01', periods=60), name='d')
+    >>> monthly = resample_series(daily, 'monthly')
+    >>> monthly.index.strftime('%m-%d').tolist(), monthly.tolist()
+    (['01-31', '02-29'], [31.0, 60.0])
+    >>> resample_series(daily, 'monthly', rule='mean').tolist()
+    [16.0, 46.0]
+    >>> resample_series(monthly, 'weekly').round(2).tolist()
+    [33.0, 40.0, 47.0, 54.0]
 
+    Each date of the calendar covers its whole day, so intraday observations of the last day are included
+
+    >>> dates = pd.to_datetime(['2020-01-15 00:00', '2020-01-31 12:00', '2020-02-29 14:00'])
+    >>> intraday = pd.Series([1.0, 2.0, 4.0], index=dates)
+    >>> resample_series(intraday, 'monthly', rule='mean').tolist()
+    [1.5, 4.0]
+    >>> resample_series(intraday, 'monthly', rule='last').tolist()
+    [2.0, 4.0]
+
+    A series without any value gives an empty series
+
+    >>> resample_series(pd.Series(np.nan, index=daily.index), 'monthly').tolist()
+    []
+    """
+
+    assert rule is None or rule in RESAMPLE_RULES, f'rule must be one of {RESAMPLE_RULES}'
+    series = series.dropna().sort_index()
+    if series.empty:
+        return pd.Series([], index=pd.DatetimeIndex([]), name=series.name, dtype='float64')
+    if rule is None:
+        native_freq = native_freq or infer_native_freq(series)
+        rule = 'interpolate' if _FREQ_DAYS[native_freq] > _FREQ_DAYS[target_freq] else 'last'
+
+    key = (series.name, target_freq, rule, _series_fingerprint(series))
+    if key in _resample_cache:
+        _resample_cache.move_to_end(key)
+        # a copy, so that the callers modifying the result do not modify the cache
+        return _resample_cache[key].copy()
+
+    offset = freq_to_offset(target_freq)
+    last_date = series.index[-1].normalize()
+    # the calendar ends with the bucket of the last date, unless we interpolate, which does not extrapolate
+    calendar = pd.date_range(
+        offset.rollforward(series.index[0].normalize()),
+        offset.rollback(last_date) if rule == 'interpolate' else offset.rollforward(last_date),
+        freq=offset,
+    )
+    cal_dates = dates_to_int64(calendar)
+    # each calendar date covers its whole day: the values up to the end of the day belong to it
+    cal_ends = cal_dates + 24 * 3600 * 10 ** 9
+    dates = dates_to_int64(series.index)
+    values = series.to_numpy(dtype='float64')
+
+    if rule == 'last':
+        pos = np.searchsorted(dates, cal_ends, side='left') - 1
+        resampled = np.where(pos >= 0, values[pos.clip(min=0)], np.nan)
+    elif rule == 'mean':
+        # the bucket of each date is the first calendar date whose day ends after it
+        buckets = np.searchsorted(cal_ends, dates, side='right')
+        sums = np.bincount(buckets, weights=values, minlength=len(cal_dates))
+        counts = np.bincount(buckets, minlength=len(cal_dates))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            resampled = np.where(counts > 0, sums / counts, np.nan)
+    else:
+        resampled = np.interp(cal_dates, dates, values, left=np.nan, right=np.nan)
+
+    result = pd.Series(resampled, index=calendar, name=series.name)
+    _resample_cache[key] = result
+    if len(_resample_cache) > RESAMPLE_CACHE_SIZE:
+        _resample_cache.popitem(last=False)
+    return result.copy()
+
+
+def align_mixed_frequency(series, target_freq='monthly', rules=None, how='inner'):
+    """
+    Resample each of the series to target_freq with resample_series and put them side by side in a df.
+    With how='inner' the df only covers the calendar dates where all the series are known, with how='outer'
+    it covers them all and the series are NaN outside their own span: nothing is filled.
+
+    :param series: a dict of pandas series indexed by dates, or a df whose columns are such series
+    :param target_freq: one of 'daily', 'weekly', 'monthly', 'quarterly' or 'yearly'
+    :param rules: optional dict from the names of the series to their resample rule
+    :param how: 'inner' or 'outer'
+    :return: a df indexed by the dates of the target_freq calendar
+
+    >>> daily = pd.Series(np.arange(1.0, 61.0), index=pd.date_range('2020-01-01', periods=60))
+    >>> monthly = pd.Series([10.0, 20.0, 30.0], index=pd.to_datetime(['2020-01-31', '2020-02-29', '2020-03-31']))
+    >>> df = align_mixed_frequency({'daily': daily, 'monthly': monthly}, 'monthly', rules={'daily': 'mean'})
+    >>> df.index.strftime('%m-%d').tolist(), df.values.tolist()
+    (['01-31', '02-29'], [[16.0, 10.0], [46.0, 20.0]])
+
+    Without any series, the df is empty
+
+    >>> align_mixed_frequency({}).shape
+    (0, 0)
+    """
 
+    if isinstance(series, pd.DataFrame):
+        series = {col: series[col] for col in series.columns}
+    rules = rules or dict()
+    resampled = [
+        resample_series(values.rename(name), target_freq, rule=rules.get(name))
+        for name, values in series.items()
+    ]
+    if not resampled:
+        return pd.DataFrame()
+    return pd.concat(resampled, axis=1, join=how)
@@ -24,6 +24,8 @@ equity, monthly_income = house_investment(mortg_rate=0.0265,
 
 import matplotlib.pyplot as plt
 from investate.series_utils import *
+from investate.instrumentation import timed
+from investate.plotting import plot_downsampled
 
 
 def compute_mortg_principal(
@@ -124,6 +126,7 @@ def inflation_adjust(month_costs_gen, yearly_infl_rate=0.02):
 # TODO: each variable is beneficial or not, take that into account to allow ranges
 
 
+@timed(count_records=lambda values: len(values[0]))
 def house_investment(
     mortg_rate=0.0275,
     down_payment_perc=0.2,
@@ -211,7 +214,7 @@ def house_investment(
     equity = [i[0] - i[1] for i in zip(house_value, loan_remaining)]
 
     if plot:
-        plt.plot(equity, label='equity')
+        plot_downsampled(plt.gca(), equity, label='equity')
         plt.vlines(
             x=n_months_repay,
             ymin=np.min(equity),
@@ -225,7 +228,7 @@ def house_investment(
         plt.legend()
         plt.title(f'Equity over {mortgage_n_years + n_years_after_pay_off} years')
         plt.show()
-        plt.plot(monthly_income, label='monthly income')
+        plot_downsampled(plt.gca(), monthly_income, label='monthly income')
         plt.vlines(
             x=n_months_repay,
             ymin=np.min(monthly_income + [monthly_mort_payment]),
@@ -254,6 +257,7 @@ def house_investment(
     return equity, monthly_income
 
 
+@timed(count_records=lambda values: len(values[0]))
 def compare_house_invest_vs_stock(
     equity,
     monthly_income,
@@ -302,9 +306,151 @@ def compare_house_invest_vs_stock(
     ]
 
     if plot:
-        plt.plot(house_invest, label='house')
-        plt.plot(down_payment_invest, label='stock')
+        plot_downsampled(plt.gca(), house_invest, label='house')
+        plot_downsampled(plt.gca(), down_payment_invest, label='stock')
         plt.legend()
         plt.show()
 
     return house_invest, total_stock_market_invest
+
+
+def house_vs_stock_final_values(
+    mortg_rate=0.0275,
+    down_payment_perc=0.2,
+    house_cost=240000,
+    tax=3000,
+    insurance=3000,
+    repair=6000,
+    estate_rate=0.04,
+    mortgage_n_years=15,
+    n_years_after_pay_off=10,
+    monthly_rental_income=6000,
+    percentage_rented=1,
+    inflation_rate=0.02,
+    income_tax=0.35,
+    management_fees_rate=0.22,
+    stock_market_rate=0.08,
+):
+    """
+    The final values of house_investment followed by compare_house_invest_vs_stock, evaluated at once for arrays
+    of parameters: all the parameters but mortgage_n_years and n_years_after_pay_off can be arrays, which are
+    broadcast together. The months are along an extra last axis and the loops are replaced by closed forms.
+
+    :return: two arrays of the broadcast shape of the parameters, the final values of the house investment and of
+             the stock market investment
+
+    >>> house, stock = house_vs_stock_final_values(mortg_rate=[0.02, 0.03, 0.04])
+    >>> house.shape, bool((np.diff(house) < 0).all())
+    ((3,), True)
+    """
+
+    n_months_repay = mortgage_n_years * 12
+    n_total_months = n_months_repay + n_years_after_pay_off * 12
+    months = np.arange(n_total_months)
+
+    # the parameters get a last axis for the months
+    (
+        mortg_rate,
+        down_payment_perc,
+        house_cost,
+        tax,
+        insurance,
+        repair,
+        estate_rate,
+        monthly_rental_income,
+        percentage_rented,
+        inflation_rate,
+        income_tax,
+        management_fees_rate,
+        stock_market_rate,
+    ) = [
+        np.asarray(param, dtype=float)[..., None]
+        for param in (
+            mortg_rate,
+            down_payment_perc,
+            house_cost,
+            tax,
+            insurance,
+            repair,
+            estate_rate,
+            monthly_rental_income,
+            percentage_rented,
+            inflation_rate,
+            income_tax,
+            management_fees_rate,
+            stock_market_rate,
+        )
+    ]
+
+    loan_amount = house_cost * (1 - down_payment_perc)
+    # the mortgage monthly cost, as in compute_mortg_principal
+    month_rate = mortg_rate / 12
+    loan_growth = (1 + month_rate) ** n_months_repay
+    with np.errstate(divide='ignore', invalid='ignore'):
+        repay_factor = np.where(
+            mortg_rate == 0, n_months_repay, (loan_growth - 1) / month_rate
+        )
+    monthly_mort_payment = loan_amount * loan_growth / repay_factor
+
+    # the monthly income, as in house_investment
+    extra_cost_per_month = (
+        (tax + insurance + repair)
+        / 12
+        * (1 + inflation_rate / 12) ** months
+        * (1 - percentage_rented * income_tax)
+    )
+    total_cost_per_month = extra_cost_per_month + monthly_mort_payment * (
+        months <= n_months_repay
+    )
+    rental_income = (
+        monthly_rental_income
+        * (1 - management_fees_rate)
+        * percentage_rented
+        * (1 - income_tax)
+        * (1 + estate_rate / 12) ** (months + 1)
+    )
+    monthly_income = rental_income - total_cost_per_month
+
+    # the final equity: the loan is repaid unless the series stops with the mortgage
+    house_value = house_cost * (1 + estate_rate / 12) ** n_total_months
+    if n_total_months > n_months_repay:
+        loan_remaining = 0
+    else:
+        loan_remaining = loan_amount * loan_growth - monthly_mort_payment * repay_factor
+    equity = house_value - loan_remaining
+
+    # the final values of compare_house_invest_vs_stock, each monthly income growing until the end
+    stock_growth = 1 + stock_market_rate / 12
+    growth_to_end = stock_growth ** (n_total_months - 1 - months)
+    positive_income = np.where(monthly_income > 0, monthly_income, 0)
+    negative_income = np.where(monthly_income <= 0, -monthly_income, 0)
+    house_invest = equity + (positive_income * growth_to_end).sum(axis=-1, keepdims=True)
+    stock_invest = down_payment_perc * house_cost * stock_growth ** n_total_months + (
+        negative_income * growth_to_end
+    ).sum(axis=-1, keepdims=True)
+
+    return house_invest[..., 0], stock_invest[..., 0]
+
+
+def sensitivity_surface(x_name, x_values, y_name, y_values, **inputs):
+    """
+    The final value of the house investment minus the final value of the stock market investment (see
+    house_vs_stock_final_values) over the grid of values of the two parameters x_name and y_name, the other
+    parameters being set by inputs
+
+    :return: an array of shape (len(y_values), len(x_values))
+
+    >>> surface = sensitivity_surface('mortg_rate', [0.02, 0.03, 0.04], 'estate_rate', [0.02, 0.05])
+    >>> surface.shape
+    (2, 3)
+    """
+    assert x_name != y_name, 'The two parameters of the surface must be different'
+    inputs = dict(
+        inputs,
+        **{
+            x_name: np.asarray(x_values, dtype=float)[None, :],
+            y_name: np.asarray(y_values, dtype=float)[:, None],
+        },
+    )
+    house_invest, stock_invest = house_vs_stock_final_values(**inputs)
+    return np.broadcast_to(house_invest - stock_invest, (len(y_values), len(x_values)))
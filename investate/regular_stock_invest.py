@@ -1,16 +1,203 @@
 """
-Function to compute the total return of a stock by taking into account both the stock value and the dividend yield
-This is a baby function, rather use a good data source like Tiingo since there are more factors to take into account.
+Compute the total return of stocks, dividends being reinvested, from their prices and their dividend and split
+series, at any frequency and for many tickers at once: the series are put side by side in dates x tickers panels
+and total_return_index is a vectorized cumulative product over the aligned panel.
+get_total_return_from_monthly_data is a baby version for the S&P 500 from quandl monthly data, which only gives a
+dividend yield: rather use a good data source like Tiingo, whose daily data has the cash dividends and the splits.
 
 Example of use:
 
-growth_series = get_total_return_from_monthly_data(start_date='1980-03-25', end_date='2021-03-01')
-plt.plot(growth_series)
+growth_series = get_total_return_from_monthly_data(api_key=API_KEY, start_date='1980-03-25', end_date='2021-03-01')
+plt.plot(growth_series.cumprod())
 plt.show()
 
+ticker_dfs = pull_data_for_tickers(['QQQ', 'SPY'], start_date='2010-01-01', end_date='2021-03-01')
+prices, dividends, splits = panels_from_ticker_dfs(ticker_dfs)
+tr_index = cached_total_return_index(prices, dividends, splits)
 """
 
+import hashlib
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
 from investate.quandl_data import *
+from investate.quandl_data import DFLT_QUANDL_CACHE_DIR, make_df_from_ticks
+from investate.instrumentation import timed, add_counts, file_size
+
+# the total return indices are cached next to the quandl price cache, in ~/invest/total_return
+DFLT_TOTAL_RETURN_CACHE_DIR = os.path.join(
+    os.path.dirname(DFLT_QUANDL_CACHE_DIR), 'total_return'
+)
+
+
+def _as_panel(values, index, columns, fill_value):
+    """The values as a float array aligned on index and columns, missing values being fill_value"""
+    if values is None:
+        return np.full((len(index), len(columns)), fill_value, dtype=float)
+    values = pd.DataFrame(values)
+    if values.shape[1] == 1 and len(columns) == 1:
+        values.columns = columns
+    values = values.reindex(index=index, columns=columns)
+    return values.to_numpy(dtype=float, na_value=np.nan)
+
+
+def total_return_factors(prices, dividends=None, splits=None):
+    """
+    The growth factor of an investment in each ticker from each date to the next, dividends being reinvested:
+    s_t * (p_t + d_t) / p_{t-1}, where p are the prices, d the cash dividends per share paid at t (after the split
+    of t, if any) and s the split ratios (2 for a 2 for 1 split).
+
+    The prices are forward filled, so the factor is 1 over the dates a ticker does not trade and NaN before its
+    first price. Missing dividends are 0 and missing splits are 1.
+
+    :param prices: a df of unadjusted prices indexed by dates, with a column per ticker, or a series of one ticker
+    :param dividends: a df (or series) of cash dividends per share, on any subset of the dates and tickers of prices
+    :param splits: a df (or series) of split ratios, on any subset of the dates and tickers of prices
+    :return: a df of factors, like prices, the first row being 1 where the first price is known
+
+    >>> prices = pd.DataFrame({'A': [10, 11, 5.5, 6], 'B': [None, 20, None, 22]})
+    >>> dividends = pd.DataFrame({'A': [0, 0, 0, 0.5]})
+    >>> splits = pd.DataFrame({'A': [1, 1, 2, 1]})
+    >>> factors = total_return_factors(prices, dividends, splits)
+    >>> factors['A'].round(6).tolist()
+    [1.0, 1.1, 1.0, 1.181818]
+    >>> factors['B'].round(6).tolist()
+    [nan, 1.0, 1.0, 1.1]
+    """
+    prices = pd.DataFrame(prices)
+    index, columns = prices.index, prices.columns
+    filled = prices.ffill().to_numpy(dtype=float, na_value=np.nan)
+    dividends = np.nan_to_num(_as_panel(dividends, index, columns, 0.0), nan=0.0)
+    splits = np.nan_to_num(_as_panel(splits, index, columns, 1.0), nan=1.0)
+
+    factors = np.empty_like(filled)
+    factors[0] = np.where(np.isnan(filled[0]), np.nan, 1.0)
+    np.add(filled[1:], dividends[1:], out=factors[1:])
+    factors[1:] *= splits[1:]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        factors[1:] /= filled[:-1]
+    # the first date of each ticker has no previous price to grow from
+    first_dates = np.isnan(filled[:-1]) & ~np.isnan(filled[1:])
+    factors[1:][first_dates] = 1.0
+    return pd.DataFrame(factors, index=index, columns=columns)
+
+
+def total_return_index(prices, dividends=None, splits=None, start_value=1.0):
+    """
+    The total return index of each ticker, that is the value of an investment of start_value at the first price of
+    the ticker, dividends being reinvested at the price of their date. See total_return_factors for the inputs.
+    All the tickers are computed at once, with a cumulative product over the dates x tickers panel.
+
+    >>> prices = pd.DataFrame({'A': [10, 11, 5.5, 6], 'B': [None, 20, None, 22]})
+    >>> dividends = pd.DataFrame({'A': [0, 0, 0, 0.5]})
+    >>> splits = pd.DataFrame({'A': [1, 1, 2, 1]})
+    >>> tr_index = total_return_index(prices, dividends, splits, start_value=100)
+    >>> tr_index['A'].round(6).tolist()
+    [100.0, 110.0, 110.0, 130.0]
+    >>> tr_index['B'].round(6).tolist()
+    [nan, 100.0, 100.0, 110.0]
+    """
+    factors = total_return_factors(prices, dividends, splits)
+    values = factors.to_numpy()
+    known = ~np.isnan(values)
+    # NaN factors (before the first price) must not propagate, they are put back once the product is done
+    index_values = np.cumprod(np.where(known, values, 1.0), axis=0)
+    index_values *= start_value
+    index_values[~known] = np.nan
+    return pd.DataFrame(index_values, index=factors.index, columns=factors.columns)
+
+
+def dividends_from_yield(prices, yearly_yield, periods_per_year=12):
+    """
+    Cash dividends per share paid at each date, from a yearly dividend yield in percents, as given by
+    MULTPL/SP500_DIV_YIELD_MONTH, assuming the dividends of the year are spread evenly over the periods_per_year
+    dates of a year
+
+    >>> dividends_from_yield(pd.Series([100.0, 120.0]), pd.Series([2.4, 1.2])).tolist()
+    [0.2, 0.12]
+    """
+    return prices * yearly_yield / (100 * periods_per_year)
+
+
+def panels_from_ticker_dfs(
+    ticker_dfs,
+    price_col='close',
+    dividend_col='divCash',
+    split_col='splitFactor',
+    date_col='date',
+):
+    """
+    The prices, dividends and splits panels (dates x tickers dfs, on the union of the dates of the tickers) of a
+    dict of dfs of daily data per ticker, by default as returned by Tiingo (see insider_trading.pull_data_for_tickers)
+
+    >>> ticker_dfs = {
+    ...     'A': pd.DataFrame({'date': ['2021-01-04', '2021-01-05'], 'close': [10.0, 11.0],
+    ...                        'divCash': [0.0, 0.5], 'splitFactor': [1.0, 1.0]}),
+    ...     'B': pd.DataFrame({'date': ['2021-01-05'], 'close': [20.0], 'divCash': [0.0], 'splitFactor': [1.0]}),
+    ... }
+    >>> prices, dividends, splits = panels_from_ticker_dfs(ticker_dfs)
+    >>> prices.shape, list(prices.columns), prices['B'].tolist()
+    ((2, 2), ['A', 'B'], [nan, 20.0])
+    """
+    panels = []
+    for col in (price_col, dividend_col, split_col):
+        series = {}
+        for ticker, df in ticker_dfs.items():
+            if col not in df.columns:
+                continue
+            values = df.set_index(date_col)[col] if date_col in df.columns else df[col]
+            values.index = pd.to_datetime(values.index)
+            series[ticker] = values
+        panels.append(pd.DataFrame(series).sort_index() if series else None)
+    return tuple(panels)
+
+
+def _panels_fingerprint(*panels, start_value=1.0):
+    """A hash of the dates, tickers and values of the panels, to key the total return cache"""
+    digest = hashlib.blake2b(repr(start_value).encode(), digest_size=16)
+    for panel in panels:
+        if panel is None:
+            digest.update(b'None')
+            continue
+        panel = pd.DataFrame(panel)
+        digest.update(repr(list(panel.columns)).encode())
+        digest.update(pd.util.hash_pandas_object(panel, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+@timed(count_records=len)
+def cached_total_return_index(
+    prices,
+    dividends=None,
+    splits=None,
+    start_value=1.0,
+    cache_dir=DFLT_TOTAL_RETURN_CACHE_DIR,
+):
+    """
+    total_return_index, read from cache_dir if it was already computed for the same panels, otherwise computed and
+    cached there. Set cache_dir to None to bypass the cache.
+    """
+    if cache_dir is None:
+        return total_return_index(prices, dividends, splits, start_value)
+
+    key = _panels_fingerprint(prices, dividends, splits, start_value=start_value)
+    path = os.path.join(cache_dir, f'total_return_{key}.pkl')
+    if os.path.isfile(path):
+        add_counts(cache_hits=1, bytes_read=file_size(path))
+        return pd.read_pickle(path)
+
+    add_counts(cache_misses=1)
+    tr_index = total_return_index(prices, dividends, splits, start_value)
+    os.makedirs(cache_dir, exist_ok=True)
+    # write then rename, so that concurrent readers never see a partially written file
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    tr_index.to_pickle(tmp_path)
+    os.replace(tmp_path, path)
+    add_counts(bytes_written=file_size(path))
+    return tr_index
 
 
 def get_total_return_from_monthly_data(
@@ -19,21 +206,21 @@ def get_total_return_from_monthly_data(
     start_date='1910-01-01',
     end_date='2021-03-01',
     remove_begining=True,
+    api_key=None,
 ):
     """
-    Attempt at getting the full return of a stock if dividends are reinvested. Using a good data source
-    like tiingo is more relialable at this point"""
+    Monthly growth factors of the S&P 500 with the dividends reinvested, from the monthly prices and dividend yields
+    of quandl, see total_return_factors. Using a good data source like tiingo is more reliable at this point.
+    The quandl monthly data has a row at the beginning and one at the end of each month, the ones at the beginning
+    are dropped if remove_begining is True.
+    """
     ticks_dicts = {'price': price_tick, 'dividends': dividend_tick}
     df = make_df_from_ticks(
-        ticks_dicts=ticks_dicts, start_date=start_date, end_date=end_date
+        api_key, ticks_dicts=ticks_dicts, start_date=start_date, end_date=end_date
     )
     if remove_begining:
-        begining_of_month_indices = [
-            i for idx, i in enumerate(list(df.index)) if idx % 2 == 0
-        ]
-        df = df.drop(begining_of_month_indices)
-    df['shift_price'] = df.price_Value.shift(1)
-    growth_series = (
-        df['dividends_Value'] / (12 * 100) + df['price_Value'] / df['shift_price']
-    )
+        df = df.iloc[1::2]
+    prices = df['price_Value']
+    dividends = dividends_from_yield(prices, df['dividends_Value'], periods_per_year=12)
+    growth_series = total_return_factors(prices, dividends).iloc[:, 0]
     return growth_series.iloc[1:]
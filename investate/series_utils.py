@@ -4,6 +4,7 @@ Module containing some of the fundamental functions to compute value of investme
 
 import numpy as np
 from operator import itemgetter
+from investate.instrumentation import timed
 
 
 def values_of_series_of_invest(
@@ -117,9 +118,90 @@ def total_of_regular_investment(reg_invest_value, rate, n_periods):
         )
 
 
+def forward_fill(values, axis=0):
+    """
+    Copy of values where each NaN is replaced by the last non NaN value before it along axis, the NaNs before the
+    first value staying NaN
+
+    >>> forward_fill([np.nan, 1, np.nan, np.nan, 4]).tolist()
+    [nan, 1.0, 1.0, 1.0, 4.0]
+    >>> forward_fill([[1, np.nan], [np.nan, 2], [3, np.nan]]).tolist()
+    [[1.0, nan], [1.0, 2.0], [3.0, 2.0]]
+    """
+    values = np.moveaxis(np.asarray(values, dtype=float), axis, 0)
+    positions = np.arange(len(values)).reshape(-1, *[1] * (values.ndim - 1))
+    # the position of the last known value, for each position
+    last_known = np.where(np.isnan(values), 0, positions)
+    np.maximum.accumulate(last_known, axis=0, out=last_known)
+    return np.moveaxis(np.take_along_axis(values, last_known, axis=0), 0, axis)
+
+
+def panel_returns(values, horizon=1, kind='simple', axis=0, gaps='propagate', out=None, dtype=None):
+    """
+    Returns over horizon periods of all the series of a panel at once, typically a (n_dates, n_tickers) array of
+    prices: the return at position t along axis is the one from t to t + horizon. The start and end values are
+    views on values, nothing is copied unless gaps need filling.
+
+    :param values: array like of values, the dates along axis
+    :param horizon: the number of periods of the returns
+    :param kind: 'simple' for end / start - 1, 'log' for log(end / start)
+    :param axis: the axis of the dates
+    :param gaps: how the NaNs of values are handled. With 'propagate', the returns starting or ending on a NaN are
+                 NaN. With 'ffill', the values are forward filled first, so the returns within a gap are 0 and the
+                 return ending after a gap covers the whole gap; only the NaNs before the first value remain.
+                 Either way, the returns starting from a 0 value are NaN.
+    :param out: optional preallocated array to write the returns into, of the shape of values with horizon fewer
+                dates, e.g. a float32 buffer reused from one call to the next
+    :param dtype: the dtype of the returns if out is not given, float64 by default
+    :return: the array of returns, out if it was given
+
+    >>> values = np.array([[100, 10], [110, 12], [121, np.nan], [133.1, 15]])
+    >>> panel_returns(values).round(4).tolist()
+    [[0.1, 0.2], [0.1, nan], [0.1, nan]]
+    >>> panel_returns(values, gaps='ffill').round(4).tolist()
+    [[0.1, 0.2], [0.1, 0.0], [0.1, 0.25]]
+    >>> panel_returns(values, horizon=2, kind='log', gaps='ffill').round(4).tolist()
+    [[0.1906, 0.1823], [0.1906, 0.2231]]
+
+    The returns can be written in place into a buffer, with dates along the last axis here
+
+    >>> buffer = np.empty((2, 3), dtype=np.float32)
+    >>> _ = panel_returns(values.T, axis=1, gaps='ffill', out=buffer)
+    >>> buffer.dtype.name, buffer.astype(float).round(4).tolist()
+    ('float32', [[0.1, 0.1, 0.1], [0.2, 0.0, 0.25]])
+    """
+    values = np.asarray(values, dtype=float)
+    if gaps == 'ffill':
+        if np.isnan(values).any():
+            values = forward_fill(values, axis=axis)
+    elif gaps != 'propagate':
+        raise ValueError(f"gaps should be 'propagate' or 'ffill', not {gaps!r}")
+    if kind not in ('simple', 'log'):
+        raise ValueError(f"kind should be 'simple' or 'log', not {kind!r}")
+
+    axis = axis % values.ndim
+    n_returns = max(values.shape[axis] - horizon, 0)
+    start_idx = tuple(slice(0, n_returns) if i == axis else slice(None) for i in range(values.ndim))
+    end_idx = tuple(slice(horizon, None) if i == axis else slice(None) for i in range(values.ndim))
+    start, end = values[start_idx], values[end_idx]
+    if out is None:
+        out = np.empty(start.shape, dtype=dtype or np.float64)
+    elif out.shape != start.shape:
+        raise ValueError(f'out should be of shape {start.shape}, not {out.shape}')
+
+    out[...] = np.nan
+    np.divide(end, start, out=out, where=start != 0, casting='same_kind')
+    if kind == 'simple':
+        out -= 1
+    else:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            np.log(out, out=out)
+    return out
+
+
 def values_to_percent_growth(values):
     """
-    Turn a series of values into a series giving the growth from one period to the next
+    Turn a series of values into a series giving the growth from one period to the next, see panel_returns
     :param values: a list of floats
     :return: another list, of length one less than values
 
@@ -137,10 +219,7 @@ def values_to_percent_growth(values):
     array([0.05, 0.05, 0.05, 0.05])
 
     """
-    values = np.array(values)
-    shifted_values = np.roll(values, shift=-1)
-    period_growth = shifted_values / values
-    return period_growth[:-1] - 1
+    return panel_returns(values)
 
 
 def relative_weight(A, B):
@@ -203,6 +282,27 @@ def rebalance_A_to_B(A, B, target_relative_weight, transfer_fee):
     )
 
 
+def grow_and_rebalance(total_A, total_B, rate_A, rate_B, end_balance, fees_func_AB):
+    """
+    One period of investment_over_period: both investments grow at their rate, then the money is moved from
+    A to B (or from B to A) so that A / (A + B) = end_balance, paying the fees given by fees_func_AB
+
+    >>> grow_and_rebalance(1, 0, 0.05, 0, 0, lambda a, b: 0)
+    (0.0, 1.05)
+    """
+    # each investment grew during the period
+    total_A = total_A * (1 + rate_A)
+    total_B = total_B * (1 + rate_B)
+    # we want to re-balance from A to B (or from B to A)
+    A_to_B = rebalance_A_to_B(
+        total_A, total_B, end_balance, transfer_fee=fees_func_AB(total_A, total_B),
+    )
+    total_A -= A_to_B
+    total_B += A_to_B * (1 - fees_func_AB(total_A, total_B))
+    return total_A, total_B
+
+
+@timed(count_records=lambda values: len(values[0]))
 def investment_over_period(
         period_rates_A,
         period_rates_B,
@@ -269,16 +369,9 @@ def investment_over_period(
     for rate_A, rate_B, end_balance in zip(
             period_rates_A, period_rates_B, period_end_balance
     ):
-        # each investment grew during the period
-        total_A = total_A * (1 + rate_A)
-        total_B = total_B * (1 + rate_B)
-        # we want to re-balance from A to B (or from B to A)
-        A_to_B = rebalance_A_to_B(
-            total_A, total_B, end_balance, transfer_fee=fees_func_AB(total_A, total_B),
+        total_A, total_B = grow_and_rebalance(
+            total_A, total_B, rate_A, rate_B, end_balance, fees_func_AB
         )
-        total_A -= A_to_B
-        total_B += A_to_B * (1 - fees_func_AB(total_A, total_B))
-
         val_A.append(total_A)
         val_B.append(total_B)
 
@@ -354,4 +447,124 @@ def find_subintervals(intervals):
             running_type_set.add(type_)
         previous_val = val
 
-    return subintervals
\ No newline at end of file
+    return subintervals
+
+
+class SubintervalIndex:
+    """
+    Compact, queryable form of the output of find_subintervals. The sorted endpoints of the intervals delimit
+    consecutive segments [bounds[k], bounds[k + 1]) and the ids of the intervals covering each segment are stored
+    CSR style: ids[indptr[k]:indptr[k + 1]]. Stabbing queries then cost O(log n + k), k being the number of ids
+    returned, and arrays of points can be queried at once. Overlap queries cost O(log n + k log k): the intervals
+    overlapping [left, right) are the ones containing left, plus the ones starting in (left, right), found in the
+    intervals sorted by their left endpoint.
+    Each interval is stored once per segment it covers, so the memory is O(n + total number of (segment, interval)
+    pairs): O(n) for intervals which rarely overlap, but up to O(n ** 2) for deeply nested ones.
+    As in find_subintervals, the intervals are half open: [left, right).
+
+    >>> intervals = [[1, 10], [2, 5], [3, 20]]
+    >>> index = SubintervalIndex(intervals)
+    >>> index.subintervals() == find_subintervals(intervals)
+    True
+    >>> index.stab(4).tolist(), index.stab(10).tolist(), index.stab(20).tolist()
+    ([0, 1, 2], [2], [])
+    >>> index.overlapping(5, 11).tolist()
+    [0, 2]
+    >>> index.overlapping(0, 2).tolist(), index.overlapping(2, 3).tolist(), index.overlapping(20, 30).tolist()
+    ([0], [0, 1], [])
+
+    Dates work too, which is convenient to find the events windows containing given days
+
+    >>> windows = np.array([['2020-01-01', '2020-02-01'], ['2020-01-15', '2020-03-01']], dtype='datetime64[D]')
+    >>> SubintervalIndex(windows).stab(np.datetime64('2020-01-20')).tolist()
+    [0, 1]
+    """
+
+    def __init__(self, intervals):
+        intervals = np.asarray(intervals)
+        if intervals.size == 0:
+            intervals = intervals.reshape(0, 2)
+        lefts, rights = intervals[:, 0], intervals[:, 1]
+        self.bounds = np.unique(np.concatenate([lefts, rights]))
+        n_segments = max(len(self.bounds) - 1, 0)
+
+        # each interval covers the segments [first_segment, end_segment)
+        first_segment = np.searchsorted(self.bounds, lefts)
+        n_covered = np.clip(np.searchsorted(self.bounds, rights) - first_segment, 0, None)
+        ids = np.repeat(np.arange(len(intervals)), n_covered)
+        offsets = np.arange(len(ids)) - np.repeat(np.cumsum(n_covered) - n_covered, n_covered)
+        segments = np.repeat(first_segment, n_covered) + offsets
+
+        order = np.lexsort((ids, segments))
+        self.ids = ids[order]
+        self.indptr = np.concatenate(
+            [[0], np.cumsum(np.bincount(segments, minlength=n_segments))]
+        ).astype(np.int64)
+
+        # the non empty intervals sorted by their left endpoint, for the overlap queries
+        non_empty = np.flatnonzero(lefts < rights)
+        by_left = np.argsort(lefts[non_empty], kind='stable')
+        self._ids_by_left = non_empty[by_left]
+        self._sorted_lefts = lefts[non_empty][by_left]
+
+    @property
+    def n_segments(self):
+        return len(self.indptr) - 1
+
+    def subintervals(self):
+        """The list of (left, right, ids) of the non empty segments, like find_subintervals"""
+        return [
+            (self.bounds[k], self.bounds[k + 1], set(self.ids[self.indptr[k] : self.indptr[k + 1]].tolist()))
+            for k in range(self.n_segments)
+            if self.indptr[k + 1] > self.indptr[k]
+        ]
+
+    def _segment_of(self, points):
+        """Segment containing each point, -1 if none"""
+        segments = np.searchsorted(self.bounds, points, side='right') - 1
+        return np.where((segments >= 0) & (segments < self.n_segments), segments, -1)
+
+    def stab(self, point):
+        """Sorted ids of the intervals containing point"""
+        segment = self._segment_of(point)
+        if segment < 0:
+            return self.ids[:0]
+        return self.ids[self.indptr[segment] : self.indptr[segment + 1]]
+
+    def stab_many(self, points):
+        """
+        The ids of the intervals containing each of the points, as CSR arrays: the ids for points[i] are
+        ids[indptr[i]:indptr[i + 1]]
+
+        >>> indptr, ids = SubintervalIndex([[1, 10], [2, 5]]).stab_many([0, 3, 7])
+        >>> indptr.tolist(), ids.tolist()
+        ([0, 0, 2, 3], [0, 1, 0])
+
+        Empty intervals contain no point
+
+        >>> indptr, ids = SubintervalIndex([[3, 3]]).stab_many([0, 3, 5])
+        >>> indptr.tolist(), ids.tolist()
+        ([0, 0, 0, 0], [])
+        >>> SubintervalIndex([]).stab_many([1])[0].tolist()
+        [0, 0]
+        """
+        points = np.asarray(points)
+        if self.n_segments == 0:
+            return np.zeros(len(points) + 1, dtype=np.int64), self.ids[:0]
+        segments = self._segment_of(points)
+        valid = segments >= 0
+        starts = np.where(valid, self.indptr[segments.clip(min=0)], 0)
+        counts = np.where(valid, self.indptr[segments.clip(min=0) + 1] - starts, 0)
+        indptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        positions = np.repeat(starts - indptr[:-1], counts) + np.arange(indptr[-1])
+        return indptr, self.ids[positions]
+
+    def overlapping(self, left, right):
+        """Sorted ids of the intervals overlapping [left, right)"""
+        if not left < right:
+            return self.ids[:0]
+        # the intervals containing left, and the ones starting after left but before right, are disjoint
+        start = np.searchsorted(self._sorted_lefts, left, side='right')
+        end = np.searchsorted(self._sorted_lefts, right, side='left')
+        starting_inside = self._ids_by_left[start:end]
+        return np.sort(np.concatenate([self.stab(left), starting_inside]))
@@ -0,0 +1,114 @@
+"""
+Event driven backtest of the moving average crossover strategy of backtesting_examples, over bars coming from a
+generator or a chunked file reader. The moving averages are updated incrementally (see incremental_indicators)
+and only a fixed number of bars is kept in memory, so histories too long to fit in RAM can be replayed.
+
+Example of use, replaying the minute closes of a large csv:
+
+    chunks = read_bar_chunks('~/invest/QQQ_1min.csv', column='close')
+    total_A, total_B, n_bars = stream_sma_backtest(chunks, chk_size_1=10, chk_size_2=30)
+"""
+
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from investate.incremental_indicators import MACrossover
+from investate.instrumentation import timed
+from investate.series_utils import grow_and_rebalance
+
+
+def iter_bars(chunks):
+    """
+    Flatten an iterable of chunks (arrays, lists or single values) into the values of the bars
+
+    >>> list(iter_bars([[1, 2], np.array([3.0]), 4]))
+    [1, 2, 3.0, 4]
+    """
+    for chunk in chunks:
+        if np.ndim(chunk) == 0:
+            yield chunk
+        else:
+            yield from np.asarray(chunk).tolist()
+
+
+def read_bar_chunks(path, column='close', chunksize=100000, **read_csv_kwargs):
+    """Read the column of a csv of bars by chunks of chunksize rows, yielding arrays"""
+    for chunk in pd.read_csv(path, usecols=[column], chunksize=chunksize, **read_csv_kwargs):
+        yield chunk[column].to_numpy()
+
+
+def iter_sma_backtest(
+    chunks,
+    chk_size_1,
+    chk_size_2,
+    thres_invest=0.5,
+    thresh_devest=0.5,
+    fees_func_AB=None,
+    initial_investment_A=1,
+    initial_investment_B=0,
+    rate_B=0,
+    decision_lag=None,
+):
+    """
+    Replay the moving average crossover strategy bar by bar, yielding the values (A, B) of the two investments
+    after each bar, starting at bar chk_size_2 - 1 (the first bar of the cut_series of get_comp_ma).
+    A follows the series, B grows at rate_B per bar and the balance between them is rebalanced at the end of each
+    bar according to the invest/devest state of MACrossover.
+
+    By default, the results are identical to the batch path of backtesting_examples (invest_with_sma, then
+    investment_over_period over the cut series with the full invest_period), which applies at bar t the state
+    computed at bar t - chk_size_2: decision_lag lets another lag be used, 0 meaning the state of the bar itself.
+
+    >>> series = [1, 1.6, 2.9, 4.1, 3.2, 2.3, 1.2, 2.2, 3.1, 4.4]
+    >>> values = list(iter_sma_backtest([series[:4], series[4:]], chk_size_1=2, chk_size_2=3))
+    >>> [round(a + b, 4) for a, b in values]
+    [1, 1.4138, 1.1034, 0.7931, 0.7931, 1.454, 1.454, 1.454]
+    """
+
+    if fees_func_AB is None:
+        fees_func_AB = lambda x, y: 0
+    chk_size_1, chk_size_2 = sorted([chk_size_1, chk_size_2])
+    if decision_lag is None:
+        decision_lag = chk_size_2
+
+    crossover = MACrossover(chk_size_1, chk_size_2, thres_invest, thresh_devest)
+    # the states of the last decision_lag + 1 bars, the oldest one being the state to apply
+    states = deque(maxlen=decision_lag + 1)
+    total_A, total_B = initial_investment_A, initial_investment_B
+    previous_value = None
+
+    for t, value in enumerate(iter_bars(chunks)):
+        states.append(crossover.update(value))
+        if t == chk_size_2 - 1:
+            yield total_A, total_B
+        elif t >= chk_size_2:
+            # before decision_lag bars, the state is the warm up state of the strategy: invested
+            end_balance = states[0] if len(states) == decision_lag + 1 else 1
+            total_A, total_B = grow_and_rebalance(
+                total_A,
+                total_B,
+                value / previous_value - 1,
+                rate_B,
+                end_balance,
+                fees_func_AB,
+            )
+            yield total_A, total_B
+        previous_value = value
+
+
+@timed(count_records=lambda values: values[2])
+def stream_sma_backtest(chunks, chk_size_1, chk_size_2, **backtest_kwargs):
+    """
+    Run iter_sma_backtest to the end, keeping only the last values
+
+    :return: the final values of A and B and the number of bars which produced a value
+
+    >>> stream_sma_backtest([[1, 1.6, 2.9, 4.1, 3.2], [2.3, 1.2, 2.2, 3.1, 4.4]], chk_size_1=2, chk_size_2=3)
+    (0.0, 1.4540229885057474, 8)
+    """
+    total_A, total_B, n_bars = np.nan, np.nan, 0
+    for total_A, total_B in iter_sma_backtest(chunks, chk_size_1, chk_size_2, **backtest_kwargs):
+        n_bars += 1
+    return total_A, total_B, n_bars
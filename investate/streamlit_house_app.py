@@ -4,11 +4,15 @@ Little streamlit app to help make decision on whether to invest in real estate v
 
 import streamlit as st
 import pandas as pd
+import numpy as np
+import matplotlib.pyplot as plt
 from investate.real_estate_vs_stock import (
     house_investment,
     compare_house_invest_vs_stock,
     compute_mortg_principal,
+    sensitivity_surface,
 )
+from investate.app_cache import APP_CACHE
 
 st.title('House vs other investment')
 
@@ -38,7 +42,26 @@ stock_market_rate = (
     st.sidebar.number_input('Yearly rate of other investment', value=8) * 0.01
 )
 
-equity, monthly_income = house_investment(
+inputs = dict(
+    mortg_rate=mortg_rate,
+    down_payment_perc=down_payment_perc,
+    house_cost=house_cost,
+    tax=tax,
+    insurance=insurance,
+    repair=repair,
+    estate_rate=estate_rate,
+    mortgage_n_years=mortgage_n_years,
+    n_years_after_pay_off=n_years_after_pay_off,
+    monthly_rental_income=monthly_rental_income,
+    percentage_rented=percentage_rented,
+    inflation_rate=inflation_rate,
+    income_tax=income_tax,
+    management_fees_rate=management_fees_rate,
+    stock_market_rate=stock_market_rate,
+)
+
+
+def house_vs_stock_df(
     mortg_rate,
     down_payment_perc,
     house_cost,
@@ -53,24 +76,118 @@ equity, monthly_income = house_investment(
     inflation_rate,
     income_tax,
     management_fees_rate,
-    plot=False,
-)
+    stock_market_rate,
+):
+    equity, monthly_income = house_investment(
+        mortg_rate,
+        down_payment_perc,
+        house_cost,
+        tax,
+        insurance,
+        repair,
+        estate_rate,
+        mortgage_n_years,
+        n_years_after_pay_off,
+        monthly_rental_income,
+        percentage_rented,
+        inflation_rate,
+        income_tax,
+        management_fees_rate,
+        plot=False,
+    )
 
-df = pd.DataFrame()
-df['equity'] = equity
-df['montlhy_income'] = monthly_income
+    df = pd.DataFrame()
+    df['equity'] = equity
+    df['montlhy_income'] = monthly_income
 
-house_invest, down_payment_invest = compare_house_invest_vs_stock(
-    equity,
-    monthly_income,
-    stock_market_rate=stock_market_rate,
-    down_payment_perc=down_payment_perc,
-    house_cost=house_cost,
-    plot=False,
+    house_invest, down_payment_invest = compare_house_invest_vs_stock(
+        equity,
+        monthly_income,
+        stock_market_rate=stock_market_rate,
+        down_payment_perc=down_payment_perc,
+        house_cost=house_cost,
+        plot=False,
+    )
+    df['house_investment'] = house_invest
+    df['stock_investment'] = down_payment_invest
+    return df
+
+
+def show(df, charts):
+    with charts.container():
+        st.line_chart(df['montlhy_income'])
+        st.line_chart(df['equity'])
+        st.line_chart(df[['house_investment', 'stock_investment']])
+
+
+# identical inputs come straight from the cache, shared by all the sessions
+future = APP_CACHE.submit(
+    ('house_vs_stock_df', *inputs.items()),
+    lambda: house_vs_stock_df(**inputs),
 )
-df['house_investment'] = house_invest
-df['stock_investment'] = down_payment_invest
+charts = st.empty()
+# keep showing the last result of this session while the new one is computed
+if not future.done() and 'house_vs_stock' in st.session_state:
+    show(st.session_state['house_vs_stock'], charts)
+st.session_state['house_vs_stock'] = future.result()
+show(st.session_state['house_vs_stock'], charts)
+
+# the parameters which can be swept in the sensitivity surface, with their label and the default range of their grid
+SENSITIVITY_RANGES = {
+    'mortg_rate': ('Mortgage rate', 0.0, 0.1),
+    'estate_rate': ('Yearly real estate market increase', -0.05, 0.1),
+    'down_payment_perc': ('Down payment percentage', 0.0, 1.0),
+    'stock_market_rate': ('Yearly rate of other investment', 0.0, 0.15),
+    'monthly_rental_income': ('Average monthly rental income', 0.0, 20000.0),
+    'house_cost': ('House price', 50000.0, 1000000.0),
+    'inflation_rate': ('Inflation rate', 0.0, 0.1),
+}
+N_GRID = 41
+
+# the surface is only computed when asked for
+if st.checkbox('Show sensitivity surface'):
+    names = list(SENSITIVITY_RANGES)
+    x_name = st.selectbox('Horizontal parameter', names, index=0)
+    y_name = st.selectbox('Vertical parameter', names, index=1)
+    if x_name == y_name:
+        st.write('Choose two different parameters')
+    else:
+        # the grids are fixed unless the current values fall outside of them, so moving the sliders of the two
+        # parameters within the grids reuses the cached surface
+        grids = {}
+        for name in (x_name, y_name):
+            _, low, high = SENSITIVITY_RANGES[name]
+            grids[name] = (min(low, inputs[name]), max(high, inputs[name]))
+        other_inputs = {
+            name: value for name, value in inputs.items() if name not in (x_name, y_name)
+        }
+        surface_future = APP_CACHE.submit(
+            ('sensitivity_surface', x_name, grids[x_name], y_name, grids[y_name], N_GRID)
+            + tuple(other_inputs.items()),
+            lambda: sensitivity_surface(
+                x_name,
+                np.linspace(*grids[x_name], N_GRID),
+                y_name,
+                np.linspace(*grids[y_name], N_GRID),
+                **other_inputs,
+            ),
+        )
+        surface = surface_future.result()
 
-st.line_chart(df['montlhy_income'])
-st.line_chart(df['equity'])
-st.line_chart(df[['house_investment', 'stock_investment']])
+        fig, ax = plt.subplots(figsize=(8, 6))
+        limit = np.abs(surface).max()
+        image = ax.imshow(
+            surface,
+            origin='lower',
+            aspect='auto',
+            extent=(*grids[x_name], *grids[y_name]),
+            cmap='RdYlGn',
+            vmin=-limit,
+            vmax=limit,
+        )
+        ax.plot(inputs[x_name], inputs[y_name], 'k+', markersize=15, label='current inputs')
+        ax.set_xlabel(SENSITIVITY_RANGES[x_name][0])
+        ax.set_ylabel(SENSITIVITY_RANGES[y_name][0])
+        ax.legend()
+        fig.colorbar(image, label='final house investment minus stock investment')
+        st.pyplot(fig)
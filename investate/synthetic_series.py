@@ -0,0 +1,199 @@
+"""
+Vectorized generators of synthetic price paths, to stress test strategies offline on many more histories than the
+real ones: geometric brownian motion, regime switching, jump diffusion and block bootstrap of historical returns.
+Each generator returns an array of shape (n_paths, n_steps), the first column being the start price s0, in float64
+or float32. generate_in_chunks produces large numbers of paths by chunks of bounded memory.
+
+Example of use:
+
+    paths = gbm_paths(n_paths=1000, n_steps=252, mu=0.0003, sigma=0.01, seed=0)
+    for chunk in generate_in_chunks(jump_diffusion_paths, n_paths=10 ** 6, n_steps=252, jump_intensity=0.01):
+        final_values = chunk[:, -1]
+"""
+
+import numpy as np
+
+
+def _rng(seed):
+    """A numpy Generator from a seed, or the Generator itself"""
+    return seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+
+
+def log_returns_to_paths(log_returns, s0=100.0):
+    """
+    Turn an array of log returns of shape (n_paths, n_steps) into prices, in place: the log return of the first
+    step is ignored so that every path starts at s0
+
+    >>> log_returns_to_paths(np.log([[1.0, 2.0, 0.5]]), s0=10).tolist()
+    [[10.0, 20.0, 10.0]]
+    """
+    log_returns[:, 0] = 0
+    np.cumsum(log_returns, axis=1, out=log_returns)
+    np.exp(log_returns, out=log_returns)
+    log_returns *= s0
+    return log_returns
+
+
+def historical_log_returns(prices):
+    """
+    The log returns of a series of historical prices, typically read from the local cache, to use with
+    block_bootstrap_paths
+
+    >>> historical_log_returns([1, 2, 4]).round(4).tolist()
+    [0.6931, 0.6931]
+    """
+    return np.diff(np.log(np.asarray(prices, dtype=float)))
+
+
+def gbm_paths(n_paths, n_steps, mu=0.0, sigma=0.01, s0=100.0, dtype=np.float64, seed=None):
+    """
+    Geometric brownian motion: the log returns are iid normal with mean mu - sigma ** 2 / 2 and std sigma, mu and
+    sigma being the drift and volatility per step
+
+    >>> paths = gbm_paths(n_paths=3, n_steps=5, seed=0)
+    >>> paths.shape, paths.dtype.name, paths[:, 0].tolist()
+    ((3, 5), 'float64', [100.0, 100.0, 100.0])
+    >>> gbm_paths(2, 4, sigma=0, mu=0.1, dtype=np.float32).dtype.name
+    'float32'
+    """
+    log_returns = _rng(seed).standard_normal((n_paths, n_steps), dtype=dtype)
+    log_returns *= sigma
+    log_returns += mu - sigma ** 2 / 2
+    return log_returns_to_paths(log_returns, s0)
+
+
+def regime_paths(n_steps, transition_matrix, n_paths=1, initial_regime=0, seed=None):
+    """
+    Paths of a markov chain over regimes 0, 1, ..., transition_matrix[i, j] being the probability to go from
+    regime i to regime j from one step to the next. Vectorized over the paths.
+
+    :return: an int array of shape (n_paths, n_steps)
+
+    >>> regime_paths(4, [[0, 1], [1, 0]], n_paths=2).tolist()
+    [[0, 1, 0, 1], [0, 1, 0, 1]]
+    """
+    rng = _rng(seed)
+    cumulative = np.cumsum(np.asarray(transition_matrix, dtype=float), axis=1)
+    n_regimes = cumulative.shape[0]
+    regimes = np.empty((n_paths, n_steps), dtype=np.intp)
+    regimes[:, 0] = initial_regime
+    uniforms = rng.random((n_paths, n_steps))
+    for step in range(1, n_steps):
+        previous = regimes[:, step - 1]
+        # the next regime is the first whose cumulative probability exceeds the uniform draw
+        next_regime = (uniforms[:, step, None] >= cumulative[previous]).sum(axis=1)
+        regimes[:, step] = np.minimum(next_regime, n_regimes - 1)
+    return regimes
+
+
+def regime_switching_paths(
+    n_paths,
+    n_steps,
+    mus=(0.0005, -0.001),
+    sigmas=(0.008, 0.025),
+    transition_matrix=((0.99, 0.01), (0.05, 0.95)),
+    s0=100.0,
+    dtype=np.float64,
+    seed=None,
+):
+    """
+    Geometric brownian motion whose drift and volatility switch between regimes (by default, a calm bull regime and
+    a volatile bear one) following a markov chain, see regime_paths
+
+    >>> paths = regime_switching_paths(n_paths=3, n_steps=10, seed=0)
+    >>> paths.shape, paths[:, 0].tolist()
+    ((3, 10), [100.0, 100.0, 100.0])
+    """
+    rng = _rng(seed)
+    regimes = regime_paths(n_steps, transition_matrix, n_paths, seed=rng)
+    mus, sigmas = np.asarray(mus, dtype=dtype), np.asarray(sigmas, dtype=dtype)
+    log_returns = rng.standard_normal((n_paths, n_steps), dtype=dtype)
+    log_returns *= sigmas[regimes]
+    log_returns += (mus - sigmas ** 2 / 2)[regimes]
+    return log_returns_to_paths(log_returns, s0)
+
+
+def jump_diffusion_paths(
+    n_paths,
+    n_steps,
+    mu=0.0,
+    sigma=0.01,
+    jump_intensity=0.01,
+    jump_mean=-0.05,
+    jump_std=0.05,
+    s0=100.0,
+    dtype=np.float64,
+    seed=None,
+):
+    """
+    Merton jump diffusion: a geometric brownian motion plus, at each step, a poisson number of jumps of intensity
+    jump_intensity, the log size of each jump being normal with mean jump_mean and std jump_std
+
+    >>> paths = jump_diffusion_paths(n_paths=2, n_steps=6, sigma=0, jump_intensity=0, seed=0)
+    >>> paths.tolist()
+    [[100.0, 100.0, 100.0, 100.0, 100.0, 100.0], [100.0, 100.0, 100.0, 100.0, 100.0, 100.0]]
+    """
+    rng = _rng(seed)
+    log_returns = rng.standard_normal((n_paths, n_steps), dtype=dtype)
+    log_returns *= sigma
+    log_returns += mu - sigma ** 2 / 2
+    n_jumps = rng.poisson(jump_intensity, (n_paths, n_steps))
+    jumping = np.nonzero(n_jumps)
+    # the sum of k normal jumps is normal, with k times their mean and variance
+    n = n_jumps[jumping]
+    log_returns[jumping] += jump_mean * n + jump_std * np.sqrt(n) * rng.standard_normal(len(n))
+    return log_returns_to_paths(log_returns, s0)
+
+
+def block_bootstrap_paths(
+    log_returns,
+    n_paths,
+    n_steps,
+    block_size=20,
+    s0=100.0,
+    dtype=np.float64,
+    seed=None,
+):
+    """
+    Paths made of blocks of block_size consecutive historical log returns (see historical_log_returns) drawn at
+    random, which keeps the short term dependencies of the returns, such as volatility clustering
+
+    >>> paths = block_bootstrap_paths(np.log([2.0] * 10), n_paths=2, n_steps=4, block_size=3, s0=1)
+    >>> paths.round(6).tolist()
+    [[1.0, 2.0, 4.0, 8.0], [1.0, 2.0, 4.0, 8.0]]
+    """
+    rng = _rng(seed)
+    log_returns = np.asarray(log_returns, dtype=dtype)
+    block_size = min(block_size, len(log_returns))
+    n_blocks = -(-n_steps // block_size)
+    starts = rng.integers(0, len(log_returns) - block_size + 1, (n_paths, n_blocks))
+    indices = (starts[:, :, None] + np.arange(block_size)).reshape(n_paths, -1)[:, :n_steps]
+    return log_returns_to_paths(log_returns[indices], s0)
+
+
+def generate_in_chunks(
+    generator, n_paths, n_steps, chunk_size=None, max_chunk_bytes=2 ** 26, seed=None, **kwargs
+):
+    """
+    Generate n_paths paths with generator by chunks, so that memory stays bounded whatever the number of paths.
+    Each chunk gets its own independent random stream spawned from seed, so the paths only depend on the seed and
+    the chunk_size.
+
+    :param generator: one of the path generators of this module, such as gbm_paths, or a partial of
+                      block_bootstrap_paths with its log_returns
+    :param chunk_size: the number of paths per chunk, by default as many as fit in max_chunk_bytes
+    :param kwargs: extra arguments of the generator
+    :return: a generator of arrays of shape (chunk_size, n_steps), the last one possibly smaller
+
+    >>> chunks = list(generate_in_chunks(gbm_paths, n_paths=5, n_steps=3, chunk_size=2, seed=0))
+    >>> [chunk.shape for chunk in chunks]
+    [(2, 3), (2, 3), (1, 3)]
+    """
+    if chunk_size is None:
+        itemsize = np.dtype(kwargs.get('dtype', np.float64)).itemsize
+        chunk_size = max(1, max_chunk_bytes // (itemsize * n_steps))
+    n_chunks = -(-n_paths // chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(n_chunks)
+    for chunk_idx, chunk_seed in enumerate(seeds):
+        n = min(chunk_size, n_paths - chunk_idx * chunk_size)
+        yield generator(n, n_steps, seed=np.random.default_rng(chunk_seed), **kwargs)
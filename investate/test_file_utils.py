@@ -0,0 +1,43 @@
+"""Tests for the workbook writers of the module file_utils"""
+
+import pandas as pd
+import pytest
+
+from investate.file_utils import add_frames_to_workbook
+
+
+@pytest.mark.parametrize('write_only', [False, True])
+def test_multiindex_frame_to_workbook(tmp_path, write_only):
+    """Testing that each level of a MultiIndex is written to its own column, with its name as header"""
+    index = pd.MultiIndex.from_tuples([('QQQ', 1), ('SPY', 2)], names=['ticker', 'rank'])
+    dataframe = pd.DataFrame({'close': [300.5, 400.25]}, index=index)
+    filename = tmp_path / 'multiindex.xlsx'
+
+    add_frames_to_workbook(str(filename), {'prices': dataframe}, write_only=write_only)
+
+    written = pd.read_excel(filename, sheet_name='prices')
+    assert written.columns.tolist() == ['ticker', 'rank', 'close']
+    assert written.values.tolist() == [['QQQ', 1, 300.5], ['SPY', 2, 400.25]]
+
+
+@pytest.mark.parametrize('write_only', [False, True])
+def test_tz_aware_frame_to_workbook(tmp_path, write_only):
+    """Testing that tz-aware datetimes, in the index and the values, are written as their naive local time"""
+    dataframe = pd.DataFrame(
+        {
+            'time': pd.date_range('2021-01-04 09:30', periods=2, freq='D', tz='US/Eastern'),
+            'close': [300.5, 301.0],
+        },
+        index=pd.date_range('2021-01-04', periods=2, freq='D', tz='UTC', name='date'),
+    )
+    filename = tmp_path / 'timezones.xlsx'
+
+    add_frames_to_workbook(str(filename), {'prices': dataframe}, write_only=write_only)
+
+    written = pd.read_excel(filename, sheet_name='prices')
+    assert written['date'].tolist() == [pd.Timestamp('2021-01-04'), pd.Timestamp('2021-01-05')]
+    assert written['time'].tolist() == [
+        pd.Timestamp('2021-01-04 09:30'),
+        pd.Timestamp('2021-01-05 09:30'),
+    ]
+    assert written['close'].tolist() == [300.5, 301.0]
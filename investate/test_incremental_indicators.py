@@ -0,0 +1,74 @@
+"""Tests for the NaN handling of the module incremental_indicators, against pandas"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from investate.incremental_indicators import (
+    SMA,
+    EMA,
+    RollingStd,
+    SMABank,
+    EMABank,
+    RollingStdBank,
+)
+
+
+def series_with_gaps(n_values=300, n_symbols=4, seed=0):
+    """Random walks with isolated NaNs and runs of NaNs, at different dates for each symbol"""
+    rng = np.random.default_rng(seed)
+    values = 100 + np.cumsum(rng.normal(0, 1, (n_values, n_symbols)), axis=0)
+    values[rng.random((n_values, n_symbols)) < 0.03] = np.nan
+    values[3, 0] = np.nan
+    values[50:58, 1] = np.nan
+    values[:2, 2] = np.nan
+    return values
+
+
+def assert_same(streamed, expected):
+    streamed, expected = np.asarray(streamed, dtype=float), np.asarray(expected, dtype=float)
+    assert np.array_equal(np.isnan(streamed), np.isnan(expected))
+    assert np.allclose(streamed, expected, equal_nan=True)
+
+
+@pytest.mark.parametrize('chk_size', [1, 3, 5, 20])
+def test_sma_matches_pandas_rolling(chk_size):
+    """Testing that SMA and SMABank are NaN exactly while a NaN is in the window, as pandas rolling"""
+    values = series_with_gaps()
+    expected = pd.DataFrame(values).rolling(chk_size).mean().to_numpy()
+
+    bank = SMABank(values.shape[1], chk_size)
+    assert_same([bank.update(row).copy() for row in values], expected)
+    for symbol in range(values.shape[1]):
+        sma = SMA(chk_size)
+        assert_same([sma.update(value) for value in values[:, symbol]], expected[:, symbol])
+
+
+@pytest.mark.parametrize('chk_size,ddof', [(2, 0), (3, 1), (5, 0), (20, 1)])
+def test_rolling_std_matches_pandas_rolling(chk_size, ddof):
+    """Testing that RollingStd and RollingStdBank recover from NaNs once they leave the window"""
+    values = series_with_gaps()
+    expected = pd.DataFrame(values).rolling(chk_size).std(ddof=ddof).to_numpy()
+
+    bank = RollingStdBank(values.shape[1], chk_size, ddof=ddof)
+    assert_same([bank.update(row).copy() for row in values], expected)
+    for symbol in range(values.shape[1]):
+        rolling_std = RollingStd(chk_size, ddof=ddof)
+        assert_same(
+            [rolling_std.update(value) for value in values[:, symbol]], expected[:, symbol]
+        )
+
+
+@pytest.mark.parametrize('alpha', [0.1, 0.5])
+def test_ema_matches_pandas_ewm(alpha):
+    """Testing that EMA and EMABank skip the NaNs, as pandas ewm with ignore_na=True"""
+    values = series_with_gaps()
+    expected = (
+        pd.DataFrame(values).ewm(alpha=alpha, adjust=False, ignore_na=True).mean().to_numpy()
+    )
+
+    bank = EMABank(values.shape[1], alpha=alpha)
+    assert_same([bank.update(row).copy() for row in values], expected)
+    for symbol in range(values.shape[1]):
+        ema = EMA(alpha=alpha)
+        assert_same([ema.update(value) for value in values[:, symbol]], expected[:, symbol])
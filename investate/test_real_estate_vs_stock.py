@@ -50,3 +50,48 @@ def test_compute_mortg_principal(
     )
 
     assert np.isclose(reg_payment, loan_left_unpaid)
+
+
+@pytest.mark.parametrize(
+    'mortg_rate,down_payment_perc,estate_rate,mortgage_n_years,n_years_after_pay_off,stock_market_rate',
+    [
+        (0.0275, 0.2, 0.04, 15, 10, 0.08),
+        (0, 0.1, 0.03, 30, 5, 0.05),
+        (0.06, 0.5, -0.01, 10, 0, 0.1),
+    ],
+)
+def test_house_vs_stock_final_values(
+    mortg_rate,
+    down_payment_perc,
+    estate_rate,
+    mortgage_n_years,
+    n_years_after_pay_off,
+    stock_market_rate,
+):
+    """Test that the broadcast evaluation agrees with the month by month computation"""
+    equity, monthly_income = house_investment(
+        mortg_rate=mortg_rate,
+        down_payment_perc=down_payment_perc,
+        estate_rate=estate_rate,
+        mortgage_n_years=mortgage_n_years,
+        n_years_after_pay_off=n_years_after_pay_off,
+        plot=False,
+    )
+    house_invest, stock_invest = compare_house_invest_vs_stock(
+        equity,
+        monthly_income,
+        stock_market_rate=stock_market_rate,
+        down_payment_perc=down_payment_perc,
+        plot=False,
+    )
+    final_house, final_stock = house_vs_stock_final_values(
+        mortg_rate=mortg_rate,
+        down_payment_perc=down_payment_perc,
+        estate_rate=estate_rate,
+        mortgage_n_years=mortgage_n_years,
+        n_years_after_pay_off=n_years_after_pay_off,
+        stock_market_rate=stock_market_rate,
+    )
+
+    assert np.isclose(final_house, house_invest[-1])
+    assert np.isclose(final_stock, stock_invest[-1])
@@ -0,0 +1,60 @@
+"""Tests for the module streaming_backtest"""
+
+import numpy as np
+import pytest
+
+from investate.backtesting_examples import get_comp_ma, invest_with_sma
+from investate.series_utils import investment_over_period, values_to_percent_growth
+from investate.streaming_backtest import iter_sma_backtest, stream_sma_backtest
+
+
+def batch_sma_backtest(series, chk_size_1, chk_size_2, fees_func_AB=None):
+    """The whole array path, as in backtesting_examples.parameter_grid_search"""
+    cut_series = get_comp_ma(series, chk_size_1, chk_size_2)['cut_series']
+    invest_period = np.array(list(invest_with_sma(chk_size_1, chk_size_2)(series)))
+    return investment_over_period(
+        period_rates_A=values_to_percent_growth(cut_series),
+        period_rates_B=[0] * len(cut_series),
+        period_end_balance=invest_period,
+        fees_func_AB=fees_func_AB,
+        initial_investment_A=1,
+        initial_investment_B=0,
+    )
+
+
+@pytest.mark.parametrize(
+    'chk_size_1,chk_size_2,n_chunks,fees_func_AB',
+    [
+        (1, 2, 1, None),
+        (3, 8, 7, None),
+        (10, 30, 13, None),
+        (5, 20, 3, lambda a, b: 0.01),
+    ],
+)
+def test_streaming_matches_batch(chk_size_1, chk_size_2, n_chunks, fees_func_AB):
+    """Testing that the streaming backtest gives the values of the batch backtest, whatever the chunking"""
+    series = 100 + np.cumsum(np.random.default_rng(0).normal(0, 1, 1000))
+    val_A, val_B = batch_sma_backtest(series, chk_size_1, chk_size_2, fees_func_AB)
+    streamed = np.array(
+        list(
+            iter_sma_backtest(
+                np.array_split(series, n_chunks),
+                chk_size_1,
+                chk_size_2,
+                fees_func_AB=fees_func_AB,
+            )
+        )
+    )
+    assert np.allclose(streamed[:, 0], val_A)
+    assert np.allclose(streamed[:, 1], val_B)
+
+
+def test_stream_sma_backtest_final_values():
+    """Testing that stream_sma_backtest returns the last values of the batch backtest"""
+    series = 100 + np.cumsum(np.random.default_rng(1).normal(0, 1, 500))
+    val_A, val_B = batch_sma_backtest(series, 4, 12)
+    total_A, total_B, n_bars = stream_sma_backtest(
+        (series[i : i + 64] for i in range(0, len(series), 64)), 4, 12
+    )
+    assert n_bars == len(val_A)
+    assert np.isclose(total_A, val_A[-1]) and np.isclose(total_B, val_B[-1])
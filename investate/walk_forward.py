@@ -0,0 +1,161 @@
+"""
+Walk-forward optimisation of the moving average crossover strategy of backtesting_examples.
+The history is split into rolling train/test folds, every pair of moving average sizes is evaluated on the train
+part (in sample) and on the following test part (out of sample) of each fold, and the out of sample performance
+is aggregated per pair. The (fold, pair) cells are spread over a process pool, the series being put once in shared
+memory rather than pickled for every task.
+
+Example of use:
+
+    results = walk_forward_sma(eth_series, max_chk_size=30, train_size=500, test_size=100)
+    oos_by_pair = out_of_sample_by_pair(results)
+    best_pairs = best_pair_per_fold(results)
+"""
+
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from investate.backtesting_examples import sma_strategy_total
+from investate.instrumentation import timed
+
+RESULT_COLUMNS = [
+    'fold',
+    'chk_size_1',
+    'chk_size_2',
+    'in_sample',
+    'out_of_sample',
+    'out_of_sample_held',
+]
+
+# the series, in the shared memory of the pool, as seen by each worker
+_worker_series = None
+_worker_shm = None
+
+
+def walk_forward_folds(n_values, train_size, test_size, step=None):
+    """
+    Rolling folds over a series of n_values values, each test part following its train part.
+    The folds move by step values, test_size by default so that the test parts do not overlap.
+
+    :return: a list of (train_start, train_end, test_start, test_end), the ends being excluded
+
+    >>> walk_forward_folds(10, train_size=4, test_size=2)
+    [(0, 4, 4, 6), (2, 6, 6, 8), (4, 8, 8, 10)]
+    """
+    step = step or test_size
+    return [
+        (start, start + train_size, start + train_size, start + train_size + test_size)
+        for start in range(0, n_values - train_size - test_size + 1, step)
+    ]
+
+
+def _attach_shared_series(shm_name, shape, dtype):
+    """Pool initializer: view the series in shared memory without copying it"""
+    global _worker_series, _worker_shm
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_series = np.ndarray(shape, dtype=dtype, buffer=_worker_shm.buf)
+
+
+def _evaluate_cells(cells, series=None):
+    """
+    In and out of sample results of a batch of (fold, train_start, train_end, test_start, test_end, chk_size_1,
+    chk_size_2) cells. Out of sample, the strategy is run from chk_size_2 - 1 values before the test part, so that
+    its moving averages are available (from past values only) at the start of the test part.
+    """
+    series = _worker_series if series is None else series
+    results = []
+    for fold, train_start, train_end, test_start, test_end, chk_size_1, chk_size_2 in cells:
+        in_sample, _ = sma_strategy_total(series[train_start:train_end], chk_size_1, chk_size_2)
+        warm_up_start = max(test_start - chk_size_2 + 1, 0)
+        out_of_sample, held = sma_strategy_total(
+            series[warm_up_start:test_end], chk_size_1, chk_size_2
+        )
+        results.append(
+            (fold, chk_size_1, chk_size_2, float(in_sample), float(out_of_sample), float(held))
+        )
+    return results
+
+
+@timed(count_records=len)
+def walk_forward_sma(
+    series,
+    max_chk_size,
+    train_size,
+    test_size,
+    step=None,
+    max_workers=None,
+    cells_per_task=None,
+):
+    """
+    Evaluate every pair of moving average sizes chk_size_1 < chk_size_2 < max_chk_size (the grid of
+    parameter_grid_search) in and out of sample on each of the walk_forward_folds of the series.
+
+    :param series: array like of floats
+    :param max_workers: the number of processes, os.cpu_count() by default. With 1, everything runs in this process
+    :param cells_per_task: the number of (fold, pair) cells sent to a worker at once, chosen to give each worker
+                           a few tasks by default
+    :return: a df with one row per (fold, pair) and the RESULT_COLUMNS, the results being the final values of
+             1 unit invested with the strategy (or simply held for out_of_sample_held)
+
+    >>> series = 100 + np.cumsum(np.random.default_rng(0).normal(0, 1, 120))
+    >>> results = walk_forward_sma(series, max_chk_size=4, train_size=60, test_size=30, max_workers=1)
+    >>> results.shape, results['fold'].unique().tolist()
+    ((6, 6), [0, 1])
+    """
+
+    series = np.ascontiguousarray(series, dtype=float)
+    folds = walk_forward_folds(len(series), train_size, test_size, step)
+    chk_sizes = range(1, max_chk_size)
+    cells = [
+        (fold, *fold_bounds, chk_size_1, chk_size_2)
+        for fold, fold_bounds in enumerate(folds)
+        for chk_size_1 in chk_sizes
+        for chk_size_2 in chk_sizes
+        if chk_size_2 > chk_size_1
+    ]
+    max_workers = max_workers or os.cpu_count()
+
+    if max_workers == 1:
+        results = _evaluate_cells(cells, series)
+    else:
+        cells_per_task = cells_per_task or max(1, len(cells) // (4 * max_workers))
+        batches = [cells[i : i + cells_per_task] for i in range(0, len(cells), cells_per_task)]
+        shm = shared_memory.SharedMemory(create=True, size=max(series.nbytes, 1))
+        try:
+            np.ndarray(series.shape, dtype=series.dtype, buffer=shm.buf)[:] = series
+            with ProcessPoolExecutor(
+                max_workers=max_workers,
+                initializer=_attach_shared_series,
+                initargs=(shm.name, series.shape, series.dtype.str),
+            ) as executor:
+                results = [
+                    result for batch in executor.map(_evaluate_cells, batches) for result in batch
+                ]
+        finally:
+            shm.close()
+            shm.unlink()
+
+    return pd.DataFrame(results, columns=RESULT_COLUMNS)
+
+
+def out_of_sample_by_pair(results):
+    """
+    Aggregate the out of sample results of walk_forward_sma per pair of moving average sizes, sorted from the
+    best mean out of sample result to the worst
+    """
+    by_pair = results.groupby(['chk_size_1', 'chk_size_2'])
+    summary = by_pair['out_of_sample'].agg(['mean', 'median', 'min', 'max', 'count'])
+    summary['mean_held'] = by_pair['out_of_sample_held'].mean()
+    return summary.sort_values('mean', ascending=False)
+
+
+def best_pair_per_fold(results):
+    """
+    The pair with the best in sample result of each fold, with its out of sample result: what walk-forward
+    optimisation would actually have earned
+    """
+    return results.loc[results.groupby('fold')['in_sample'].idxmax()].set_index('fold')